@@ -1,4 +1,8 @@
-import { addMessage, getConversation } from "@/lib/conversation-utils";
+import {
+  addMessage,
+  getConversation,
+  readMessagesSince,
+} from "@/lib/conversation-utils";
 import { NextResponse } from "next/server";
 import type { Message } from "@/types/message";
 
@@ -8,6 +12,19 @@ export async function GET(
 ) {
   try {
     const { id: conversationId } = await params;
+
+    // ?cursor=<n> returns only messages after that byte offset, plus the
+    // cursor for the next poll; start polling with cursor=0
+    const cursorParam = new URL(request.url).searchParams.get("cursor");
+    if (cursorParam !== null) {
+      const cursor = Number(cursorParam);
+      if (!Number.isSafeInteger(cursor) || cursor < 0) {
+        return NextResponse.json({ error: "Invalid cursor" }, { status: 400 });
+      }
+      const page = await readMessagesSince(conversationId, cursor);
+      return NextResponse.json(page);
+    }
+
     const messages = await getConversation(conversationId);
     return NextResponse.json(messages);
   } catch (error) {
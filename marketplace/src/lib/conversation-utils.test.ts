@@ -0,0 +1,101 @@
+import assert from "node:assert/strict";
+import { mkdir, mkdtemp, readFile, rm, writeFile } from "node:fs/promises";
+import { tmpdir } from "node:os";
+import path from "node:path";
+import { after, before, test } from "node:test";
+import type { Message } from "@/types/message";
+
+// Run with `npm test`, which loads this file through jiti
+
+let root: string;
+let directory: string;
+let utils: typeof import("./conversation-utils");
+
+// conversation-utils resolves its directory from the working directory when it
+// is loaded, so move into a scratch tree before importing it
+before(async () => {
+  root = await mkdtemp(path.join(tmpdir(), "conversations-"));
+  directory = path.join(root, "src/data/conversations");
+  await mkdir(directory, { recursive: true });
+  process.chdir(root);
+  utils = await import("./conversation-utils");
+});
+
+after(() => rm(root, { recursive: true, force: true }));
+
+// A conversation as written before the format contract, with "\n" endings
+const LF_CONVERSATION = [
+  "dateTime,content,sender,type,price",
+  "2024-12-15T02:30:32.780Z,Hello,buyer,text,",
+  "2024-12-15T02:30:32.780Z,Hello,seller,text,",
+  "",
+].join("\n");
+
+const NEW_MESSAGES: Message[] = [
+  {
+    dateTime: new Date("2024-12-15T02:31:00.000Z"),
+    sender: "buyer",
+    content: { type: "offer", price: 150 },
+  },
+  {
+    dateTime: new Date("2024-12-15T02:32:00.000Z"),
+    sender: "seller",
+    content: "Could you do $170, given the condition?",
+  },
+];
+
+function contents(messages: Message[]) {
+  return messages.map((message) => message.content);
+}
+
+test("appending to a \\n file keeps its line endings", async () => {
+  const conversationId = "lf-conversation";
+  const filePath = path.join(directory, `${conversationId}.csv`);
+  await writeFile(filePath, LF_CONVERSATION);
+  for (const message of NEW_MESSAGES) {
+    await utils.addMessage(conversationId, message);
+  }
+
+  const data = await readFile(filePath);
+  assert.equal(data.indexOf("\r"), -1);
+
+  const expected = ["Hello", "Hello", ...contents(NEW_MESSAGES)];
+  assert.deepEqual(
+    contents(await utils.getConversation(conversationId)),
+    expected,
+  );
+
+  const page = await utils.readMessagesSince(conversationId);
+  assert.deepEqual(contents(page.messages), expected);
+  assert.equal(page.cursor, data.length);
+
+  // Polling from the end of the original rows returns just the appended ones
+  const since = await utils.readMessagesSince(
+    conversationId,
+    Buffer.byteLength(LF_CONVERSATION),
+  );
+  assert.deepEqual(contents(since.messages), contents(NEW_MESSAGES));
+  assert.equal(since.cursor, data.length);
+});
+
+test("a new conversation uses the contract's delimiter", async () => {
+  const conversationId = await utils.createConversation("listing");
+  for (const message of NEW_MESSAGES) {
+    await utils.addMessage(conversationId, message);
+  }
+
+  const data = await readFile(
+    path.join(directory, `${conversationId}.csv`),
+    "utf-8",
+  );
+  assert.equal(data.split("\r\n").length, 4);
+  assert.equal(data.replaceAll("\r\n", "").indexOf("\n"), -1);
+
+  const expected = contents(NEW_MESSAGES);
+  assert.deepEqual(
+    contents(await utils.getConversation(conversationId)),
+    expected,
+  );
+  const page = await utils.readMessagesSince(conversationId);
+  assert.deepEqual(contents(page.messages), expected);
+});
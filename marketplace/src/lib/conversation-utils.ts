@@ -1,12 +1,26 @@
 import { promises as fs } from "fs";
+import type { FileHandle } from "fs/promises";
 import path from "path";
 import { parse } from "csv-parse/sync";
 import { stringify } from "csv-stringify/sync";
 import { randomUUID } from "crypto";
 import type { Message } from "@/types/message";
+import conversationFormat from "./conversation-format.json";
 
 const CONVERSATIONS_DIR = path.join(process.cwd(), "src/data/conversations");
 
+// Conversation files are append-only CSV, written by this module and by the
+// Python simulators (swarm/conversation_log.py). Both read the columns and
+// record delimiter from conversation-format.json. Rows appended to an existing
+// file keep the delimiter of its header row, so files written with "\n" before
+// the contract do not end up with mixed line endings.
+export const CONVERSATION_COLUMNS = conversationFormat.columns;
+const RECORD_DELIMITER = conversationFormat.recordDelimiter;
+const HEADER = CONVERSATION_COLUMNS.join(",") + RECORD_DELIMITER;
+
+// Upper bound on bytes read per readMessagesSince call
+const DEFAULT_MAX_BYTES = 64 * 1024;
+
 // Ensure conversations directory exists
 async function ensureConversationsDir() {
   try {
@@ -24,96 +38,175 @@ interface CSVMessage {
   price?: string;
 }
 
+export interface ConversationPage {
+  messages: Message[];
+  // Byte offset to pass as the cursor of the next read
+  cursor: number;
+  // The file no longer matched the cursor and was read from the top
+  reset: boolean;
+}
+
+function conversationPath(conversationId: string) {
+  return path.join(CONVERSATIONS_DIR, `${conversationId}.csv`);
+}
+
+function toMessage(record: CSVMessage): Message {
+  const baseMessage = {
+    dateTime: new Date(record.dateTime),
+    sender: record.sender as "buyer" | "seller",
+  };
+
+  if (record.type === "offer") {
+    return {
+      ...baseMessage,
+      content: {
+        type: "offer",
+        price: parseFloat(record.price!),
+      },
+    };
+  } else if (record.type === "accepted") {
+    return {
+      ...baseMessage,
+      content: {
+        type: "accepted",
+        price: parseFloat(record.price!),
+      },
+    };
+  } else {
+    return {
+      ...baseMessage,
+      content: record.content,
+    };
+  }
+}
+
+function toRecord(message: Message): CSVMessage {
+  return {
+    dateTime: message.dateTime.toISOString(),
+    sender: message.sender,
+    type: typeof message.content === "string" ? "text" : message.content.type,
+    content: typeof message.content === "string" ? message.content : "",
+    price:
+      typeof message.content === "string"
+        ? undefined
+        : message.content.price.toString(),
+  };
+}
+
+// Length of `data` up to the end of its last whole record. A newline only
+// ends a record outside quotes, i.e. after an even number of quote characters.
+function completeLength(data: Buffer): number {
+  let end = 0;
+  let quotes = 0;
+  let position = 0;
+  let newline = data.indexOf(0x0a);
+  while (newline !== -1) {
+    for (let i = data.indexOf(0x22, position); i !== -1 && i < newline; ) {
+      quotes++;
+      i = data.indexOf(0x22, i + 1);
+    }
+    position = newline + 1;
+    if (quotes % 2 === 0) end = position;
+    newline = data.indexOf(0x0a, position);
+  }
+  return end;
+}
+
+// Record delimiter of an existing file, from its header row
+async function fileDelimiter(handle: FileHandle): Promise<string> {
+  const head = Buffer.alloc(HEADER.length);
+  const { bytesRead } = await handle.read(head, 0, head.length, 0);
+  const newline = head.subarray(0, bytesRead).indexOf(0x0a);
+  if (newline === -1) return RECORD_DELIMITER;
+  return head[newline - 1] === 0x0d ? "\r\n" : "\n";
+}
+
 export async function createConversation(listingId: string): Promise<string> {
   await ensureConversationsDir();
   const conversationId = randomUUID();
-  const filePath = path.join(CONVERSATIONS_DIR, `${conversationId}.csv`);
-  
+  const filePath = conversationPath(conversationId);
+
   // Create empty CSV with headers
-  const headers = "dateTime,content,sender,type,price\n";
-  await fs.writeFile(filePath, headers);
-  
+  await fs.writeFile(filePath, HEADER);
+
   return conversationId;
 }
 
 export async function getConversation(conversationId: string): Promise<Message[]> {
   try {
-    const filePath = path.join(CONVERSATIONS_DIR, `${conversationId}.csv`);
+    const filePath = conversationPath(conversationId);
     const fileContent = await fs.readFile(filePath, "utf-8");
-    
+
     const records = parse(fileContent, {
       columns: true,
       skip_empty_lines: true,
     }) as CSVMessage[];
 
-    return records.map((record): Message => {
-      const baseMessage = {
-        dateTime: new Date(record.dateTime),
-        sender: record.sender as "buyer" | "seller",
-      };
-
-      if (record.type === "offer") {
-        return {
-          ...baseMessage,
-          content: {
-            type: "offer",
-            price: parseFloat(record.price!),
-          },
-        };
-      } else if (record.type === "accepted") {
-        return {
-          ...baseMessage,
-          content: {
-            type: "accepted",
-            price: parseFloat(record.price!),
-          },
-        };
-      } else {
-        return {
-          ...baseMessage,
-          content: record.content,
-        };
-      }
-    });
+    return records.map(toMessage);
   } catch (error) {
     console.error("Error reading conversation:", error);
     return [];
   }
 }
 
-export async function addMessage(conversationId: string, message: Message): Promise<void> {
-  const filePath = path.join(CONVERSATIONS_DIR, `${conversationId}.csv`);
-  const messages = await getConversation(conversationId);
-  
-  const newRecord: CSVMessage = {
-    dateTime: message.dateTime.toISOString(),
-    sender: message.sender,
-    type: typeof message.content === "string" ? "text" : message.content.type,
-    content: typeof message.content === "string" 
-      ? message.content 
-      : "",
-    price: typeof message.content === "string" 
-      ? undefined 
-      : message.content.price.toString(),
-  };
+// Messages appended after byte offset `cursor`. Reads at most about maxBytes
+// (more only when a single record is larger) and stops at the last whole
+// record, so a row still being written is returned by the next call. Polling
+// with the returned cursor costs O(new messages) rather than O(conversation).
+export async function readMessagesSince(
+  conversationId: string,
+  cursor = 0,
+  maxBytes = DEFAULT_MAX_BYTES,
+): Promise<ConversationPage> {
+  let handle: FileHandle;
+  try {
+    handle = await fs.open(conversationPath(conversationId), "r");
+  } catch (error) {
+    console.error("Error reading conversation:", error);
+    return { messages: [], cursor, reset: false };
+  }
 
-  const allRecords = [...messages.map(msg => {
-    const record: CSVMessage = {
-      dateTime: msg.dateTime.toISOString(),
-      sender: msg.sender,
-      type: typeof msg.content === "string" ? "text" : msg.content.type,
-      content: typeof msg.content === "string" ? msg.content : "",
-      price: typeof msg.content === "string" 
-        ? undefined 
-        : msg.content.price.toString(),
-    };
-    return record;
-  }), newRecord];
-
-  const csv = stringify(allRecords, { 
-    header: true,
-    columns: ["dateTime", "content", "sender", "type", "price"],
-  });
-  
-  await fs.writeFile(filePath, csv);
-} 
\ No newline at end of file
+  try {
+    const { size } = await handle.stat();
+    // A file shorter than the cursor was replaced; start over
+    const reset = cursor > size;
+    const start = reset ? 0 : cursor;
+    let length = Math.min(maxBytes, size - start);
+    let data = Buffer.alloc(0);
+    let end = 0;
+    while (length > 0) {
+      data = Buffer.alloc(length);
+      const { bytesRead } = await handle.read(data, 0, length, start);
+      data = data.subarray(0, bytesRead);
+      end = completeLength(data);
+      if (end > 0 || start + length >= size) break;
+      length = Math.min(length * 2, size - start);
+    }
+
+    const records = parse(data.subarray(0, end), {
+      // Only a read from the top starts with the header row
+      columns: start === 0 ? true : CONVERSATION_COLUMNS,
+      skip_empty_lines: true,
+    }) as CSVMessage[];
+    return { messages: records.map(toMessage), cursor: start + end, reset };
+  } finally {
+    await handle.close();
+  }
+}
+
+// Appends one row instead of rewriting the file, so the cost of a message
+// does not grow with the length of the conversation
+export async function addMessage(conversationId: string, message: Message): Promise<void> {
+  const handle = await fs.open(conversationPath(conversationId), "a+");
+  try {
+    // A conversation without a file yet gets its header with the first row
+    const { size } = await handle.stat();
+    const row = stringify([toRecord(message)], {
+      columns: CONVERSATION_COLUMNS,
+      record_delimiter: size === 0 ? RECORD_DELIMITER : await fileDelimiter(handle),
+    });
+    await handle.write(size === 0 ? HEADER + row : row);
+  } finally {
+    await handle.close();
+  }
+}
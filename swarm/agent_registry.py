@@ -0,0 +1,123 @@
+# Agent definitions shared by every negotiation. Each template pairs an agent
+# whose instructions never change with a short context template for the state
+# that does (prices, offers, user instructions). The Agent is created once and
+# reused, and because the system prompt stays byte-identical across rounds and
+# sessions the provider can serve it from its prompt cache; only the small
+# context message differs between calls.
+
+
+class AgentTemplate:
+    """A static agent plus the template for its per-call context message"""
+
+    def __init__(self, name, instructions, context):
+        self.name = name
+        self.instructions = instructions
+        self.context = context
+        self._agent = None
+
+    @property
+    def agent(self):
+        # Built on first use (importing swarm is deferred until then); a race
+        # only ever creates an identical Agent
+        if self._agent is None:
+            from swarm import Agent
+
+            self._agent = Agent(name=self.name, instructions=self.instructions, tools=[])
+        return self._agent
+
+    def context_message(self, user_instruction="", **state):
+        content = self.context.format(**state)
+        if user_instruction:
+            content += f"\nUser instructions: {user_instruction}"
+        return {"role": "user", "content": content}
+
+    def turn(self, request, user_instruction="", **state):
+        """The shared agent and the messages for one call"""
+        return self.agent, [
+            self.context_message(user_instruction, **state),
+            {"role": "user", "content": request},
+        ]
+
+
+class AgentRegistry:
+    """Agent templates by key"""
+
+    def __init__(self):
+        self._templates = {}
+
+    def register(self, key, name, instructions, context):
+        template = self._templates[key] = AgentTemplate(name, instructions, context)
+        return template
+
+    def __getitem__(self, key):
+        return self._templates[key]
+
+    def __contains__(self, key):
+        return key in self._templates
+
+    def turn(self, key, request, user_instruction="", **state):
+        return self._templates[key].turn(request, user_instruction, **state)
+
+
+AGENTS = AgentRegistry()
+
+AGENTS.register(
+    "verifier",
+    "Product Verification Agent",
+    """Your ONLY task is to verify if this product meets marketplace standards.
+
+        Format your response EXACTLY like this:
+        VERIFICATION: [YES/NO]
+        REASON: [One brief sentence explaining why]
+
+        Do not provide recommendations, steps, or checklists.
+        If no specific concerns are provided, assume the product meets standards.""",
+    "You are verifying this product for the {user_role}.",
+)
+
+AGENTS.register(
+    "buyer",
+    "Buyer Agent",
+    """You are negotiating as the buyer.
+            Your budget and the current price are given in the context message.
+
+            IMPORTANT: Respond in a direct, conversational way.
+            Start with your offer amount and then give a SHORT explanation.
+            Format: "I offer $X because [brief reason]"
+
+            Follow any user instructions in the context message.""",
+    "Budget: ${buyer_budget}\nCurrent price: ${current_price}",
+)
+
+AGENTS.register(
+    "seller",
+    "Seller Agent",
+    """You are negotiating as the seller.
+            Your minimum price and the buyer's offer are given in the context message.
+
+            IMPORTANT: Respond in a direct, conversational way.
+            Use EXACTLY one of these formats:
+            - "ACCEPT: [brief acceptance message]"
+            - "COUNTER: $X [brief reason]"
+            - "REJECT: [brief reason]"
+
+            Follow any user instructions in the context message.""",
+    "Minimum acceptable price: ${seller_min_price}\nCurrent offer: ${buyer_offer}",
+)
+
+AGENTS.register(
+    "seller_batch",
+    "Listing Seller Agent",
+    """You are the seller of a single listing, answering several buyers at once.
+            Your minimum price and each buyer's offer are given in the context message.
+
+            IMPORTANT: Reply with EXACTLY one line per buyer, starting with the
+            buyer's number, in one of these formats:
+            - "N: ACCEPT: [brief acceptance message]"
+            - "N: COUNTER: $X [brief reason]"
+            - "N: REJECT: [brief reason]"
+
+            The item can only be sold once, so accept at most one buyer.
+            Follow any user instructions in the context message.""",
+    "Minimum acceptable price: ${seller_min_price}\n{offers}",
+)
@@ -0,0 +1,126 @@
+import threading
+
+# Rule-based referee for marketplace_negotiation. The orchestrator knows both
+# the buyer's budget and the seller's minimum, so some outcomes are settled
+# before the model has said anything:
+#
+#   no zone     budget < minimum: no offer the buyer may make is acceptable
+#   offer       the buyer's offer already meets the seller's minimum, so the
+#               seller accepts without being asked
+#   converged   the seller's counter is within `epsilon` of the buyer's offer
+#               and inside the budget, so the buyer takes it
+#
+# When the buyer's reply has no parsable offer the arbiter supplies one
+# instead of the round being skipped. Each ruling records how many model calls
+# the negotiation would otherwise have spent reaching the same outcome.
+
+
+class Ruling:
+    """A settled outcome"""
+
+    __slots__ = ("status", "final_price", "reason", "calls_saved")
+
+    def __init__(self, status, final_price, reason, calls_saved):
+        self.status = status
+        self.final_price = final_price
+        self.reason = reason
+        self.calls_saved = calls_saved
+
+    def result(self, rounds):
+        """The negotiation result dict for this ruling"""
+        if self.status:
+            message = f"Deal successfully concluded at ${self.final_price}"
+        else:
+            message = f"Negotiation failed - {self.reason}"
+        return {
+            "status": self.status,
+            "final_price": self.final_price,
+            "message": message,
+            "rounds": rounds,
+            "calls_saved": self.calls_saved,
+        }
+
+    def __repr__(self):
+        return f"Ruling({self.reason!r}, final_price={self.final_price})"
+
+
+class NegotiationArbiter:
+    """Settles determined negotiations and counts the model calls saved"""
+
+    def __init__(self, epsilon=0.02):
+        self.epsilon = epsilon
+        self.calls_saved = 0
+        self.rulings = {"no_zone": 0, "offer": 0, "converged": 0}
+        self.fallback_offers = 0
+        self._lock = threading.Lock()
+
+    def _rule(self, kind, ruling):
+        with self._lock:
+            self.rulings[kind] += 1
+            self.calls_saved += ruling.calls_saved
+        return ruling
+
+    def check_zone(self, buyer_budget, seller_min_price, max_rounds):
+        """No deal is possible when the budget is below the minimum; saves the
+        verification call and every round"""
+        if buyer_budget < seller_min_price:
+            return self._rule(
+                "no_zone",
+                Ruling(
+                    False,
+                    None,
+                    f"budget ${buyer_budget} is below the seller's minimum "
+                    f"${seller_min_price}",
+                    1 + 2 * max_rounds,
+                ),
+            )
+        return None
+
+    def check_offer(self, buyer_offer, seller_min_price):
+        """An offer at or above the minimum is accepted; saves the seller's turn"""
+        if buyer_offer >= seller_min_price:
+            return self._rule(
+                "offer",
+                Ruling(
+                    True,
+                    buyer_offer,
+                    f"offer ${buyer_offer} meets the minimum ${seller_min_price}",
+                    1,
+                ),
+            )
+        return None
+
+    def check_counter(self, buyer_offer, counter_offer, buyer_budget):
+        """A counter within epsilon of the offer and inside the budget is taken;
+        saves the buyer's next offer and the seller's acceptance"""
+        if (
+            counter_offer <= buyer_budget
+            and counter_offer - buyer_offer <= self.epsilon * counter_offer
+        ):
+            return self._rule(
+                "converged",
+                Ruling(
+                    True,
+                    counter_offer,
+                    f"counter ${counter_offer} is within {self.epsilon:.0%} of "
+                    f"the offer ${buyer_offer}",
+                    2,
+                ),
+            )
+        return None
+
+    def fallback_offer(self, current_price, buyer_budget):
+        """Offer to use when the buyer's reply has no parsable amount"""
+        with self._lock:
+            self.fallback_offers += 1
+        if current_price <= buyer_budget:
+            return current_price
+        return min(buyer_budget, int(current_price * 0.9))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls_saved": self.calls_saved,
+                "fallback_offers": self.fallback_offers,
+                **self.rulings,
+            }
@@ -0,0 +1,327 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from functools import partial
+import sys
+import time
+import uuid
+
+from arbiter import NegotiationArbiter
+from checkpoint import BatchCheckpoint, SessionProgress, replay_log
+from client_pool import pool_stats
+from conversation_log import (
+    create_conversation_file,
+    end_conversation,
+    read_conversation,
+)
+from instrumentation import end_session, get_recorder, tags
+from llm_backend import get_backend
+from multi_agent import NegotiationRounds
+from scheduler import BATCH
+
+# Non-interactive batch driver for marketplace_negotiation. Each job is one
+# session; sessions run as coroutines on a single event loop and every blocking
+# backend call is pushed onto a thread pool behind a semaphore, so the number
+# of in-flight LLM requests never exceeds `concurrency`. With a BatchCheckpoint
+# the engine records each session's progress after every round and its result
+# when it ends; running the same checkpoint again skips finished jobs and
+# continues the others from their last completed round.
+
+
+def _unpack_job(job):
+    """Accept either a (product, budget, minimum) tuple or a dict job"""
+    if isinstance(job, dict):
+        return job["product_details"], job["buyer_budget"], job["seller_min_price"]
+    product_details, buyer_budget, seller_min_price = job
+    return product_details, buyer_budget, seller_min_price
+
+
+class BatchNegotiationEngine:
+    """Runs many marketplace negotiations concurrently with a cap on LLM calls"""
+
+    def __init__(
+        self,
+        backend=None,
+        concurrency=16,
+        max_sessions=None,
+        max_rounds=5,
+        user_role="buyer",
+        arbiter=None,
+        speculative=False,
+        checkpoint=None,
+    ):
+        self.backend = backend or get_backend()
+        self.concurrency = concurrency
+        # Sessions mostly wait on the semaphore, so keep a few more of them
+        # alive than there are call slots to avoid idle slots between rounds.
+        self.max_sessions = max_sessions or concurrency * 4
+        self.max_rounds = max_rounds
+        self.user_role = user_role
+        self.arbiter = arbiter
+        # Generate the first buyer offer alongside verification
+        self.speculative = speculative
+        self.discarded_openings = 0
+        self.checkpoint = checkpoint
+        self._semaphore = None
+        self._executor = None
+
+    async def _run_agent(self, agent, messages, temperature=0.7, **labels):
+        """Run one blocking backend call without holding up the event loop
+
+        `labels` tag the call for instrumentation; the context is copied into
+        the worker thread since run_in_executor does not carry it over.
+        """
+        loop = asyncio.get_running_loop()
+        with tags(**labels):
+            context = contextvars.copy_context()
+        async with self._semaphore:
+            completion = await loop.run_in_executor(
+                self._executor,
+                partial(
+                    context.run,
+                    self.backend.run,
+                    agent,
+                    messages,
+                    temperature=temperature,
+                ),
+            )
+        return completion.content
+
+    async def negotiate(
+        self, product_details, buyer_budget, seller_min_price, progress=None
+    ):
+        """Coroutine version of marketplace_negotiation with interactive=False
+
+        A SessionProgress with a conversation id continues that session from
+        its last completed round, appending to the same conversation log.
+        """
+        progress = progress or SessionProgress()
+        if progress.conversation_id is None:
+            progress.conversation_id = str(uuid.uuid4())
+            create_conversation_file(progress.conversation_id)
+            # Saved even if the session fails before its first round, so a
+            # resume finds its log
+            self._checkpoint_progress()
+        conversation_id = progress.conversation_id
+        try:
+            with tags(session=conversation_id, priority=BATCH):
+                return await self._negotiate(
+                    conversation_id,
+                    product_details,
+                    buyer_budget,
+                    seller_min_price,
+                    progress,
+                )
+        finally:
+            end_conversation(conversation_id)
+            end_session(conversation_id)
+
+    async def _negotiate(
+        self, conversation_id, product_details, buyer_budget, seller_min_price, progress
+    ):
+        rounds = NegotiationRounds(
+            conversation_id,
+            product_details,
+            buyer_budget,
+            seller_min_price,
+            user_role=self.user_role,
+            max_rounds=self.max_rounds,
+            arbiter=self.arbiter,
+            speculative=self.speculative,
+            progress=progress,
+            on_progress=self._checkpoint_progress,
+        )
+        steps = rounds.steps()
+        replies = None
+        while True:
+            try:
+                calls = steps.send(replies)
+            except StopIteration as stop:
+                result = stop.value
+                break
+            replies = await asyncio.gather(
+                *(
+                    self._run_agent(
+                        call.agent, call.messages, call.temperature, **call.labels
+                    )
+                    for call in calls
+                )
+            )
+        if rounds.discarded_opening:
+            self.discarded_openings += 1
+        return result
+
+    def _checkpoint_progress(self):
+        if self.checkpoint is not None:
+            self.checkpoint.update()
+
+    async def _negotiate_job(self, index, job):
+        start = time.perf_counter()
+        checkpoint = self.checkpoint
+        progress = checkpoint.session(index) if checkpoint is not None else None
+        try:
+            result = None
+            if progress is not None and progress.resumed and progress.conversation_id:
+                # Rounds logged after the last save are taken from the log
+                progress.resumed = False
+                result = replay_log(
+                    progress,
+                    read_conversation(progress.conversation_id),
+                    self.max_rounds,
+                )
+            if result is None:
+                result = await self.negotiate(*_unpack_job(job), progress=progress)
+        except Exception as e:
+            # One broken session must not take the rest of the batch down. It
+            # stays in flight in the checkpoint, so a resume retries it.
+            result = {
+                "status": False,
+                "final_price": None,
+                "message": f"Negotiation error - {e}",
+                "rounds": 0,
+                "latency": time.perf_counter() - start,
+            }
+            return index, result
+        result["latency"] = time.perf_counter() - start
+        if checkpoint is not None:
+            checkpoint.finish(index, result)
+        return index, result
+
+    async def stream(self, jobs):
+        """Yield (job index, result) pairs in completion order
+
+        With a checkpoint, jobs it already has results for are yielded first,
+        without running them.
+        """
+        checkpoint = self.checkpoint
+        if checkpoint is not None:
+            jobs = [_unpack_job(job) for job in jobs]
+            checkpoint.begin(jobs)
+            for index, result in sorted(checkpoint.results.items()):
+                yield index, result
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        pending = set()
+        try:
+            for index, job in enumerate(jobs):
+                if checkpoint is not None and index in checkpoint.results:
+                    continue
+                if len(pending) >= self.max_sessions:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        yield task.result()
+                pending.add(asyncio.create_task(self._negotiate_job(index, job)))
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            if checkpoint is not None:
+                checkpoint.save()
+
+    async def run(self, jobs):
+        """Run every job and return the results in job order"""
+        results = {}
+        async for index, result in self.stream(jobs):
+            results[index] = result
+        return [results[index] for index in range(len(results))]
+
+
+def run_batch(jobs, concurrency=16, **kwargs):
+    """Blocking helper running a whole batch and returning results in order"""
+    engine = BatchNegotiationEngine(concurrency=concurrency, **kwargs)
+    return asyncio.run(engine.run(jobs))
+
+
+def resume_batch(path, concurrency=16, **kwargs):
+    """Finish the batch checkpointed at `path` and return all of its results
+
+    Finished jobs are not rerun, and in-flight sessions continue from their
+    last completed round in their existing conversation logs.
+    """
+    checkpoint = BatchCheckpoint(path)
+    if checkpoint.jobs is None:
+        raise FileNotFoundError(f"No checkpoint at {path}")
+    return run_batch(
+        checkpoint.jobs, concurrency=concurrency, checkpoint=checkpoint, **kwargs
+    )
+
+
+if __name__ == "__main__":
+    product_details = {
+        "name": "Victorian Sofa",
+        "description": "1960s Vintage British Sofa",
+        "condition": "Excellent",
+        "price": 1000,
+        "category": "Furniture",
+    }
+    jobs = [
+        (product_details, budget, 800) for budget in range(700, 1000, 50)
+    ]
+
+    # --max-price=<n> / --location=<city> fan out over matching catalog
+    # listings instead of the sofa budgets
+    filters = {}
+    for arg in sys.argv[1:]:
+        if arg.startswith("--max-price="):
+            filters["max_price"] = float(arg.split("=", 1)[1])
+        elif arg.startswith("--location="):
+            filters["location"] = arg.split("=", 1)[1]
+    if filters:
+        from listing_store import get_store, negotiation_jobs
+
+        jobs = negotiation_jobs(get_store().query(**filters))
+        print(f"{len(jobs)} listings match {filters}")
+
+    # --checkpoint=<path> saves progress there; if the file already exists the
+    # batch it holds is resumed instead
+    checkpoint = None
+    for arg in sys.argv[1:]:
+        if arg.startswith("--checkpoint="):
+            checkpoint = BatchCheckpoint(arg.split("=", 1)[1])
+            if checkpoint.jobs is not None:
+                jobs = checkpoint.jobs
+                print(
+                    f"Resuming {len(checkpoint.pending())} of {len(jobs)} jobs "
+                    f"from {checkpoint.path}"
+                )
+
+    # --arbiter settles determined outcomes without the model
+    arbiter = NegotiationArbiter() if "--arbiter" in sys.argv else None
+
+    async def main():
+        engine = BatchNegotiationEngine(
+            concurrency=4, arbiter=arbiter, checkpoint=checkpoint
+        )
+        async for index, result in engine.stream(jobs):
+            product, budget, _ = jobs[index]
+            print(f"[{index}] {product['name']}, budget ${budget}: {result['message']}")
+
+    asyncio.run(main())
+    if arbiter:
+        stats = arbiter.stats()
+        print(
+            f"Arbiter saved {stats['calls_saved']} model calls "
+            f"(no zone {stats['no_zone']}, offer {stats['offer']}, "
+            f"converged {stats['converged']}, fallback offers {stats['fallback_offers']})"
+        )
+    for stats in pool_stats():
+        print(
+            f"Client pool: {stats['created']}/{stats['size']} clients, "
+            f"{stats['leases']} leases ({stats['reused']} reused), peak "
+            f"{stats['peak_in_use']} in use, {stats['waits']} waits, "
+            f"utilisation {stats['utilisation']:.0%}"
+        )
+    for row in get_recorder().summary():
+        print(
+            f"{row['stage']:>12} {row['role']:<8} {row['calls']:>4} calls "
+            f"({row['cache_hits']} cached)  p50 {row['latency_p50']}s  "
+            f"tokens {row['prompt_tokens']}/{row['completion_tokens']}  ${row['cost']:.4f}"
+        )
@@ -0,0 +1,449 @@
+import argparse
+from contextlib import redirect_stdout
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from conversation_log import ConversationLogWriter, set_writer
+from instrumentation import InstrumentedBackend, Recorder, set_recorder
+from llm_backend import FakeBackend, set_backend
+from model_router import ROUTING_POLICIES, RoutedBackend
+
+# Reproducible benchmark of the two orchestrators against the offline fake
+# model. A seed fixes a list of scenarios (product, listed price, buyer budget,
+# seller minimum); every driver runs all of them and reports wall time,
+# Python-side overhead per round (wall time minus simulated model time),
+# prompt/completion tokens, the tracemalloc high-water mark, conversation log
+# I/O and deal outcomes. Each run is appended to a JSONL history and compared
+# with the previous run of the same driver and scenario set, so regressions
+# show up as flagged rows. With --routing every driver also runs once per
+# model_router policy, and each policy's latency and cost are reported against
+# the first one.
+
+HISTORY_PATH = os.getenv("BENCHMARK_HISTORY", "benchmark_history.jsonl")
+
+PRODUCTS = [
+    ("Victorian Sofa", "1960s Vintage British Sofa", 1000),
+    ("Vintage Mechanical Keyboard", "IBM Model M from 1989, all keys work", 180),
+    ("Mountain Bike", "Trek mountain bike, barely used", 850),
+    ("Gaming Console", "PS5 with two controllers and 3 games", 450),
+    ("Vintage Camera", "Film camera in excellent condition", 300),
+]
+
+# Modules a CLI run or a spawned pool worker starts from, and the SDKs that
+# should only be imported once a model is actually called
+STARTUP_MODULES = (
+    "message_parser",
+    "multi_agent",
+    "multi_sim",
+    "batch_negotiation",
+    "sweep",
+)
+SDK_MODULES = ("openai", "swarm", "dotenv", "httpx")
+
+# Latency the fake model gives each model relative to the default one when
+# routing policies are compared; rough stand-ins, not measurements
+ROUTING_LATENCY = {"gpt-4": 1.0, "gpt-4o": 0.5, "gpt-4o-mini": 0.3}
+
+# Relative increase over the previous run that counts as a regression
+REGRESSION_THRESHOLD = 0.10
+# Metrics where larger is worse
+_COST_METRICS = (
+    "overhead_per_round_ms",
+    "prompt_tokens_per_deal",
+    "calls_per_deal",
+    "cost_per_deal",
+    "peak_memory_kb",
+    "log_writes",
+)
+
+
+def scenarios(seed=0, count=20):
+    """Seeded (name, description, price, budget, minimum) scenarios"""
+    rng = random.Random(seed)
+    result = []
+    for _ in range(count):
+        name, description, price = rng.choice(PRODUCTS)
+        minimum = round(price * rng.uniform(0.7, 0.9))
+        budget = round(price * rng.uniform(0.75, 1.0))
+        result.append((name, description, price, budget, minimum))
+    return result
+
+
+def _multi_agent_driver():
+    from multi_agent import marketplace_negotiation
+
+    def run(name, description, price, budget, minimum):
+        product_details = {"name": name, "description": description, "price": price}
+        with redirect_stdout(io.StringIO()):
+            result = marketplace_negotiation(
+                product_details, budget, minimum, interactive=False
+            )
+        return result["status"], result["final_price"], result["rounds"]
+
+    return run
+
+
+def _multi_sim_driver(history):
+    import multi_sim
+    from headless import run_headless
+
+    def run(name, description, price, budget, minimum):
+        # multi_sim negotiates over its module-level ITEM; its prompts use
+        # neither the buyer's budget nor the seller's minimum
+        item = multi_sim.ITEM
+        multi_sim.ITEM = {
+            "name": name,
+            "condition": "Used",
+            "original_price": price,
+            "listing_price": price,
+            "description": description,
+            "minimum_acceptable_price": minimum,
+        }
+        try:
+            result = run_headless(role="seller", history=history)
+        finally:
+            multi_sim.ITEM = item
+        return result.deal_made, result.final_price, result.rounds
+
+    return run
+
+
+DRIVERS = {
+    "multi_agent": _multi_agent_driver,
+    "multi_sim_full": lambda: _multi_sim_driver("full"),
+    "multi_sim_summary": lambda: _multi_sim_driver("summary"),
+}
+# Drivers that run the scenarios without their budget and minimum, so their
+# deal rates and prices are not comparable with multi_agent's
+UNBOUNDED_DRIVERS = ("multi_sim_full", "multi_sim_summary")
+
+
+def _os_writes():
+    """Write syscalls of this process so far (Linux only)"""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("syscw:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def run_driver(name, cases, fake, latency):
+    """Run every scenario through one driver and collect its metrics"""
+    run = DRIVERS[name]()
+    recorder = Recorder()
+    set_recorder(recorder)
+    with tempfile.TemporaryDirectory() as directory:
+        writer = ConversationLogWriter(directory)
+        set_writer(writer)
+        model_seconds = fake.model_seconds
+        os_writes = _os_writes()
+        tracemalloc.start()
+        start = time.perf_counter()
+        outcomes = [run(*case) for case in cases]
+        wall = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        writer.close()
+        after = _os_writes()
+
+    model_seconds = fake.model_seconds - model_seconds
+    calls = recorder.summary()
+    prompt_tokens = sum(row["prompt_tokens"] for row in calls)
+    completion_tokens = sum(row["completion_tokens"] for row in calls)
+    call_count = sum(row["calls"] for row in calls)
+    cost = sum(row["cost"] for row in calls)
+    deals = [price for deal, price, _ in outcomes if deal]
+    rounds = sum(rounds for _, _, rounds in outcomes)
+    closed = len(deals) or 1
+    return {
+        "driver": name,
+        "scenarios": len(cases),
+        "latency": latency,
+        "wall_seconds": round(wall, 4),
+        "model_seconds": round(model_seconds, 4),
+        "overhead_per_round_ms": round(
+            (wall - model_seconds) / max(rounds, 1) * 1e3, 4
+        ),
+        "calls": call_count,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "deals": len(deals),
+        "deal_rate": round(len(deals) / len(cases), 4),
+        "mean_final_price": round(sum(deals) / len(deals), 2) if deals else None,
+        "mean_rounds": round(rounds / len(cases), 3),
+        "calls_per_deal": round(call_count / closed, 3),
+        "prompt_tokens_per_deal": round(prompt_tokens / closed, 1),
+        "cost": round(cost, 6),
+        "cost_per_deal": round(cost / closed, 6),
+        "peak_memory_kb": round(peak / 1024, 1),
+        "log_writes": writer.flushes,
+        "log_rows": writer.rows,
+        "log_opens": writer.opens,
+        "os_writes": after - os_writes if after is not None else None,
+    }
+
+
+def import_profile(modules=STARTUP_MODULES, repeat=3):
+    """Cold-start cost of importing each module in a fresh interpreter
+
+    Uses -X importtime; reports the best cumulative import time of the module
+    over `repeat` runs, the process wall time, and which SDK modules the
+    import pulled in.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    path = os.pathsep.join(filter(None, [directory, os.getenv("PYTHONPATH")]))
+    # Prints which of the SDK modules (passed as arguments) ended up imported
+    probe = (
+        "import json, sys; "
+        "print(json.dumps(sorted(set(sys.argv[1:]) & set(sys.modules))))"
+    )
+    rows = []
+    for module in modules:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            proc = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", f"import {module}; {probe}"]
+                + list(SDK_MODULES),
+                capture_output=True,
+                text=True,
+                cwd=directory,
+                env={**os.environ, "PYTHONPATH": path},
+            )
+            wall = time.perf_counter() - start
+            if proc.returncode:
+                raise RuntimeError(f"importing {module} failed:\n{proc.stderr}")
+            cumulative = None
+            for line in proc.stderr.splitlines():
+                fields = line.split("|")
+                if len(fields) == 3 and fields[2].strip() == module:
+                    cumulative = int(fields[1]) / 1e3
+            if best is None or cumulative < best[0]:
+                best = (cumulative, wall, json.loads(proc.stdout.splitlines()[-1]))
+        rows.append(
+            {
+                "module": module,
+                "import_ms": round(best[0], 2),
+                "process_ms": round(best[1] * 1e3, 1),
+                "sdk_loaded": best[2],
+            }
+        )
+    return rows
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_runs(path, seed, count, latency):
+    """Latest recorded metrics per (driver, routing policy) for the same
+    scenario set"""
+    latest = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                if (record["seed"], record["scenarios"], record["latency"]) == (
+                    seed,
+                    count,
+                    latency,
+                ):
+                    latest[record["driver"], record.get("routing")] = record
+    return latest
+
+
+def regressions(current, previous):
+    """Metrics that got worse than REGRESSION_THRESHOLD, or a lower deal rate"""
+    flagged = []
+    for metric in _COST_METRICS:
+        before, after = previous.get(metric), current.get(metric)
+        limit = before * (1 + REGRESSION_THRESHOLD) if before else None
+        if limit is not None and after is not None and after > limit:
+            flagged.append(f"{metric} {before} -> {after}")
+    if current["deal_rate"] < previous.get("deal_rate", 0):
+        flagged.append(f"deal_rate {previous['deal_rate']} -> {current['deal_rate']}")
+    return flagged
+
+
+def run_benchmark(
+    drivers=None, seed=0, count=20, latency=0.0, history=HISTORY_PATH, routing=None
+):
+    """Run the drivers over the seeded scenarios, record and compare results
+
+    `routing` lists model_router policies to run every driver under; the
+    fake model is then slower or faster per model by ROUTING_LATENCY.
+    """
+    fake = FakeBackend(
+        latency=latency, seed=seed, model_latency=ROUTING_LATENCY if routing else None
+    )
+    cases = scenarios(seed, count)
+    previous = previous_runs(history, seed, count, latency) if history else {}
+    stamp = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "seed": seed,
+    }
+
+    results = []
+    for name in drivers or DRIVERS:
+        for policy in routing or [None]:
+            # No response cache or scheduler: every call reaches the fake
+            backend = InstrumentedBackend(fake)
+            if policy:
+                backend = RoutedBackend(backend, policy)
+            set_backend(backend)
+            metrics = run_driver(name, cases, fake, latency)
+            if policy:
+                metrics["routing"] = policy
+                metrics["escalations"] = sum(backend.escalations.values())
+            metrics["regressions"] = regressions(
+                metrics, previous.get((name, policy), {})
+            )
+            results.append(metrics)
+            if history:
+                with open(history, "a") as f:
+                    f.write(json.dumps({**stamp, **metrics}) + "\n")
+    return results
+
+
+def routing_deltas(results):
+    """Wall time and cost change of each routing policy against the first
+    policy run for the same driver"""
+    baselines = {}
+    deltas = []
+    for metrics in results:
+        if "routing" not in metrics:
+            continue
+        baseline = baselines.setdefault(metrics["driver"], metrics)
+        if baseline is metrics:
+            continue
+        deltas.append(
+            {
+                "driver": metrics["driver"],
+                "routing": metrics["routing"],
+                "baseline": baseline["routing"],
+                "wall": _change(baseline["wall_seconds"], metrics["wall_seconds"]),
+                "model_seconds": _change(
+                    baseline["model_seconds"], metrics["model_seconds"]
+                ),
+                "cost_per_deal": _change(
+                    baseline["cost_per_deal"], metrics["cost_per_deal"]
+                ),
+                "deal_rate": metrics["deal_rate"] - baseline["deal_rate"],
+                "escalations": metrics["escalations"],
+            }
+        )
+    return deltas
+
+
+def _change(before, after):
+    return (after - before) / before if before else 0.0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the negotiation drivers")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenarios", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--driver", action="append", choices=list(DRIVERS))
+    parser.add_argument("--history", default=HISTORY_PATH)
+    parser.add_argument("--no-history", action="store_true")
+    parser.add_argument(
+        "--routing",
+        action="append",
+        choices=list(ROUTING_POLICIES),
+        help="run every driver under these model routing policies and compare "
+        "them with the first one given",
+    )
+    parser.add_argument(
+        "--imports",
+        action="store_true",
+        help="profile cold-start import time of the simulator modules instead",
+    )
+    args = parser.parse_args()
+
+    if args.imports:
+        print(f"{'module':<18} {'import ms':>9} {'process ms':>10}  SDKs loaded")
+        for row in import_profile():
+            print(
+                f"{row['module']:<18} {row['import_ms']:>9.2f} "
+                f"{row['process_ms']:>10.1f}  {', '.join(row['sdk_loaded']) or '-'}"
+            )
+        sys.exit(0)
+
+    results = run_benchmark(
+        args.driver,
+        args.seed,
+        args.scenarios,
+        args.latency,
+        None if args.no_history else args.history,
+        args.routing,
+    )
+    columns = (
+        ("deal_rate", "{:>6.0%}"),
+        ("mean_rounds", "{:>6.2f}"),
+        ("calls_per_deal", "{:>7.2f}"),
+        ("cost_per_deal", "{:>8.4f}"),
+        ("prompt_tokens_per_deal", "{:>8.0f}"),
+        ("completion_tokens", "{:>7}"),
+        ("wall_seconds", "{:>8.3f}"),
+        ("overhead_per_round_ms", "{:>8.3f}"),
+        ("peak_memory_kb", "{:>9.1f}"),
+        ("log_writes", "{:>6}"),
+    )
+    print(
+        f"{'driver':<26} {'deals':>6} {'rounds':>6} {'calls/d':>7} {'$/deal':>8} "
+        f"{'tok/d':>8} {'compl':>7} {'wall s':>8} {'ms/rnd':>8} {'peak KB':>9} "
+        f"{'writes':>6}"
+    )
+    for metrics in results:
+        label = metrics["driver"]
+        if "routing" in metrics:
+            label += f"/{metrics['routing']}"
+        print(
+            f"{label:<26} "
+            + " ".join(fmt.format(metrics[key]) for key, fmt in columns)
+        )
+        for flag in metrics["regressions"]:
+            print(f"  ⚠️  regression: {flag}")
+    unbounded = sorted(
+        {metrics["driver"] for metrics in results} & set(UNBOUNDED_DRIVERS)
+    )
+    if unbounded:
+        print(
+            f"Note: {', '.join(unbounded)} ignore the scenario budget and seller "
+            "minimum (multi_sim negotiates from the listed price alone)"
+        )
+
+    deltas = routing_deltas(results)
+    if deltas:
+        print(f"\nRouting policies against {deltas[0]['baseline']}:")
+        for delta in deltas:
+            print(
+                f"  {delta['driver'] + '/' + delta['routing']:<26} "
+                f"wall {delta['wall']:+.0%}  model time {delta['model_seconds']:+.0%}  "
+                f"$/deal {delta['cost_per_deal']:+.0%}  "
+                f"deal rate {delta['deal_rate']:+.0%}  "
+                f"{delta['escalations']} escalations"
+            )
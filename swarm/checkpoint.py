@@ -0,0 +1,212 @@
+import json
+import os
+import time
+
+from conversation_log import get_writer
+from message_parser import REJECTED, classify_message
+from session_state import from_cents, to_cents
+
+# Checkpoints for long batches. A BatchCheckpoint keeps, per job, either its
+# finished result or the progress of its session (conversation id, whether it
+# passed verification, rounds completed, current price, and an offer already
+# logged but not yet answered). It is rewritten atomically (temp file, fsync,
+# rename) at most every `interval` seconds and when the batch stops, so a
+# restart after a deploy or an OOM kill picks the batch up where it was. The
+# conversation log is written ahead of the checkpoint and is replayed on
+# resume, so rounds that finished after the last save are not paid for twice.
+
+CHECKPOINT_INTERVAL = float(os.getenv("CHECKPOINT_INTERVAL", "5"))
+
+
+class SessionProgress:
+    """Serialisable state of one in-flight negotiation"""
+
+    __slots__ = (
+        "conversation_id",
+        "verified",
+        "round",
+        "current_price",
+        "pending_offer",
+        "resumed",
+    )
+
+    def __init__(
+        self,
+        conversation_id=None,
+        verified=False,
+        round=0,
+        current_price=None,
+        pending_offer=None,
+        resumed=False,
+    ):
+        self.conversation_id = conversation_id
+        self.verified = verified
+        # Rounds completed so far; the next one to run
+        self.round = round
+        self.current_price = current_price
+        self.pending_offer = pending_offer
+        self.resumed = resumed
+
+    def to_dict(self):
+        return {
+            "conversation_id": self.conversation_id,
+            "verified": self.verified,
+            "round": self.round,
+            "current_price": self.current_price,
+            "pending_offer": self.pending_offer,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(resumed=True, **data)
+
+    def __repr__(self):
+        return (
+            f"SessionProgress({self.conversation_id}, round {self.round}, "
+            f"${self.current_price})"
+        )
+
+
+def _price(value):
+    """Dollar amount of a CSV price cell"""
+    return from_cents(to_cents(float(value))) if value else None
+
+
+def replay_log(progress, messages, max_rounds):
+    """Bring `progress` up to date with the logged `messages` of its session
+
+    Returns the session's result if the log shows it already ended, else None.
+    A log that is behind the checkpoint (rows lost from a buffered writer)
+    leaves the checkpointed progress as it is.
+    """
+    if len(messages) < 2:
+        return None
+    # The greetings are only logged once verification has passed
+    rounds, current_price, pending_offer, verdict = 0, None, None, None
+    for message in messages[2:]:
+        price = _price(message.get("price"))
+        if message.get("type") == "accepted":
+            # The seller accepts the offer of a round still open; the buyer
+            # accepts a counter (the arbiter's converged ruling) whose row
+            # has already closed the round
+            if message["sender"] == "seller":
+                rounds += 1
+            return {
+                "status": True,
+                "final_price": price,
+                "message": f"Deal successfully concluded at ${price}",
+                "rounds": rounds,
+            }
+        if message["sender"] == "buyer":
+            if message.get("type") == "offer":
+                pending_offer = price
+            else:
+                # No offer in the buyer's message: the round was skipped
+                rounds += 1
+            continue
+        verdict, counter_offer = classify_message(message["content"], last_price=False)
+        if verdict != REJECTED and counter_offer:
+            current_price = counter_offer
+        rounds += 1
+        pending_offer = None
+
+    if rounds < progress.round:
+        return None
+    if rounds >= max_rounds:
+        reason = "maximum rounds" if verdict == REJECTED else "no agreement"
+        return {
+            "status": False,
+            "final_price": None,
+            "message": f"Negotiation failed - {reason} reached",
+            "rounds": rounds,
+        }
+    progress.verified = True
+    progress.round = rounds
+    if current_price is not None:
+        progress.current_price = current_price
+    progress.pending_offer = pending_offer
+    return None
+
+
+class BatchCheckpoint:
+    """Jobs, finished results and in-flight sessions of one batch, on disk"""
+
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.jobs = None
+        self.results = {}
+        self.sessions = {}
+        self.saves = 0
+        self._dirty = False
+        self._last_save = time.monotonic()
+        if os.path.exists(path):
+            self.load()
+
+    def load(self):
+        with open(self.path) as f:
+            data = json.load(f)
+        self.jobs = [tuple(job) for job in data["jobs"]]
+        self.results = {
+            int(index): result for index, result in data["results"].items()
+        }
+        self.sessions = {
+            int(index): SessionProgress.from_dict(progress)
+            for index, progress in data["sessions"].items()
+        }
+
+    def begin(self, jobs):
+        """Record the batch's jobs, or check them against the loaded ones"""
+        if self.jobs is None:
+            self.jobs = [tuple(job) for job in jobs]
+            self._dirty = True
+            self.save()
+        elif len(self.jobs) != len(jobs):
+            raise ValueError(
+                f"Checkpoint {self.path} is for a batch of {len(self.jobs)} jobs, "
+                f"not {len(jobs)}"
+            )
+
+    def pending(self):
+        """Indices of the jobs without a result yet"""
+        return [index for index in range(len(self.jobs)) if index not in self.results]
+
+    def session(self, index):
+        """Progress of job `index`, created on first use"""
+        progress = self.sessions.get(index)
+        if progress is None:
+            progress = self.sessions[index] = SessionProgress()
+        return progress
+
+    def finish(self, index, result):
+        self.results[index] = result
+        self.sessions.pop(index, None)
+        self.update()
+
+    def update(self):
+        """Note a change; saves once `interval` seconds have passed since the last"""
+        self._dirty = True
+        if time.monotonic() - self._last_save >= self.interval:
+            self.save()
+
+    def save(self):
+        if not self._dirty:
+            return
+        # Log rows go out first so the log is never behind the checkpoint
+        get_writer().flush()
+        data = {
+            "jobs": self.jobs,
+            "results": self.results,
+            "sessions": {
+                index: progress.to_dict() for index, progress in self.sessions.items()
+            },
+        }
+        temp = f"{self.path}.tmp"
+        with open(temp, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.path)
+        self.saves += 1
+        self._dirty = False
+        self._last_save = time.monotonic()
@@ -0,0 +1,154 @@
+from contextlib import contextmanager
+import threading
+import time
+import weakref
+
+# Bounded pool of provider clients for one process. Each client keeps its own
+# keep-alive HTTP connections, so handing the most recently returned client to
+# the next caller reuses a warm connection instead of opening (and TLS
+# handshaking) a new one per session. A lease is exclusive: at most `size`
+# calls are in flight per pool, and callers beyond that wait for a client to
+# come back. Pools are per process; forked workers must build their own (the
+# sweep does, by resetting the backend in every worker).
+
+_pools = weakref.WeakSet()
+
+
+class ClientPool:
+    """Up to `size` clients built lazily by `factory`, leased one call at a time"""
+
+    def __init__(self, factory, size=16):
+        self.factory = factory
+        self.size = size
+        self.created = 0
+        self.leases = 0
+        self.waits = 0
+        self.waited = 0.0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.busy_seconds = 0.0
+        self._idle = []
+        self._cond = threading.Condition()
+        self._started = time.monotonic()
+        _pools.add(self)
+
+    def acquire(self):
+        with self._cond:
+            if not self._idle and self.created >= self.size:
+                self.waits += 1
+                start = time.monotonic()
+                while not self._idle and self.created >= self.size:
+                    self._cond.wait()
+                self.waited += time.monotonic() - start
+            # Newest idle client first: its connections are the warmest
+            client = self._idle.pop() if self._idle else None
+            if client is None:
+                self.created += 1
+            self.leases += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+        if client is None:
+            try:
+                client = self.factory()
+            except BaseException:
+                with self._cond:
+                    self.created -= 1
+                    self.in_use -= 1
+                    self._cond.notify()
+                raise
+        return client
+
+    def release(self, client, held=0.0):
+        with self._cond:
+            self._idle.append(client)
+            self.in_use -= 1
+            self.busy_seconds += held
+            self._cond.notify()
+
+    @contextmanager
+    def lease(self):
+        """Borrow a client for the duration of the block"""
+        client = self.acquire()
+        start = time.monotonic()
+        try:
+            yield client
+        finally:
+            self.release(client, time.monotonic() - start)
+
+    def close(self):
+        """Close idle clients; leased ones are closed by whoever holds them"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self.created -= len(idle)
+        for client in idle:
+            close = getattr(client, "close", None)
+            if close is not None:
+                close()
+
+    def stats(self):
+        with self._cond:
+            elapsed = time.monotonic() - self._started
+            return {
+                "size": self.size,
+                "created": self.created,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "leases": self.leases,
+                "reused": self.leases - self.created,
+                "waits": self.waits,
+                "mean_wait": self.waited / self.waits if self.waits else 0.0,
+                # Share of the pool's capacity spent serving calls
+                "utilisation": (
+                    self.busy_seconds / (elapsed * self.size) if elapsed else 0.0
+                ),
+            }
+
+
+def pool_stats():
+    """Stats of every live pool in this process"""
+    return [pool.stats() for pool in list(_pools)]
+
+
+if __name__ == "__main__":
+    # Sessions on a thread pool against a stand-in client whose first call
+    # pays a connection handshake: a fresh client per session against a
+    # shared pool.
+    from concurrent.futures import ThreadPoolExecutor
+    import sys
+
+    handshake = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+    call = 0.01
+    sessions, turns, threads = 64, 6, 16
+
+    class Client:
+        def __init__(self):
+            self.connected = False
+
+        def complete(self):
+            if not self.connected:
+                time.sleep(handshake)
+                self.connected = True
+            time.sleep(call)
+
+    def fresh_client():
+        client = Client()
+        for _ in range(turns):
+            client.complete()
+
+    pool = ClientPool(Client, size=threads)
+
+    def pooled():
+        for _ in range(turns):
+            with pool.lease() as client:
+                client.complete()
+
+    print(
+        f"{sessions} sessions x {turns} turns on {threads} threads, "
+        f"{handshake}s handshake, {call}s per call"
+    )
+    for label, session in (("client per session", fresh_client), ("pool", pooled)):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(lambda _: session(), range(sessions)))
+        print(f"  {label:<18} {time.perf_counter() - start:.2f}s")
+    print(f"  pool stats: {pool.stats()}")
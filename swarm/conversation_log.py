@@ -0,0 +1,344 @@
+from collections import OrderedDict
+import atexit
+import csv
+import io
+import json
+import os
+import threading
+import time
+
+# Conversation logs are the CSV files the Next.js app reads from
+# marketplace/src/data/conversations/{id}.csv. ConversationLogWriter keeps a
+# bounded LRU of open handles and buffers rows per conversation instead of
+# reopening the file for every message. Files are append-only on both sides;
+# the columns and record delimiter come from the format contract shared with
+# marketplace/src/lib/conversation-utils.ts (read on first use, with built-in
+# defaults when the marketplace tree is not next to swarm/), and read_since()
+# reads only the
+# rows after a byte cursor, like the messages API does for the UI. Rows
+# appended to an existing file keep the delimiter of its header row, so files
+# written with "\n" before the contract do not end up with mixed line endings.
+
+CONVERSATIONS_DIR = os.getenv(
+    "CONVERSATIONS_DIR",
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "..",
+        "marketplace",
+        "src",
+        "data",
+        "conversations",
+    ),
+)
+FORMAT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "marketplace",
+    "src",
+    "lib",
+    "conversation-format.json",
+)
+# The contract's contents, for when its file is absent
+DEFAULT_FORMAT = {
+    "columns": ["dateTime", "content", "sender", "type", "price"],
+    "senders": ["buyer", "seller"],
+    "types": ["text", "offer", "accepted"],
+    "recordDelimiter": "\r\n",
+}
+
+_format = None
+
+
+def conversation_format():
+    """The format contract, loaded on first use"""
+    global _format
+    if _format is None:
+        try:
+            with open(FORMAT_PATH) as f:
+                _format = json.load(f)
+        except FileNotFoundError:
+            _format = DEFAULT_FORMAT
+    return _format
+
+# Durability modes, from safest to fastest:
+#   message  flush every row as soon as it is logged (the UI sees it at once)
+#   fsync    buffer rows, flush on thresholds and fsync when a session ends
+#   batched  buffer rows, flush on thresholds, leave syncing to the OS
+FLUSH_PER_MESSAGE = "message"
+FSYNC_ON_CLOSE = "fsync"
+BATCHED = "batched"
+DURABILITY_MODES = (FLUSH_PER_MESSAGE, FSYNC_ON_CLOSE, BATCHED)
+
+
+def message_row(message):
+    """Turn a message dict (or a session_state.MessageRecord) into a CSV row in
+    the contract's column order"""
+    if not isinstance(message, dict):
+        return message.row()
+    return [
+        message["dateTime"],
+        message["content"],
+        message["sender"],
+        message.get("type", "text"),
+        message.get("price", ""),
+    ]
+
+
+def file_delimiter(path):
+    """Record delimiter of an existing conversation file, from its header row;
+    the contract's for a missing or empty file"""
+    try:
+        with open(path, "rb") as f:
+            header = f.readline()
+    except FileNotFoundError:
+        header = b""
+    if not header.endswith(b"\n"):
+        return conversation_format()["recordDelimiter"]
+    return "\r\n" if header.endswith(b"\r\n") else "\n"
+
+
+class ConversationLogWriter:
+    """Buffered writer for per-conversation CSV logs"""
+
+    def __init__(
+        self,
+        directory=CONVERSATIONS_DIR,
+        durability=FLUSH_PER_MESSAGE,
+        max_open_files=64,
+        flush_rows=64,
+        flush_interval=1.0,
+    ):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.directory = directory
+        self.durability = durability
+        self.max_open_files = max_open_files
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        # I/O counters, handy for benchmarks
+        self.opens = 0
+        self.flushes = 0
+        self.fsyncs = 0
+        self.rows = 0
+        self._handles = OrderedDict()
+        self._delimiters = {}
+        self._buffers = {}
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, conversation_id):
+        return os.path.join(self.directory, f"{conversation_id}.csv")
+
+    def create(self, conversation_id):
+        """Start a new conversation file containing just the header"""
+        with self._lock:
+            self._close_handle(conversation_id)
+            self._buffers.pop(conversation_id, None)
+            handle = open(self.path(conversation_id), "w", newline="")
+            self.opens += 1
+            contract = conversation_format()
+            delimiter = self._delimiters[conversation_id] = contract["recordDelimiter"]
+            self._track(conversation_id, handle)
+            csv.writer(handle, lineterminator=delimiter).writerow(contract["columns"])
+            if self.durability == FLUSH_PER_MESSAGE:
+                handle.flush()
+                self.flushes += 1
+
+    def write(self, conversation_id, message):
+        """Queue one message; it is written according to the durability mode"""
+        with self._lock:
+            # Kept as given and turned into a row on flush
+            self._buffers.setdefault(conversation_id, []).append(message)
+            self._buffered += 1
+            self.rows += 1
+            if self.durability == FLUSH_PER_MESSAGE:
+                self._flush_conversation(conversation_id)
+            elif (
+                self._buffered >= self.flush_rows
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            ):
+                self.flush()
+
+    def close_conversation(self, conversation_id):
+        """Flush and release a finished session's file"""
+        with self._lock:
+            self._flush_conversation(conversation_id)
+            self._close_handle(conversation_id)
+
+    def flush(self):
+        with self._lock:
+            for conversation_id in list(self._buffers):
+                self._flush_conversation(conversation_id)
+            self._last_flush = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            for conversation_id in list(self._handles):
+                self._close_handle(conversation_id)
+
+    def _handle(self, conversation_id):
+        handle = self._handles.get(conversation_id)
+        if handle is None:
+            path = self.path(conversation_id)
+            self._delimiters[conversation_id] = file_delimiter(path)
+            handle = open(path, "a", newline="")
+            self.opens += 1
+            self._track(conversation_id, handle)
+        else:
+            self._handles.move_to_end(conversation_id)
+        return handle
+
+    def _track(self, conversation_id, handle):
+        self._handles[conversation_id] = handle
+        while len(self._handles) > self.max_open_files:
+            oldest = next(iter(self._handles))
+            self._flush_conversation(oldest)
+            self._close_handle(oldest)
+
+    def _flush_conversation(self, conversation_id):
+        rows = self._buffers.pop(conversation_id, None)
+        if not rows:
+            return
+        handle = self._handle(conversation_id)
+        delimiter = self._delimiters[conversation_id]
+        csv.writer(handle, lineterminator=delimiter).writerows(
+            map(message_row, rows)
+        )
+        handle.flush()
+        self.flushes += 1
+        self._buffered -= len(rows)
+
+    def _close_handle(self, conversation_id):
+        handle = self._handles.pop(conversation_id, None)
+        self._delimiters.pop(conversation_id, None)
+        if handle is None:
+            return
+        if self.durability == FSYNC_ON_CLOSE:
+            handle.flush()
+            os.fsync(handle.fileno())
+            self.fsyncs += 1
+        handle.close()
+
+
+_default_writer = None
+
+
+def get_writer():
+    """Process-wide writer
+
+    CONVERSATION_LOG_FORMAT=segmented logs into the append-only
+    ConversationStore instead of one CSV per conversation, and
+    CONVERSATION_LOG_DURABILITY picks the durability mode of either.
+    """
+    global _default_writer
+    if _default_writer is None:
+        durability = os.getenv("CONVERSATION_LOG_DURABILITY", FLUSH_PER_MESSAGE)
+        if os.getenv("CONVERSATION_LOG_FORMAT", "csv") == "segmented":
+            from conversation_store import ConversationStore
+
+            _default_writer = ConversationStore(durability=durability)
+        else:
+            _default_writer = ConversationLogWriter(durability=durability)
+        atexit.register(_default_writer.close)
+    return _default_writer
+
+
+def set_writer(writer):
+    global _default_writer
+    _default_writer = writer
+
+
+def create_conversation_file(conversation_id):
+    """Create a new conversation CSV file"""
+    get_writer().create(conversation_id)
+
+
+def log_message(conversation_id, message):
+    """Log a message to the conversation CSV file"""
+    get_writer().write(conversation_id, message)
+
+
+def end_conversation(conversation_id):
+    """Flush and close a conversation once its session is over"""
+    get_writer().close_conversation(conversation_id)
+
+
+def _complete_length(data):
+    """Length of `data` up to the end of its last whole CSV record
+
+    A newline ends a record only outside quotes, i.e. after an even number of
+    quote characters since the start of the data.
+    """
+    end = 0
+    quotes = 0
+    position = 0
+    newline = data.find(b"\n")
+    while newline != -1:
+        quotes += data.count(b'"', position, newline)
+        position = newline + 1
+        if quotes % 2 == 0:
+            end = position
+        newline = data.find(b"\n", position)
+    return end
+
+
+def read_since(
+    conversation_id, cursor=0, max_bytes=64 * 1024, directory=CONVERSATIONS_DIR
+):
+    """Messages appended after byte offset `cursor`, and the cursor to pass next
+
+    Reads at most about max_bytes (more only if a single row is larger) and
+    stops at the last whole row, so a row still being written is returned by
+    the next call. Cursor 0 starts at the header. A cursor past the end of the
+    file means it was replaced; reading restarts from the top, which callers
+    can tell by the returned cursor being smaller than the one they passed.
+    Only the CSV format is read; the segmented store has iter_messages().
+    """
+    path = os.path.join(directory, f"{conversation_id}.csv")
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return [], cursor
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        start = 0 if cursor > size else cursor
+        length = min(max_bytes, size - start)
+        data = b""
+        end = 0
+        while length > 0:
+            f.seek(start)
+            data = f.read(length)
+            end = _complete_length(data)
+            if end or start + length >= size:
+                break
+            length = min(length * 2, size - start)
+
+    rows = csv.reader(io.StringIO(data[:end].decode("utf-8"), newline=""))
+    if start == 0:
+        next(rows, None)
+    columns = conversation_format()["columns"]
+    messages = [dict(zip(columns, row)) for row in rows if row]
+    return messages, start + end
+
+
+def read_conversation(conversation_id):
+    """Every message logged so far for a conversation, from whichever writer
+    get_writer() returns"""
+    writer = get_writer()
+    writer.flush()
+    if hasattr(writer, "iter_messages"):
+        if conversation_id not in writer:
+            return []
+        return list(writer.iter_messages(conversation_id))
+    messages, cursor = [], 0
+    while True:
+        page, next_cursor = read_since(
+            conversation_id, cursor, directory=writer.directory
+        )
+        if next_cursor <= cursor:
+            return messages
+        messages += page
+        cursor = next_cursor
@@ -0,0 +1,267 @@
+from array import array
+import csv
+import json
+import os
+import struct
+import sys
+import threading
+import uuid
+
+from conversation_log import (
+    CONVERSATIONS_DIR,
+    DURABILITY_MODES,
+    FLUSH_PER_MESSAGE,
+    FSYNC_ON_CLOSE,
+    conversation_format,
+    message_row,
+)
+
+# Append-only segmented store for conversation logs. Instead of one CSV file per
+# conversation, every message from every conversation is appended to the
+# current segment file:
+#
+#   segment-00000001.log   records: <u32 payload length><JSON payload>
+#   index.bin              entries: <16-byte conversation uuid><u32 segment><u64 offset>
+#
+# A record payload is [conversation_id] for a conversation start marker, or
+# [conversation_id, dateTime, content, sender, type, price] for a message. The
+# index is loaded into a dict of packed arrays (8 bytes per message) so reading
+# a conversation is a handful of seeks. export_csv() materialises the familiar
+# per-conversation CSV for the Next.js UI on demand.
+
+STORE_DIR = os.getenv(
+    "CONVERSATION_STORE_DIR", os.path.join(CONVERSATIONS_DIR, "..", "conversation_store")
+)
+
+_RECORD_HEADER = struct.Struct("<I")
+_INDEX_ENTRY = struct.Struct("<16sIQ")
+_OFFSET_BITS = 40  # 1 TiB per segment is plenty
+
+
+def _pack(segment, offset):
+    return (segment << _OFFSET_BITS) | offset
+
+
+def _unpack(position):
+    return position >> _OFFSET_BITS, position & ((1 << _OFFSET_BITS) - 1)
+
+
+class ConversationStore:
+    """Segmented append-only conversation log with a per-conversation index
+
+    Implements the same create/write/close_conversation/flush/close interface as
+    ConversationLogWriter, so it can be installed with conversation_log.set_writer.
+    """
+
+    def __init__(
+        self,
+        directory=STORE_DIR,
+        segment_bytes=64 * 1024 * 1024,
+        durability=FLUSH_PER_MESSAGE,
+        flush_rows=256,
+    ):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.durability = durability
+        self.flush_rows = flush_rows
+        self._index = {}
+        self._readers = {}
+        self._pending = 0
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+        self._load_index()
+        segments = self._segment_numbers()
+        self._segment = segments[-1] if segments else 1
+        self._segment_file = open(self._segment_path(self._segment), "ab")
+        self._index_file = open(os.path.join(directory, "index.bin"), "ab")
+
+    # -- writing -----------------------------------------------------------
+
+    def create(self, conversation_id):
+        """Register a new, empty conversation"""
+        self._append(conversation_id, [conversation_id])
+
+    def write(self, conversation_id, message):
+        self._append(conversation_id, [conversation_id, *message_row(message)])
+
+    def close_conversation(self, conversation_id):
+        with self._lock:
+            self.flush()
+            if self.durability == FSYNC_ON_CLOSE:
+                os.fsync(self._segment_file.fileno())
+                os.fsync(self._index_file.fileno())
+
+    def flush(self):
+        with self._lock:
+            self._segment_file.flush()
+            self._index_file.flush()
+            self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._segment_file.close()
+            self._index_file.close()
+            for handle in self._readers.values():
+                handle.close()
+            self._readers.clear()
+
+    def _append(self, conversation_id, payload):
+        data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        key = uuid.UUID(conversation_id).bytes
+        with self._lock:
+            offset = self._segment_file.tell()
+            if offset and offset + _RECORD_HEADER.size + len(data) > self.segment_bytes:
+                self._roll_segment()
+                offset = 0
+            self._segment_file.write(_RECORD_HEADER.pack(len(data)) + data)
+            self._index_file.write(_INDEX_ENTRY.pack(key, self._segment, offset))
+            self._remember(conversation_id, self._segment, offset)
+            self._pending += 1
+            if self.durability == FLUSH_PER_MESSAGE or self._pending >= self.flush_rows:
+                self.flush()
+
+    def _roll_segment(self):
+        self._segment_file.flush()
+        self._segment_file.close()
+        self._segment += 1
+        self._segment_file = open(self._segment_path(self._segment), "ab")
+
+    # -- reading -----------------------------------------------------------
+
+    def conversations(self):
+        """Ids of every conversation in the store"""
+        with self._lock:
+            return list(self._index)
+
+    def __contains__(self, conversation_id):
+        return conversation_id in self._index
+
+    def read(self, conversation_id):
+        """Messages of a conversation as dicts with the CSV column names"""
+        return list(self.iter_messages(conversation_id))
+
+    def iter_messages(self, conversation_id, start=0):
+        """Yield messages lazily, skipping the first `start` messages"""
+        with self._lock:
+            self._segment_file.flush()
+            positions = self._index.get(conversation_id)
+            if positions is None:
+                raise KeyError(conversation_id)
+            positions = positions[:]
+        columns = conversation_format()["columns"]
+        seen = 0
+        for position in positions:
+            payload = self._read_record(*_unpack(position))
+            if len(payload) == 1:
+                continue
+            if seen >= start:
+                yield dict(zip(columns, payload[1:]))
+            seen += 1
+
+    def _read_record(self, segment, offset):
+        with self._lock:
+            handle = self._readers.get(segment)
+            if handle is None:
+                handle = self._readers[segment] = open(self._segment_path(segment), "rb")
+            handle.seek(offset)
+            (length,) = _RECORD_HEADER.unpack(handle.read(_RECORD_HEADER.size))
+            return json.loads(handle.read(length))
+
+    # -- export ------------------------------------------------------------
+
+    def export_csv(self, conversation_id, directory=CONVERSATIONS_DIR):
+        """Write the conversation out as {id}.csv for the marketplace UI"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{conversation_id}.csv")
+        with open(path, "w", newline="") as f:
+            contract = conversation_format()
+            writer = csv.writer(f, lineterminator=contract["recordDelimiter"])
+            writer.writerow(contract["columns"])
+            for message in self.iter_messages(conversation_id):
+                writer.writerow(message_row(message))
+        return path
+
+    # -- index -------------------------------------------------------------
+
+    def _remember(self, conversation_id, segment, offset):
+        positions = self._index.get(conversation_id)
+        if positions is None:
+            positions = self._index[conversation_id] = array("Q")
+        positions.append(_pack(segment, offset))
+
+    def _load_index(self):
+        path = os.path.join(self.directory, "index.bin")
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        # A torn final entry (crash mid-write) is dropped and truncated away
+        usable = len(data) - len(data) % _INDEX_ENTRY.size
+        for key, segment, offset in _INDEX_ENTRY.iter_unpack(data[:usable]):
+            self._remember(str(uuid.UUID(bytes=key)), segment, offset)
+        if usable != len(data):
+            with open(path, "r+b") as f:
+                f.truncate(usable)
+
+    def rebuild_index(self):
+        """Recreate index.bin by scanning every segment"""
+        with self._lock:
+            self.flush()
+            self._index.clear()
+            self._index_file.close()
+            with open(os.path.join(self.directory, "index.bin"), "wb") as index_file:
+                for segment in self._segment_numbers():
+                    with open(self._segment_path(segment), "rb") as f:
+                        offset = 0
+                        while True:
+                            header = f.read(_RECORD_HEADER.size)
+                            if len(header) < _RECORD_HEADER.size:
+                                break
+                            (length,) = _RECORD_HEADER.unpack(header)
+                            data = f.read(length)
+                            if len(data) < length:
+                                break
+                            conversation_id = json.loads(data)[0]
+                            index_file.write(
+                                _INDEX_ENTRY.pack(
+                                    uuid.UUID(conversation_id).bytes, segment, offset
+                                )
+                            )
+                            self._remember(conversation_id, segment, offset)
+                            offset += _RECORD_HEADER.size + length
+            self._index_file = open(os.path.join(self.directory, "index.bin"), "ab")
+
+    def _segment_numbers(self):
+        return sorted(
+            int(name[len("segment-") : -len(".log")])
+            for name in os.listdir(self.directory)
+            if name.startswith("segment-") and name.endswith(".log")
+        )
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:08d}.log")
+
+
+if __name__ == "__main__":
+    # python conversation_store.py export <conversation_id>...
+    # python conversation_store.py export-all
+    # python conversation_store.py rebuild-index
+    store = ConversationStore()
+    command = sys.argv[1] if len(sys.argv) > 1 else "export-all"
+    if command == "export":
+        for conversation_id in sys.argv[2:]:
+            print(store.export_csv(conversation_id))
+    elif command == "export-all":
+        for conversation_id in store.conversations():
+            store.export_csv(conversation_id)
+        print(f"Exported {len(store.conversations())} conversations")
+    elif command == "rebuild-index":
+        store.rebuild_index()
+        print(f"Indexed {len(store.conversations())} conversations")
+    else:
+        print(f"Unknown command: {command}")
+    store.close()
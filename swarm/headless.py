@@ -0,0 +1,191 @@
+import argparse
+import json
+import time
+
+from multi_sim import console, simulate_negotiation
+
+# Unattended driver for multi_sim. simulate_negotiation asks for the user's
+# role, their verification concerns and every user turn; here those prompts
+# are answered from a script (or by an "AI handles everything" policy), output
+# is silenced, and each session returns a SimulationResult. Scripts are
+# consumed in prompt order: role, concerns, then one line per user turn. An
+# empty answer, or running out of script, hands the turn to the AI; a script
+# that runs out before a valid role has been given raises EOFError.
+#
+# Script files hold one answer per line with sessions separated by "---".
+
+
+class ScriptedUser:
+    """Answers multi_sim's prompts in order from a list of strings, and raises
+    EOFError once they run out, like input() at the end of stdin"""
+
+    def __init__(self, answers):
+        self._answers = iter(answers)
+        self.prompts = 0
+
+    def __call__(self, prompt=""):
+        self.prompts += 1
+        try:
+            return next(self._answers)
+        except StopIteration:
+            raise EOFError(f"script ran out of answers at prompt {prompt!r}") from None
+
+
+def ai_policy(role="buyer"):
+    """Pick `role` and let the AI handle every other prompt"""
+    return ScriptedUser([role])
+
+
+def load_scripts(path):
+    """One answer list per session from a script file"""
+    scripts = [[]]
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.strip() == "---":
+                scripts.append([])
+            else:
+                scripts[-1].append(line)
+    return [script for script in scripts if script]
+
+
+def _silent(*args, **kwargs):
+    pass
+
+
+def run_headless(script=None, role="buyer", history="full", speculative=False):
+    """Run one session without a terminal and return its SimulationResult"""
+    user = ScriptedUser(script) if script is not None else ai_policy(role)
+    with console(ask=user, say=_silent):
+        return simulate_negotiation(history=history, speculative=speculative)
+
+
+def run_many(scripts=None, sessions=1, **kwargs):
+    """Run one session per script, or `sessions` AI-policy sessions"""
+    if scripts is not None:
+        return [run_headless(script, **kwargs) for script in scripts]
+    return [run_headless(**kwargs) for _ in range(sessions)]
+
+
+def summarize(results, seconds):
+    deals = [result for result in results if result.deal_made]
+    return {
+        "sessions": len(results),
+        "deal_rate": len(deals) / len(results) if results else 0.0,
+        "mean_final_price": (
+            sum(result.final_price for result in deals) / len(deals) if deals else None
+        ),
+        "mean_rounds": (
+            sum(result.rounds for result in results) / len(results) if results else 0.0
+        ),
+        "seconds_per_session": seconds / len(results) if results else 0.0,
+    }
+
+
+def compare(sessions=20, latency=0.0):
+    """multi_sim's history-based sessions against multi_agent's stateless
+    rounds on the fake backend, for the same item"""
+    from contextlib import redirect_stdout
+    import io
+
+    from instrumentation import InstrumentedBackend, Recorder, set_recorder
+    from llm_backend import FakeBackend, set_backend
+
+    set_backend(InstrumentedBackend(FakeBackend(latency=latency)))
+    # Both modules look the backend up on every call, so they use the fake
+    import multi_sim
+    from multi_agent import marketplace_negotiation
+
+    item = multi_sim.ITEM
+    product_details = {
+        "name": item["name"],
+        "description": item["description"],
+        "condition": item["condition"],
+        "price": item["listing_price"],
+    }
+    rows = []
+
+    def measure(label, run):
+        recorder = Recorder()
+        set_recorder(recorder)
+        start = time.perf_counter()
+        outcomes = [run() for _ in range(sessions)]
+        seconds = time.perf_counter() - start
+        calls = recorder.summary()
+        rows.append(
+            (
+                label,
+                sum(deal for deal, _ in outcomes) / sessions,
+                sum(rounds for _, rounds in outcomes) / sessions,
+                sum(row["calls"] for row in calls) / sessions,
+                sum(row["prompt_tokens"] for row in calls) / sessions,
+                seconds / sessions,
+            )
+        )
+
+    for history in ("full", "summary"):
+
+        def sim(history=history):
+            result = run_headless(role="seller", history=history)
+            return result.deal_made, result.rounds
+
+        measure(f"multi_sim ({history})", sim)
+
+    def stateless():
+        with redirect_stdout(io.StringIO()):
+            result = marketplace_negotiation(
+                product_details,
+                round(item["listing_price"] * 0.9),
+                item["minimum_acceptable_price"],
+                interactive=False,
+            )
+        return result["status"], result["rounds"]
+
+    measure("multi_agent", stateless)
+
+    print(f"{sessions} sessions each, {latency}s per model call")
+    print(
+        f"{'driver':<22} {'deals':>6} {'rounds':>7} {'calls':>6} "
+        f"{'prompt tok':>11} {'s/session':>10}"
+    )
+    for label, deal_rate, rounds, calls, tokens, seconds in rows:
+        print(
+            f"{label:<22} {deal_rate:>6.0%} {rounds:>7.2f} {calls:>6.1f} "
+            f"{tokens:>11.0f} {seconds:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run multi_sim without a terminal")
+    parser.add_argument("--script", help="file of scripted answers, sessions split by ---")
+    parser.add_argument("--sessions", type=int, default=1)
+    parser.add_argument("--role", choices=("buyer", "seller"), default="buyer")
+    parser.add_argument("--history", default="full")
+    parser.add_argument("--speculative", action="store_true")
+    parser.add_argument("--jsonl", help="write one result per line to this file")
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="benchmark against multi_agent on the fake backend",
+    )
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.sessions, args.latency)
+    else:
+        scripts = load_scripts(args.script) if args.script else None
+        start = time.perf_counter()
+        results = run_many(
+            scripts,
+            sessions=args.sessions,
+            role=args.role,
+            history=args.history,
+            speculative=args.speculative,
+        )
+        summary = summarize(results, time.perf_counter() - start)
+        if args.jsonl:
+            with open(args.jsonl, "w") as f:
+                for result in results:
+                    f.write(json.dumps(result.to_dict()) + "\n")
+        print(json.dumps(summary, indent=2))
@@ -0,0 +1,237 @@
+from collections import deque
+import sys
+import time
+
+from llm_backend import count_tokens
+from message_parser import ACCEPTED, COUNTER, OFFER, classify_message
+
+# Conversation history for multi_sim's chat-style agents. Re-sending the full
+# transcript makes prompt tokens grow quadratically over a negotiation; these
+# strategies bound what is sent each turn:
+#
+#   full     every message (the original behaviour)
+#   last_n   the opening message plus the most recent `n` messages
+#   summary  the most recent `n` messages plus a rolling one-line summary of
+#            everything older (offers made, whether terms were discussed)
+#   offers   only the current offer state and the latest message
+#
+# Messages are appended once and the prompt is assembled from the retained
+# window, so building a prompt costs O(window) rather than copying the whole
+# transcript. append() takes who sent a message ("buyer" or "seller") next to
+# it, since the chat role of a side depends on which one the user plays.
+
+
+class FullHistory:
+    """Every message, in order"""
+
+    def __init__(self):
+        # Slot 0 is reserved for the system prompt so prompt() can hand out the
+        # list without copying it
+        self._prompt = [None]
+
+    def append(self, message, speaker=None):
+        self._prompt.append(message)
+
+    def prompt(self, system):
+        self._prompt[0] = {"role": "system", "content": system}
+        return self._prompt
+
+    def messages(self):
+        return self._prompt[1:]
+
+    def __len__(self):
+        return len(self._prompt) - 1
+
+
+class LastNHistory:
+    """The opening message plus a sliding window of recent messages"""
+
+    def __init__(self, n=6):
+        self._opening = None
+        self._window = deque(maxlen=n)
+        self._count = 0
+
+    def append(self, message, speaker=None):
+        if self._opening is None:
+            self._opening = message
+        else:
+            self._window.append(message)
+        self._count += 1
+
+    def prompt(self, system):
+        head = [{"role": "system", "content": system}]
+        if self._opening is not None:
+            head.append(self._opening)
+        head.extend(self._window)
+        return head
+
+    def messages(self):
+        return [self._opening, *self._window] if self._opening else []
+
+    def __len__(self):
+        return self._count
+
+
+class _OfferState:
+    """Latest offer from each side, tracked incrementally"""
+
+    def __init__(self):
+        self.offers = {}
+        self.rounds = 0
+        self.description = ""
+
+    def update(self, message, speaker=None):
+        kind, price = classify_message(message["content"])
+        if kind in (OFFER, COUNTER, ACCEPTED) and price is not None:
+            self.offers[speaker or _speaker(message)] = price
+        self.rounds += 1
+        self.description = self._describe()
+
+    def _describe(self):
+        if not self.offers:
+            return f"{self.rounds} earlier messages, no prices named yet."
+        offers = ", ".join(
+            f"{speaker} ${price}" for speaker, price in sorted(self.offers.items())
+        )
+        return f"{self.rounds} earlier messages. Latest offers: {offers}."
+
+
+def _speaker(message):
+    """Sender of a message appended without one, from its [BUYER]/[SELLER] tag"""
+    content = message["content"]
+    if content.startswith("[BUYER]"):
+        return "buyer"
+    if content.startswith("[SELLER]"):
+        return "seller"
+    return "unknown"
+
+
+class SummaryHistory:
+    """Recent messages verbatim, older ones folded into a running summary"""
+
+    def __init__(self, n=4):
+        self._window = deque()
+        self._speakers = deque()
+        self._n = n
+        self._state = _OfferState()
+        self._count = 0
+
+    def append(self, message, speaker=None):
+        self._window.append(message)
+        self._speakers.append(speaker)
+        self._count += 1
+        if len(self._window) > self._n:
+            self._state.update(self._window.popleft(), self._speakers.popleft())
+
+    def prompt(self, system):
+        head = [{"role": "system", "content": system}]
+        if self._state.rounds:
+            head.append(
+                {
+                    "role": "user",
+                    "content": f"[SUMMARY OF EARLIER CONVERSATION]: {self._state.description}",
+                }
+            )
+        head.extend(self._window)
+        return head
+
+    def messages(self):
+        return list(self._window)
+
+    def __len__(self):
+        return self._count
+
+
+class OfferStateHistory:
+    """Only the negotiated state and the latest message"""
+
+    def __init__(self):
+        self._state = _OfferState()
+        self._latest = None
+        self._latest_speaker = None
+        self._count = 0
+
+    def append(self, message, speaker=None):
+        if self._latest is not None:
+            self._state.update(self._latest, self._latest_speaker)
+        self._latest = message
+        self._latest_speaker = speaker
+        self._count += 1
+
+    def prompt(self, system):
+        state = self._state.description or "just started."
+        head = [
+            {"role": "system", "content": f"{system}\nNegotiation so far: {state}"}
+        ]
+        if self._latest is not None:
+            head.append(self._latest)
+        return head
+
+    def messages(self):
+        return [self._latest] if self._latest else []
+
+    def __len__(self):
+        return self._count
+
+
+HISTORY_STRATEGIES = {
+    "full": FullHistory,
+    "last_n": LastNHistory,
+    "summary": SummaryHistory,
+    "offers": OfferStateHistory,
+}
+
+
+def make_history(strategy="full", **kwargs):
+    """Build a history object by strategy name"""
+    try:
+        return HISTORY_STRATEGIES[strategy](**kwargs)
+    except KeyError:
+        raise ValueError(f"Unknown history strategy: {strategy}") from None
+
+
+if __name__ == "__main__":
+    # Prompt tokens, prompt-build time and modelled model latency per round for
+    # each strategy over a fake negotiation. The fake charges 0.2 ms per prompt
+    # token for prefill on top of a fixed 50 ms, so latency tracks prompt size.
+    # Pass the number of rounds as the first argument.
+    from llm_backend import FakeBackend
+
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    # The buyer is the user here, as when the user plays the seller
+    speakers = {"assistant": "seller", "user": "buyer"}
+    systems = {
+        "assistant": "You are a marketplace seller on a casual messaging platform. "
+        "Be firm on pricing but willing to negotiate. Keep responses brief.",
+        "user": "You are a marketplace buyer on a casual messaging platform. "
+        "You want the best possible price. Keep responses brief, like texting.",
+    }
+    for name in HISTORY_STRATEGIES:
+        history = make_history(name)
+        backend = FakeBackend(latency=0.05, latency_per_prompt_token=0.0002)
+        history.append(
+            {"role": "user", "content": "[BUYER]: Hi! I saw your listing for $180."},
+            "buyer",
+        )
+        per_round = []
+        for round_num in range(rounds):
+            round_tokens = 0
+            build_seconds = 0.0
+            model_seconds = 0.0
+            for role in ("assistant", "user"):
+                start = time.perf_counter()
+                prompt = history.prompt(systems[role])
+                build_seconds += time.perf_counter() - start
+                round_tokens += sum(count_tokens(m["content"]) for m in prompt)
+                reply = backend.complete(prompt)
+                model_seconds += reply.latency
+                history.append(
+                    {"role": role, "content": reply.content}, speakers[role]
+                )
+            per_round.append((round_tokens, build_seconds, model_seconds))
+
+        total = sum(tokens for tokens, _, _ in per_round)
+        print(f"{name:>8}: {total:6d} prompt tokens over {rounds} rounds")
+        print("   tokens/round: " + " ".join(f"{t:5d}" for t, _, _ in per_round))
+        print("  build us/round: " + " ".join(f"{b * 1e6:5.1f}" for _, b, _ in per_round))
+        print("  model ms/round: " + " ".join(f"{m * 1e3:5.0f}" for _, _, m in per_round))
@@ -0,0 +1,320 @@
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+import contextvars
+import json
+import threading
+import time
+
+from llm_backend import LLMBackend, DEFAULT_MODEL, count_tokens
+
+# Per-call spans and aggregate histograms for model calls. Call sites label the
+# work they are doing with `tags(stage=..., round=..., role=...)`; the labels
+# live in a context variable, so they follow asyncio tasks and are picked up by
+# InstrumentedBackend without threading extra arguments through every call.
+# Recording a span is a few dict lookups and a bisect, cheap enough to leave on.
+
+# USD per 1K (prompt, completion) tokens
+MODEL_PRICES = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+}
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+COST_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+
+_tags = contextvars.ContextVar("instrumentation_tags", default={})
+
+
+@contextmanager
+def tags(**labels):
+    """Attach labels (session, stage, round, role, ...) to calls made inside"""
+    token = _tags.set({**_tags.get(), **labels})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def current_tags():
+    return _tags.get()
+
+
+def call_cost(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+class Span:
+    """One model call"""
+
+    __slots__ = (
+        "session",
+        "stage",
+        "round",
+        "role",
+        "model",
+        "start",
+        "latency",
+        "prompt_tokens",
+        "completion_tokens",
+        "cost",
+        "cached",
+    )
+
+    def __init__(
+        self, labels, model, start, latency, prompt_tokens, completion_tokens, cached
+    ):
+        self.session = labels.get("session")
+        self.stage = labels.get("stage", "unknown")
+        self.round = labels.get("round")
+        self.role = labels.get("role", "")
+        self.model = model
+        self.start = start
+        self.latency = latency
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cost = 0.0 if cached else call_cost(model, prompt_tokens, completion_tokens)
+        self.cached = cached
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Histogram:
+    """Fixed-bucket histogram with Prometheus semantics"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bucket bound containing the q-th quantile"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class Recorder:
+    """Collects spans, per-(stage, role) histograms and per-session totals"""
+
+    def __init__(self, max_spans=10_000):
+        self.spans = deque(maxlen=max_spans)
+        self._calls = {}
+        self._sessions = {}
+        self._session_histograms = {
+            "session_latency_seconds": Histogram(LATENCY_BUCKETS),
+            "session_tokens": Histogram(TOKEN_BUCKETS),
+            "session_cost_usd": Histogram(COST_BUCKETS),
+            "session_calls": Histogram((1, 2, 4, 6, 8, 10, 15, 20)),
+        }
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        key = (span.stage, span.role, span.model)
+        with self._lock:
+            self.spans.append(span)
+            stats = self._calls.get(key)
+            if stats is None:
+                stats = self._calls[key] = {
+                    "calls": 0,
+                    "cache_hits": 0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "cost": 0.0,
+                    "latency": Histogram(LATENCY_BUCKETS),
+                    "tokens": Histogram(TOKEN_BUCKETS),
+                }
+            stats["calls"] += 1
+            stats["cache_hits"] += span.cached
+            stats["prompt_tokens"] += span.prompt_tokens
+            stats["completion_tokens"] += span.completion_tokens
+            stats["cost"] += span.cost
+            stats["latency"].observe(span.latency)
+            stats["tokens"].observe(span.prompt_tokens + span.completion_tokens)
+
+            if span.session is not None:
+                totals = self._sessions.setdefault(span.session, [0.0, 0, 0.0, 0])
+                totals[0] += span.latency
+                totals[1] += span.prompt_tokens + span.completion_tokens
+                totals[2] += span.cost
+                totals[3] += 1
+
+    def end_session(self, session):
+        """Fold a finished session's totals into the session histograms"""
+        with self._lock:
+            totals = self._sessions.pop(session, None)
+            if totals is None:
+                return None
+            histograms = self._session_histograms
+            histograms["session_latency_seconds"].observe(totals[0])
+            histograms["session_tokens"].observe(totals[1])
+            histograms["session_cost_usd"].observe(totals[2])
+            histograms["session_calls"].observe(totals[3])
+        return {
+            "latency": totals[0],
+            "tokens": totals[1],
+            "cost": totals[2],
+            "calls": totals[3],
+        }
+
+    def summary(self):
+        """Per (stage, role, model) totals plus p50/p95 latency"""
+        with self._lock:
+            return [
+                {
+                    "stage": stage,
+                    "role": role,
+                    "model": model,
+                    "calls": stats["calls"],
+                    "cache_hits": stats["cache_hits"],
+                    "prompt_tokens": stats["prompt_tokens"],
+                    "completion_tokens": stats["completion_tokens"],
+                    "cost": round(stats["cost"], 6),
+                    "latency_p50": stats["latency"].quantile(0.5),
+                    "latency_p95": stats["latency"].quantile(0.95),
+                    "latency_mean": stats["latency"].sum / stats["calls"],
+                }
+                for (stage, role, model), stats in sorted(self._calls.items())
+            ]
+
+    def write_jsonl(self, path):
+        """Dump the retained spans as JSON lines"""
+        with self._lock:
+            spans = list(self.spans)
+        with open(path, "w") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict()) + "\n")
+        return len(spans)
+
+    def prometheus(self):
+        """Prometheus text exposition of every counter and histogram"""
+        lines = []
+        with self._lock:
+            calls = sorted(self._calls.items())
+            counters = (
+                ("llm_calls_total", "calls"),
+                ("llm_cache_hits_total", "cache_hits"),
+                ("llm_prompt_tokens_total", "prompt_tokens"),
+                ("llm_completion_tokens_total", "completion_tokens"),
+                ("llm_cost_usd_total", "cost"),
+            )
+            for name, field in counters:
+                lines.append(f"# TYPE {name} counter")
+                for (stage, role, model), stats in calls:
+                    labels = f'stage="{stage}",role="{role}",model="{model}"'
+                    lines.append(f"{name}{{{labels}}} {stats[field]}")
+            for name, field in (
+                ("llm_call_latency_seconds", "latency"),
+                ("llm_call_tokens", "tokens"),
+            ):
+                lines.append(f"# TYPE {name} histogram")
+                for (stage, role, model), stats in calls:
+                    labels = f'stage="{stage}",role="{role}",model="{model}"'
+                    lines.extend(_histogram_lines(name, labels, stats[field]))
+            for name, histogram in self._session_histograms.items():
+                lines.append(f"# TYPE {name} histogram")
+                lines.extend(_histogram_lines(name, "", histogram))
+        return "\n".join(lines) + "\n"
+
+
+def _histogram_lines(name, labels, histogram):
+    prefix = labels + "," if labels else ""
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+    yield f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}'
+    suffix = f"{{{labels}}}" if labels else ""
+    yield f"{name}_sum{suffix} {histogram.sum}"
+    yield f"{name}_count{suffix} {histogram.count}"
+
+
+class InstrumentedBackend(LLMBackend):
+    """Records a Span for every call made through the wrapped backend"""
+
+    def __init__(self, backend, recorder=None):
+        self.backend = backend
+        self._recorder = recorder
+
+    @property
+    def recorder(self):
+        # Without an explicit recorder, follow set_recorder()
+        return self._recorder or _default_recorder
+
+    def complete(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150):
+        start = time.time()
+        began = time.perf_counter()
+        completion = self.backend.complete(
+            messages, model=model, temperature=temperature, max_tokens=max_tokens
+        )
+        self.recorder.record(
+            Span(
+                _tags.get(),
+                model,
+                start,
+                time.perf_counter() - began,
+                completion.prompt_tokens,
+                completion.completion_tokens,
+                completion.cached,
+            )
+        )
+        return completion
+
+    def stream(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150):
+        labels = _tags.get()
+        start = time.time()
+        began = time.perf_counter()
+        chunks = []
+        try:
+            for chunk in self.backend.stream(
+                messages, model=model, temperature=temperature, max_tokens=max_tokens
+            ):
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            # Streams do not report usage reliably; estimate it instead
+            self.recorder.record(
+                Span(
+                    labels,
+                    model,
+                    start,
+                    time.perf_counter() - began,
+                    sum(count_tokens(m["content"]) for m in messages),
+                    count_tokens("".join(chunks)),
+                    False,
+                )
+            )
+
+
+_default_recorder = Recorder()
+
+
+def get_recorder():
+    return _default_recorder
+
+
+def set_recorder(recorder):
+    global _default_recorder
+    _default_recorder = recorder
+
+
+def end_session(session):
+    return _default_recorder.end_session(session)
@@ -0,0 +1,296 @@
+import argparse
+import csv
+import hashlib
+import io
+import os
+import threading
+
+# In-memory index over the marketplace catalog (marketplace/src/data/
+# listings.csv, the file the Next.js app serves listings from). The catalog is
+# parsed once into slotted Listing records indexed by id, price bucket and
+# location. refresh() stats the file and, when rows were only appended (the
+# file grew and a hash of every byte already parsed still matches), parses just
+# the new bytes; any other change, including an in-place edit that keeps the
+# size, reloads the whole catalog. Simulations
+# select listings with query() and turn them into negotiation inputs without
+# touching the CSV again.
+
+LISTINGS_PATH = os.getenv(
+    "LISTINGS_PATH",
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "..",
+        "marketplace",
+        "src",
+        "data",
+        "listings.csv",
+    ),
+)
+LISTING_COLUMNS = [
+    "id",
+    "title",
+    "description",
+    "price",
+    "location",
+    "imageUrl",
+    "datePosted",
+    "sellerName",
+]
+
+# Read size when hashing the parsed prefix of the file
+_HASH_CHUNK = 1 << 16
+
+
+class Listing:
+    """One catalog row"""
+
+    __slots__ = (
+        "id",
+        "title",
+        "description",
+        "price",
+        "location",
+        "image_url",
+        "date_posted",
+        "seller_name",
+    )
+
+    def __init__(self, row):
+        self.id = row["id"]
+        self.title = row["title"]
+        self.description = row["description"]
+        self.price = _price(row["price"])
+        self.location = row["location"]
+        self.image_url = row["imageUrl"]
+        self.date_posted = row["datePosted"]
+        self.seller_name = row["sellerName"]
+
+    @property
+    def city(self):
+        return self.location.split(",")[0].strip()
+
+    def product_details(self):
+        """Product dict in the shape marketplace_negotiation expects"""
+        return {
+            "id": self.id,
+            "name": self.title,
+            "description": self.description,
+            "price": self.price,
+            "location": self.location,
+        }
+
+    def sim_item(self, minimum_ratio=0.8):
+        """Item dict in the shape multi_sim's ITEM uses"""
+        return {
+            "name": self.title,
+            "condition": "Used",
+            "original_price": self.price,
+            "listing_price": self.price,
+            "description": self.description,
+            "minimum_acceptable_price": round(self.price * minimum_ratio),
+        }
+
+    def __repr__(self):
+        return f"Listing({self.id!r}, {self.title!r}, ${self.price})"
+
+
+def _price(value):
+    price = float(value)
+    return int(price) if price.is_integer() else price
+
+
+class ListingStore:
+    """Catalog indexed by id, price bucket and location
+
+    bucket_size  width in dollars of the price buckets used by range queries
+    """
+
+    def __init__(self, path=LISTINGS_PATH, bucket_size=100):
+        self.path = path
+        self.bucket_size = bucket_size
+        self.reloads = 0
+        self.appends = 0
+        self._by_id = {}
+        self._by_bucket = {}
+        self._by_location = {}
+        self._columns = None
+        self._offset = 0
+        self._stat = None
+        # Hash of the bytes up to _offset
+        self._prefix = hashlib.blake2b()
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """Pick up changes to the file; returns the number of rows parsed"""
+        with self._lock:
+            stat = os.stat(self.path)
+            unchanged = self._stat == (stat.st_mtime_ns, stat.st_size)
+            if unchanged and stat.st_size == self._offset:
+                return 0
+            with open(self.path, "rb") as f:
+                grew = self._stat is not None and stat.st_size > self._stat[1]
+                if self._columns and (
+                    unchanged or (grew and self._prefix_matches(f))
+                ):
+                    f.seek(self._offset)
+                    # An unterminated last row that has not grown since the
+                    # previous refresh is finished, not being written
+                    parsed = self._parse(f, complete=unchanged)
+                    self.appends += 1
+                    self._stat = (stat.st_mtime_ns, stat.st_size)
+                    return parsed
+                f.seek(0)
+                self._clear()
+                parsed = self._parse(f, complete=True)
+                self.reloads += 1
+            self._stat = (stat.st_mtime_ns, stat.st_size)
+            return parsed
+
+    def _clear(self):
+        self._by_id.clear()
+        self._by_bucket.clear()
+        self._by_location.clear()
+        self._columns = None
+        self._offset = 0
+        self._prefix = hashlib.blake2b()
+
+    def _prefix_matches(self, f):
+        """Whether the first _offset bytes of f are the ones parsed before"""
+        f.seek(0)
+        digest = hashlib.blake2b()
+        remaining = self._offset
+        while remaining:
+            chunk = f.read(min(_HASH_CHUNK, remaining))
+            if not chunk:
+                return False
+            digest.update(chunk)
+            remaining -= len(chunk)
+        return digest.digest() == self._prefix.digest()
+
+    def _parse(self, f, complete=False):
+        # While tailing only whole lines are parsed; a row still being written
+        # is picked up by a later refresh. A full load (complete=True) also
+        # parses a last row without a trailing newline.
+        start = f.tell()
+        data = f.read()
+        end = len(data) if complete else data.rfind(b"\n") + 1
+        if not end:
+            return 0
+        text = io.StringIO(data[:end].decode("utf-8"), newline="")
+        if self._columns is None:
+            reader = csv.DictReader(text)
+            self._columns = reader.fieldnames
+        else:
+            reader = csv.DictReader(text, fieldnames=self._columns)
+        parsed = 0
+        for row in reader:
+            if row.get("id"):
+                self._add(Listing(row))
+                parsed += 1
+        self._offset = start + end
+        self._prefix.update(data[:end])
+        return parsed
+
+    def _add(self, listing):
+        previous = self._by_id.get(listing.id)
+        if previous is not None:
+            self._by_bucket[self._bucket(previous.price)].discard(previous.id)
+            self._by_location[previous.city.lower()].discard(previous.id)
+        self._by_id[listing.id] = listing
+        self._by_bucket.setdefault(self._bucket(listing.price), set()).add(listing.id)
+        self._by_location.setdefault(listing.city.lower(), set()).add(listing.id)
+
+    def _bucket(self, price):
+        return int(price // self.bucket_size)
+
+    def get(self, listing_id):
+        return self._by_id.get(str(listing_id))
+
+    def query(self, min_price=None, max_price=None, location=None):
+        """Listings within a price range and/or in a city, ordered by price
+
+        location matches the city part case-insensitively ("Berkeley"
+        matches "Berkeley, CA").
+        """
+        with self._lock:
+            ids = None
+            if location is not None:
+                city = location.split(",")[0].strip().lower()
+                ids = set(self._by_location.get(city, ()))
+            if min_price is not None or max_price is not None:
+                low = self._bucket(min_price) if min_price is not None else None
+                high = self._bucket(max_price) if max_price is not None else None
+                in_range = set()
+                for bucket, bucket_ids in self._by_bucket.items():
+                    if low is not None and bucket < low:
+                        continue
+                    if high is not None and bucket > high:
+                        continue
+                    in_range.update(bucket_ids)
+                ids = in_range if ids is None else ids & in_range
+            listings = (
+                self._by_id.values() if ids is None else [self._by_id[i] for i in ids]
+            )
+            return sorted(
+                (
+                    listing
+                    for listing in listings
+                    if (min_price is None or listing.price >= min_price)
+                    and (max_price is None or listing.price <= max_price)
+                ),
+                key=lambda listing: (listing.price, listing.id),
+            )
+
+    def locations(self):
+        with self._lock:
+            return sorted({listing.location for listing in self._by_id.values()})
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+
+
+def negotiation_jobs(listings, budget_ratio=0.9, minimum_ratio=0.8):
+    """BatchNegotiationEngine jobs for a set of listings, with the buyer budget
+    and seller minimum set relative to each listed price"""
+    return [
+        (
+            listing.product_details(),
+            round(listing.price * budget_ratio),
+            round(listing.price * minimum_ratio),
+        )
+        for listing in listings
+    ]
+
+
+_default_store = None
+
+
+def get_store():
+    """Process-wide store over LISTINGS_PATH, refreshed on every call"""
+    global _default_store
+    if _default_store is None:
+        _default_store = ListingStore()
+    else:
+        _default_store.refresh()
+    return _default_store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the listing catalog")
+    parser.add_argument("--min-price", type=float)
+    parser.add_argument("--max-price", type=float)
+    parser.add_argument("--location")
+    args = parser.parse_args()
+
+    store = get_store()
+    matches = store.query(args.min_price, args.max_price, args.location)
+    print(f"{len(matches)} of {len(store)} listings")
+    for listing in matches:
+        print(
+            f"  {listing.id:>4}  ${listing.price:<8} {listing.location:<20} "
+            f"{listing.title}"
+        )
@@ -0,0 +1,408 @@
+from contextlib import contextmanager
+import os
+import random
+import re
+import threading
+import time
+
+# Every model call in the simulators goes through an LLMBackend. The default
+# talks to OpenAI; setting LLM_BACKEND=fake swaps in FakeBackend, a rule-based
+# stand-in that speaks the same reply formats as the real agents so whole
+# negotiations can run offline with a controllable latency.
+
+DEFAULT_MODEL = "gpt-4"
+
+_PRICE_PATTERN = re.compile(r"\$(\d+)")
+
+
+def count_tokens(text):
+    """Cheap token estimate (~4 characters per token)"""
+    return max(1, len(text) // 4) if text else 0
+
+
+class Completion:
+    """Text returned by a backend plus the usage numbers of the call"""
+
+    def __init__(
+        self,
+        content,
+        model,
+        prompt_tokens=0,
+        completion_tokens=0,
+        latency=0.0,
+        cached=False,
+    ):
+        self.content = content
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.latency = latency
+        self.cached = cached
+
+    def __repr__(self):
+        return f"Completion(model={self.model!r}, content={self.content!r})"
+
+
+class LLMBackend:
+    """Interface every model provider implements"""
+
+    def complete(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150):
+        raise NotImplementedError
+
+    def stream(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150):
+        """Yield the reply in chunks; backends without streaming yield it whole"""
+        yield self.complete(
+            messages, model=model, temperature=temperature, max_tokens=max_tokens
+        ).content
+
+    def run(self, agent, messages, temperature=0.7, max_tokens=None):
+        """Run a tool-less swarm Agent: its instructions become the system prompt"""
+        return self.complete(
+            [{"role": "system", "content": agent.instructions}, *messages],
+            model=agent.model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+
+
+class OpenAIBackend(LLMBackend):
+    """Chat completions against the OpenAI API
+
+    max_retries is passed to the client; get_backend sets it to 0 because the
+    scheduler retries with its own backoff. Without an explicit client, calls
+    lease one from a ClientPool of up to `pool_size` keep-alive clients, which
+    also caps the calls this backend has in flight.
+    """
+
+    def __init__(self, client=None, api_key=None, max_retries=None, pool_size=16):
+        self.client = client
+        self.pool = None
+        if client is None:
+            from client_pool import ClientPool
+
+            kwargs = {}
+            if api_key:
+                kwargs["api_key"] = api_key
+            if max_retries is not None:
+                kwargs["max_retries"] = max_retries
+            self.pool = ClientPool(lambda: _openai_client(**kwargs), size=pool_size)
+
+    @contextmanager
+    def _lease(self):
+        if self.pool is None:
+            yield self.client
+        else:
+            with self.pool.lease() as client:
+                yield client
+
+    def complete(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150):
+        start = time.perf_counter()
+        kwargs = {"model": model, "messages": messages, "temperature": temperature}
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+        with self._lease() as client:
+            response = client.chat.completions.create(**kwargs)
+        latency = time.perf_counter() - start
+        usage = response.usage
+        return Completion(
+            response.choices[0].message.content or "",
+            response.model,
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+            latency=latency,
+        )
+
+    def stream(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150):
+        kwargs = {"model": model, "messages": messages, "temperature": temperature}
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+        # The client stays leased until the stream is consumed or closed
+        with self._lease() as client:
+            response = client.chat.completions.create(stream=True, **kwargs)
+            try:
+                for chunk in response:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                # Closing the HTTP stream early stops the generation (and billing)
+                response.close()
+
+
+def _openai_client(**kwargs):
+    from openai import OpenAI
+
+    return OpenAI(**kwargs)
+
+
+class FakeRateLimitError(Exception):
+    """Raised by FakeBackend to simulate a provider 429"""
+
+    status_code = 429
+
+
+class FakeBackend(LLMBackend):
+    """Deterministic, rule-based model for offline runs and load tests
+
+    latency            fixed seconds slept per call
+    latency_per_token  extra seconds per completion token
+    latency_per_prompt_token
+                       extra seconds per prompt token (prefill cost)
+    jitter             +/- fraction applied to the latency (seeded)
+    padding_tokens     filler words appended to every reply to simulate
+                       longer outputs
+    script             optional list of canned replies used in order before
+                       falling back to the rules
+    error_rate         fraction of calls failing with FakeRateLimitError
+                       (seeded)
+    model_latency      latency multiplier per model name, to stand in for
+                       smaller, faster models (1 for unlisted models)
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        latency_per_token=0.0,
+        jitter=0.0,
+        padding_tokens=0,
+        script=None,
+        seed=0,
+        latency_per_prompt_token=0.0,
+        error_rate=0.0,
+        model_latency=None,
+    ):
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self.latency_per_prompt_token = latency_per_prompt_token
+        self.jitter = jitter
+        self.padding_tokens = padding_tokens
+        self.script = list(script or [])
+        self.error_rate = error_rate
+        self.model_latency = model_latency or {}
+        self.errors = 0
+        self.calls = 0
+        self.model_seconds = 0.0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _generate(self, messages, max_tokens):
+        with self._lock:
+            self.calls += 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors += 1
+                raise FakeRateLimitError("Rate limit reached (fake)")
+            content = self.script.pop(0) if self.script else None
+            jitter = self._random.uniform(-self.jitter, self.jitter)
+        if content is None:
+            content = self.reply(messages)
+        if self.padding_tokens:
+            content += " " + " ".join(["ok"] * self.padding_tokens)
+        if max_tokens and count_tokens(content) > max_tokens:
+            content = content[: max_tokens * 4]
+        return content, 1 + jitter
+
+    def complete(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150):
+        content, scale = self._generate(messages, max_tokens)
+        scale *= self.model_latency.get(model, 1)
+        prompt_tokens = sum(count_tokens(m["content"]) for m in messages)
+        completion_tokens = count_tokens(content)
+        latency = (
+            self.latency
+            + self.latency_per_prompt_token * prompt_tokens
+            + self.latency_per_token * completion_tokens
+        ) * scale
+        if latency > 0:
+            time.sleep(latency)
+        with self._lock:
+            self.model_seconds += latency
+        return Completion(
+            content,
+            model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            latency=latency,
+        )
+
+    def stream(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150):
+        """Yield the reply word by word: the fixed and prefill latency before the
+        first word, then `latency_per_token` per token"""
+        content, scale = self._generate(messages, max_tokens)
+        scale *= self.model_latency.get(model, 1)
+        words = re.findall(r"\S+\s*", content)
+        prompt_tokens = sum(count_tokens(m["content"]) for m in messages)
+        elapsed = (self.latency + self.latency_per_prompt_token * prompt_tokens) * scale
+        try:
+            if elapsed > 0:
+                time.sleep(elapsed)
+            for word in words:
+                delay = self.latency_per_token * count_tokens(word) * scale
+                if delay > 0:
+                    time.sleep(delay)
+                    elapsed += delay
+                yield word
+        finally:
+            with self._lock:
+                self.model_seconds += elapsed
+
+    def reply(self, messages):
+        """Pick a reply from the shape of the prompt"""
+        system = messages[0]["content"] if messages[0]["role"] == "system" else ""
+        if "VERIFICATION:" in system:
+            return "VERIFICATION: YES\nREASON: The listing meets marketplace standards."
+        if "negotiating as the buyer" in system:
+            return self._agent_buyer(_prompt_text(messages))
+        if "negotiating as the seller" in system:
+            return self._agent_seller(_prompt_text(messages))
+        if "answering several buyers" in system:
+            return self._agent_seller_batch(_prompt_text(messages))
+        return self._chat(system, messages)
+
+    def _agent_buyer(self, prompt):
+        budget = int(re.search(r"Budget: \$(\d+)", prompt).group(1))
+        current = int(re.search(r"Current price: \$(\d+)", prompt).group(1))
+        offer = current if current <= budget else min(budget, int(current * 0.9))
+        return f"I offer ${offer} because that is what fits my budget."
+
+    def _agent_seller(self, prompt):
+        minimum = int(re.search(r"Minimum acceptable price: \$(\d+)", prompt).group(1))
+        offer = int(re.search(r"Current offer: \$(\d+)", prompt).group(1))
+        if offer >= minimum:
+            return "ACCEPT: That works for me, it's yours."
+        return f"COUNTER: ${minimum} is the lowest I can go."
+
+    def _agent_seller_batch(self, prompt):
+        # The highest offer at or above the minimum wins the item
+        minimum = int(re.search(r"Minimum acceptable price: \$(\d+)", prompt).group(1))
+        offers = {
+            number: int(offer)
+            for number, offer in re.findall(r"Buyer (\d+): \$(\d+)", prompt)
+        }
+        winner = max(offers, key=offers.get) if offers else None
+        lines = []
+        for number, offer in offers.items():
+            if offer < minimum:
+                lines.append(f"{number}: COUNTER: ${minimum} is the lowest I can go.")
+            elif number == winner:
+                lines.append(f"{number}: ACCEPT: That works for me, it's yours.")
+            else:
+                lines.append(f"{number}: REJECT: I've accepted a better offer.")
+        return "\n".join(lines)
+
+    def _chat(self, system, messages):
+        """Texting-style buyer/seller used by multi_sim"""
+        seller = "as the SELLER" in system or "marketplace seller" in system
+        history = [m["content"] for m in messages if m["role"] != "system"]
+        if not history or "Start the conversation" in history[-1]:
+            listed = _PRICE_PATTERN.findall(history[-1]) if history else []
+            price = f" for ${listed[-1]}" if listed else ""
+            return f"Hi! I saw your listing{price}. What condition is it in?"
+
+        theirs = _PRICE_PATTERN.findall(history[-1])
+        mine = [p for m in history[-2::-2] for p in _PRICE_PATTERN.findall(m)]
+        if seller:
+            if not mine:
+                asked = _PRICE_PATTERN.findall(" ".join(history))
+                ask = asked[0] if asked else "the listed price"
+                ask = f"${ask}" if asked else ask
+                return f"It's in great shape, everything works. Asking {ask}."
+            ask = int(mine[0])
+            if theirs and int(theirs[-1]) >= ask * 0.9:
+                return f"Deal! Sold for ${theirs[-1]}."
+            offer = int(theirs[-1]) if theirs else int(ask * 0.8)
+            return f"I could do ${(offer + ask) // 2}, that's a fair price."
+
+        if not theirs:
+            return "Sounds good. What's the lowest you'd take?"
+        asked = int(theirs[-1])
+        if mine and asked <= int(mine[0]) * 1.1:
+            return f"Deal, ${asked} works for me!"
+        offer = int(mine[0]) + (asked - int(mine[0])) // 2 if mine else int(asked * 0.8)
+        return f"Would you take ${offer}?"
+
+
+def _prompt_text(messages):
+    # Agent state lives in the system prompt or in a context message
+    return "\n".join(m["content"] for m in messages)
+
+
+_default_backend = None
+# Serialises creation so threads asking for the backend at once share one
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Process-wide backend chosen by the LLM_BACKEND environment variable
+
+    Deterministic (temperature 0) calls are answered from a response cache
+    unless LLM_CACHE=0; LLM_CACHE_PATH adds a persistent SQLite tier. Calls
+    that reach the provider go through a CallScheduler enforcing LLM_RPM and
+    LLM_TPM (unlimited when unset) and retrying rate limits and transient
+    errors. Every call is recorded by the instrumentation recorder unless
+    INSTRUMENTATION=0. OpenAI calls share LLM_POOL_SIZE pooled clients.
+    LLM_ROUTING names a model_router policy that picks the model and
+    max_tokens of each call by negotiation stage.
+    """
+    global _default_backend
+    if _default_backend is None:
+        with _backend_lock:
+            if _default_backend is None:
+                _default_backend = _create_backend()
+    return _default_backend
+
+
+def _create_backend():
+    # .env is read here rather than at import so LLM_BACKEND, OPENAI_API_KEY
+    # and the limits can live there without every importer paying for it
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    name = os.getenv("LLM_BACKEND", "openai").lower()
+    if name == "fake":
+        backend = FakeBackend(
+            latency=float(os.getenv("FAKE_LLM_LATENCY", "0")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+        )
+    elif name == "openai":
+        backend = OpenAIBackend(
+            max_retries=0, pool_size=int(os.getenv("LLM_POOL_SIZE", "16"))
+        )
+    else:
+        raise ValueError(f"Unknown LLM_BACKEND: {name}")
+
+    from scheduler import CallScheduler, ScheduledBackend
+
+    rpm = os.getenv("LLM_RPM")
+    tpm = os.getenv("LLM_TPM")
+    backend = ScheduledBackend(
+        backend,
+        CallScheduler(
+            rpm=float(rpm) if rpm else None, tpm=float(tpm) if tpm else None
+        ),
+    )
+
+    if os.getenv("LLM_CACHE", "1") != "0":
+        from llm_cache import CachedBackend, ResponseCache
+
+        cache = ResponseCache(
+            path=os.getenv("LLM_CACHE_PATH"),
+            ttl=float(os.getenv("LLM_CACHE_TTL", str(24 * 3600))),
+        )
+        backend = CachedBackend(backend, cache)
+
+    if os.getenv("INSTRUMENTATION", "1") != "0":
+        from instrumentation import InstrumentedBackend
+
+        backend = InstrumentedBackend(backend)
+
+    routing = os.getenv("LLM_ROUTING")
+    if routing:
+        from model_router import RoutedBackend
+
+        backend = RoutedBackend(backend, routing)
+    return backend
+
+
+def set_backend(backend):
+    """Override the process-wide backend (tests, benchmarks, load runs)"""
+    global _default_backend
+    with _backend_lock:
+        _default_backend = backend
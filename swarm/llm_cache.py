@@ -0,0 +1,199 @@
+from collections import OrderedDict
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from llm_backend import LLMBackend, Completion, DEFAULT_MODEL
+
+# Content-addressed response cache. Entries are keyed on everything that
+# determines a completion (model, messages, temperature, max_tokens) and live in
+# an in-memory LRU, optionally backed by a SQLite file so re-running a catalog
+# simulation does not pay for the same verification calls again.
+
+
+def cache_key(model, messages, temperature, max_tokens):
+    """Stable hash of a chat completion request"""
+    payload = json.dumps(
+        [model, messages, temperature, max_tokens],
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier (memory LRU + optional SQLite) cache with TTL and size limits"""
+
+    def __init__(self, max_entries=1024, ttl=24 * 3600, path=None, max_disk_entries=100_000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)"
+            )
+            self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    self._db.execute(
+                        "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+                    )
+                    # Commit right away: an open transaction would hold the
+                    # write lock and lock out other processes sharing the file
+                    self._db.commit()
+                    value = json.loads(row[0])
+                    self._remember(key, row[1], value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+                if row:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), expires_at, now),
+                )
+                self._evict_disk(now)
+                self._db.commit()
+
+    def _remember(self, key, expires_at, value):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _evict_disk(self, now):
+        self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        (count,) = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            self._db.execute(
+                """DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY accessed_at LIMIT ?
+                )""",
+                (overflow,),
+            )
+            self.evictions += overflow
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._memory),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class CachedBackend(LLMBackend):
+    """Serves repeated deterministic requests from a ResponseCache
+
+    Only temperature-0 calls are cached by default: sampled turns are meant to
+    differ between runs. Pass cache_sampled=True to cache everything.
+    """
+
+    def __init__(self, backend, cache=None, cache_sampled=False):
+        self.backend = backend
+        self.cache = cache if cache is not None else ResponseCache()
+        self.cache_sampled = cache_sampled
+
+    def complete(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150):
+        if temperature != 0 and not self.cache_sampled:
+            return self.backend.complete(
+                messages, model=model, temperature=temperature, max_tokens=max_tokens
+            )
+
+        key = cache_key(model, messages, temperature, max_tokens)
+        value = self.cache.get(key)
+        if value is not None:
+            return Completion(
+                value["content"],
+                value["model"],
+                prompt_tokens=value["prompt_tokens"],
+                completion_tokens=value["completion_tokens"],
+                cached=True,
+            )
+
+        completion = self.backend.complete(
+            messages, model=model, temperature=temperature, max_tokens=max_tokens
+        )
+        self.cache.put(
+            key,
+            {
+                "content": completion.content,
+                "model": completion.model,
+                "prompt_tokens": completion.prompt_tokens,
+                "completion_tokens": completion.completion_tokens,
+            },
+        )
+        return completion
+
+    def stream(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150):
+        if temperature != 0 and not self.cache_sampled:
+            return self.backend.stream(
+                messages, model=model, temperature=temperature, max_tokens=max_tokens
+            )
+        return super().stream(
+            messages, model=model, temperature=temperature, max_tokens=max_tokens
+        )
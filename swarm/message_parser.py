@@ -0,0 +1,301 @@
+import re
+import sys
+import timeit
+
+# Shared offer/verdict parsing for both simulators. classify_message handles
+# the simulators' per-turn calls with one lower-cased copy, one price scan and
+# substring lookups for the verdict words; classify_batch finds prices and
+# verdict words with one precompiled pattern over a single joined buffer when
+# reprocessing conversation logs.
+
+TEXT = "text"
+OFFER = "offer"
+COUNTER = "counter"
+ACCEPTED = "accepted"
+REJECTED = "rejected"
+
+_SEPARATOR = "\x00"
+
+# Matched against lower-cased text. Every branch starts with a bare literal
+# (outside its group) so the regex engine can skip straight to candidate
+# characters; word starts and negations ("no deal", "won't accept") are
+# checked on the few hits in Python.
+_TOKENS = re.compile(
+    r"\$\s?(\d{1,3}(?:,\d{3})+|\d+)(\.\d+)?(k\b)?"  # groups 1-3: price
+    r"|a(ccept(?:ed|s)?)\b|d(eal)\b|s(old)\b"  # groups 4-6: acceptance
+    r"|r(eject(?:ed|s)?)\b"  # group 7: rejection
+)
+_ACCEPT_GROUP = 4
+_REJECT_GROUP = 7
+_NEGATIONS = ("no ", "not ", "n't ")
+_VERDICT = re.compile(r"\s*(accept|counter|reject)\s*:")
+_VERDICTS = {"accept": ACCEPTED, "counter": COUNTER, "reject": REJECTED}
+# classify_message's word lookup, as in _TOKENS: (stem, whether "-ed"/"-s" may
+# follow it, whether it is an acceptance that a preceding negation cancels)
+_WORDS = (
+    ("accept", True, True),
+    ("deal", False, True),
+    ("sold", False, True),
+    ("reject", True, False),
+)
+_PRICE = re.compile(r"\$\s?(\d{1,3}(?:,\d{3})+|\d+)(\.\d+)?([kK]\b)?")
+_VERIFICATION = re.compile(r"VERIFICATION:\s*\[?\s*(YES|NO)\b", re.IGNORECASE)
+_BARE_NO = re.compile(r"\bno\b", re.IGNORECASE)
+_REPLY_LINE = re.compile(
+    r"^\s*(?:buyer\s*)?(\d+)\s*[:.)]\s*(.*\S)", re.IGNORECASE | re.MULTILINE
+)
+
+
+def _amount(whole, cents, k):
+    if cents is None and k is None and "," not in whole:
+        return int(whole)
+    value = float(whole.replace(",", "") + (cents or ""))
+    if k:
+        value *= 1000
+    elif cents is None or len(cents) <= 3:
+        # Already at most two decimals; round() would not change it
+        return int(value) if value.is_integer() else value
+    return int(value) if value.is_integer() else round(value, 2)
+
+
+def parse_price(message, last=False):
+    """First (or last) dollar amount in a message: "$1,200", "$99.50", "$1.5k" """
+    if last:
+        match = None
+        for match in _PRICE.finditer(message):
+            pass
+    else:
+        match = _PRICE.search(message)
+    return _amount(*match.groups()) if match else None
+
+
+def parse_verification(message):
+    """True when a verifier reply approves the product"""
+    match = _VERIFICATION.search(message)
+    if match:
+        return match.group(1).upper() == "YES"
+    return not _BARE_NO.search(message)
+
+
+def verification_given(message):
+    """True when a verifier reply has the VERIFICATION: YES/NO line at all"""
+    return _VERIFICATION.search(message) is not None
+
+
+def split_replies(message):
+    """Per-buyer replies in a batched seller message, {buyer number: reply}
+
+    Each reply is a line starting with the buyer's number ("2: COUNTER: $950
+    ..." or "Buyer 2: ..."); other lines are ignored.
+    """
+    return {
+        int(match.group(1)): match.group(2)
+        for match in _REPLY_LINE.finditer(message)
+    }
+
+
+def _result(verdict, accepted, rejected, price):
+    if price is not None:
+        price = _amount(*price.group(1, 2, 3))
+    if verdict == "accept" or (verdict is None and accepted):
+        return ACCEPTED, price
+    if verdict == "reject" or (verdict is None and rejected):
+        return REJECTED, price
+    if verdict == "counter":
+        return COUNTER, price
+    if price is not None:
+        return OFFER, price
+    return TEXT, None
+
+
+def _word_ends(text, position, inflected):
+    """Whether a word ends at `position` (re's \\b after a word character),
+    allowing an "-ed" or "-s" ending when `inflected`"""
+    if position == len(text):
+        return True
+    char = text[position]
+    if not (char.isalnum() or char == "_"):
+        return True
+    if not inflected:
+        return False
+    if text.startswith("ed", position):
+        return _word_ends(text, position + 2, False)
+    return char == "s" and _word_ends(text, position + 1, False)
+
+
+def classify_message(message, last_price=True):
+    """Single-pass classification of a message into (type, price)
+
+    An explicit "ACCEPT:" / "COUNTER:" / "REJECT:" prefix wins; otherwise
+    acceptance words ("deal", "sold", "accepted") beat rejection words, and a
+    message that only names a price is an offer. `last_price` picks the last
+    dollar amount (multi_sim's convention) instead of the first.
+    """
+    lowered = message.lower()
+    price = None
+    if "$" in lowered:
+        prices = _PRICE.findall(lowered)
+        if prices:
+            whole, cents, k = prices[-1] if last_price else prices[0]
+            if cents or k or "," in whole:
+                price = _amount(whole, cents or None, k or None)
+            else:
+                price = int(whole)
+
+    if ":" in lowered:
+        # What _VERDICT matches: a verdict word alone before the first colon
+        verdict = _VERDICTS.get(lowered.partition(":")[0].strip())
+        if verdict:
+            return verdict, price
+
+    # Verdict words are looked up with str.find rather than a regex scan that
+    # stops at every "a", "d", "s" and "r"; word starts, endings and negations
+    # are only checked where a stem occurs
+    if (
+        "accept" in lowered
+        or "deal" in lowered
+        or "sold" in lowered
+        or "reject" in lowered
+    ):
+        rejected = False
+        for stem, inflected, negatable in _WORDS:
+            position = lowered.find(stem)
+            while position != -1:
+                if (
+                    not (position and lowered[position - 1].isalnum())
+                    and _word_ends(lowered, position + len(stem), inflected)
+                    and not (negatable and lowered.endswith(_NEGATIONS, 0, position))
+                ):
+                    if negatable:
+                        return ACCEPTED, price
+                    rejected = True
+                    break
+                position = lowered.find(stem, position + 1)
+        if rejected:
+            return REJECTED, price
+
+    if price is not None:
+        return OFFER, price
+    return TEXT, None
+
+
+def classify_batch(messages, last_price=True):
+    """Classify many messages with one regex scan over a joined buffer"""
+    if not isinstance(messages, (list, tuple)):
+        messages = list(messages)
+    # Lower-case each message before joining: lower() can change a string's
+    # length ("İ" becomes two characters), and the ends are offsets into the
+    # lower-cased buffer
+    lowered = [message.lower() for message in messages]
+    buffer = _SEPARATOR.join(lowered)
+    results = []
+    ends = []
+    position = -1
+    for message in lowered:
+        position += len(message) + 1
+        ends.append(position)
+
+    index = 0
+    start = 0
+    end = ends[0] if ends else 0
+    verdict = _VERDICT.match(buffer, 0, end)
+    verdict = verdict and verdict.group(1)
+    accepted = rejected = False
+    price = None
+    for match in _TOKENS.finditer(buffer):
+        position = match.start()
+        while position > end:
+            results.append(_result(verdict, accepted, rejected, price))
+            index += 1
+            start = end + 1
+            end = ends[index]
+            verdict = _VERDICT.match(buffer, start, end)
+            verdict = verdict and verdict.group(1)
+            accepted = rejected = False
+            price = None
+
+        group = match.lastindex
+        if group >= _ACCEPT_GROUP:
+            if position > start and buffer[position - 1].isalnum():
+                continue
+            if group == _REJECT_GROUP:
+                rejected = True
+            elif not buffer.endswith(_NEGATIONS, start, position):
+                accepted = True
+        elif price is None or last_price:
+            price = match
+
+    while index < len(messages):
+        results.append(_result(verdict, accepted, rejected, price))
+        index += 1
+        if index < len(messages):
+            start = end + 1
+            end = ends[index]
+            verdict = _VERDICT.match(buffer, start, end)
+            verdict = verdict and verdict.group(1)
+            accepted = rejected = False
+            price = None
+    return results
+
+
+def log_type(kind, price):
+    """Map a classification onto the conversation CSV `type` column"""
+    if kind == ACCEPTED:
+        return "accepted"
+    if price is not None:
+        return "offer"
+    return "text"
+
+
+if __name__ == "__main__":
+    samples = [
+        "I offer $850 because the sofa needs some reupholstering.",
+        "COUNTER: $950 is the lowest I can do for a piece like this.",
+        "ACCEPT: Sounds good, it's yours for $900.",
+        "REJECT: That's far too low for the condition it's in.",
+        "Deal! Sold for $1,150.50.",
+        "Hey, is this still available? What's the condition like?",
+        "Would you take $1.2k if I pick it up today?",
+    ]
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    messages = (samples * (count // len(samples) + 1))[:count]
+
+    # What multi_sim did with each message before: extract_price (integer
+    # prices only), the substring checks choosing the logged type, then the
+    # separate deal check, re-reading the price on a deal; for comparison.
+    def extract_price(message):
+        price_matches = re.findall(r"\$(\d+)", message)
+        if price_matches:
+            return int(price_matches[-1])
+        return None
+
+    def legacy_classify(message):
+        price = extract_price(message)
+        message_type = "text"
+        if "deal" in message.lower() or "sold" in message.lower():
+            message_type = "accepted"
+        elif price:
+            message_type = "offer"
+        if "deal" in message.lower() or "sold" in message.lower():
+            price = extract_price(message)
+        return message_type, price
+
+    def per_message(classify):
+        def run():
+            for message in messages:
+                classify(message)
+
+        return run
+
+    timings = [
+        ("multi_sim before", per_message(legacy_classify)),
+        ("classify_message", per_message(classify_message)),
+        ("classify_batch", lambda: classify_batch(messages)),
+    ]
+    print(f"Classifying {count} messages")
+    for name, fn in timings:
+        seconds = min(timeit.repeat(fn, number=1, repeat=3))
+        print(
+            f"  {name:<24} {seconds * 1e6 / count:6.2f} us/msg"
+            f"  {count / seconds:12,.0f} msg/s"
+        )
@@ -0,0 +1,192 @@
+from collections import Counter
+import threading
+
+from instrumentation import current_tags
+from llm_backend import LLMBackend, DEFAULT_MODEL
+from message_parser import (
+    ACCEPTED,
+    COUNTER,
+    REJECTED,
+    classify_message,
+    parse_price,
+    verification_given,
+)
+
+# Per-stage model routing. Every call is tagged with what it is for, and a
+# routing policy maps the four stages of a negotiation onto a model and a
+# max_tokens budget:
+#   verification  the verifier's YES/NO check
+#   opening       the buyer's first message or offer
+#   counter       the turns in between
+#   closing       the turns of the last round
+# Short structured replies can go to a small, fast model; a route without a
+# model keeps the model (and max_tokens) the caller asked for, which is what
+# every call ran on before routing. When a small model's reply does not parse
+# as what the call site expects (tagged `expect`), an escalating route makes
+# the call again as the caller asked for it, and that reply is used instead.
+# RoutedBackend sits outside the instrumentation, so both attempts are
+# recorded under the model that actually served them.
+
+STAGES = ("verification", "opening", "counter", "closing")
+
+
+SMALL_MODEL = "gpt-4o-mini"
+
+
+class Route:
+    """Model and max_tokens for one stage, and whether a reply that does not
+    parse is retried on the caller's model
+
+    No model means the caller's model. max_tokens caps the caller's limit;
+    None leaves it as the caller set it.
+    """
+
+    __slots__ = ("model", "max_tokens", "escalate")
+
+    def __init__(self, model=None, max_tokens=None, escalate=False):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.escalate = escalate
+
+    def limit(self, max_tokens):
+        """max_tokens for a call whose caller asked for `max_tokens`"""
+        if self.max_tokens is None:
+            return max_tokens
+        return min(self.max_tokens, max_tokens) if max_tokens else self.max_tokens
+
+    def __repr__(self):
+        escalation = " -> caller's model" if self.escalate else ""
+        return (
+            f"Route({self.model or 'caller'}, {self.max_tokens or 'caller'} "
+            f"tokens{escalation})"
+        )
+
+
+ROUTING_POLICIES = {
+    # Every call as the caller asked for it, as before routing
+    "large": {stage: Route() for stage in STAGES},
+    # Small model for the verdict-style stages, the caller's model to negotiate
+    "tiered": {
+        "verification": Route(SMALL_MODEL, 40, escalate=True),
+        "opening": Route(SMALL_MODEL, 80, escalate=True),
+        "counter": Route(),
+        "closing": Route(),
+    },
+    # Small model everywhere, escalating whatever does not parse
+    "small": {
+        "verification": Route(SMALL_MODEL, 40, escalate=True),
+        "opening": Route(SMALL_MODEL, 80, escalate=True),
+        "counter": Route(SMALL_MODEL, escalate=True),
+        "closing": Route(SMALL_MODEL, 100, escalate=True),
+    },
+}
+
+
+def _is_offer(reply):
+    return parse_price(reply) is not None
+
+
+def _is_verdict(reply):
+    """ACCEPT, REJECT, or a COUNTER that names a price"""
+    verdict, price = classify_message(reply, last_price=False)
+    return verdict in (ACCEPTED, REJECTED) or (verdict == COUNTER and price is not None)
+
+
+# Parse checks by `expect` tag; verification calls are always checked
+PARSE_CHECKS = {
+    "verification": verification_given,
+    "offer": _is_offer,
+    "verdict": _is_verdict,
+}
+
+_STAGE_ROUTES = {
+    "verification": "verification",
+    "opening": "opening",
+    "negotiation": "counter",
+}
+
+
+def turn_route(round_num, max_rounds, role):
+    """Route of a negotiation turn in 0-based round `round_num`"""
+    if round_num == max_rounds - 1:
+        return "closing"
+    if round_num == 0 and role == "buyer":
+        return "opening"
+    return "counter"
+
+
+def route_of(labels):
+    """Stage a call is routed by: its `route` tag, else derived from `stage`"""
+    return labels.get("route") or _STAGE_ROUTES.get(labels.get("stage"))
+
+
+class RoutedBackend(LLMBackend):
+    """Picks model and max_tokens per stage from a routing policy
+
+    Calls without a stage the policy knows keep the model they asked for.
+    Streams are routed but never escalated, since their tokens have already
+    been shown by the time the reply could be checked.
+    """
+
+    def __init__(self, backend, policy="tiered"):
+        self.backend = backend
+        if isinstance(policy, str):
+            if policy not in ROUTING_POLICIES:
+                raise ValueError(f"Unknown routing policy: {policy}")
+            self.policy, self.routes = policy, ROUTING_POLICIES[policy]
+        else:
+            self.policy, self.routes = "custom", policy
+        self.calls = Counter()
+        self.escalations = Counter()
+        self._lock = threading.Lock()
+
+    def complete(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150):
+        labels = current_tags()
+        stage = route_of(labels)
+        route = self.routes.get(stage)
+        if route is None:
+            return self.backend.complete(
+                messages, model=model, temperature=temperature, max_tokens=max_tokens
+            )
+        with self._lock:
+            self.calls[stage] += 1
+        routed_model = route.model or model
+        routed_tokens = route.limit(max_tokens)
+        completion = self.backend.complete(
+            messages,
+            model=routed_model,
+            temperature=temperature,
+            max_tokens=routed_tokens,
+        )
+        if not route.escalate or (routed_model, routed_tokens) == (model, max_tokens):
+            return completion
+        expect = labels.get("expect") or (stage == "verification" and stage)
+        check = PARSE_CHECKS.get(expect)
+        if check is None or check(completion.content):
+            return completion
+        with self._lock:
+            self.escalations[stage] += 1
+        return self.backend.complete(
+            messages, model=model, temperature=temperature, max_tokens=max_tokens
+        )
+
+    def stream(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150):
+        route = self.routes.get(route_of(current_tags()))
+        if route is not None:
+            model, max_tokens = route.model or model, route.limit(max_tokens)
+        return self.backend.stream(
+            messages, model=model, temperature=temperature, max_tokens=max_tokens
+        )
+
+    def stats(self):
+        """Routed calls and escalations per stage"""
+        with self._lock:
+            return {
+                stage: {
+                    "model": self.routes[stage].model or "caller",
+                    "calls": self.calls[stage],
+                    "escalations": self.escalations[stage],
+                }
+                for stage in STAGES
+                if stage in self.routes
+            }
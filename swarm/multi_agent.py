@@ -1,23 +1,37 @@
-from swarm import Swarm, Agent
-import os
-from dotenv import load_dotenv
-import csv
-from datetime import datetime
+import sys
+import time
 import uuid
 
-load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-
-client = Swarm()
+from agent_registry import AGENTS
+from checkpoint import SessionProgress
+from conversation_log import create_conversation_file, log_message, end_conversation
+from instrumentation import end_session, tags
+from llm_backend import get_backend
+from message_parser import (
+    ACCEPTED,
+    REJECTED,
+    classify_message,
+    parse_price,
+    parse_verification,
+)
+from model_router import turn_route
+from session_state import MessageKind, MessageRecord, Sender
+from speculation import speculate
+
+# The backend (and with it .env loading and the OpenAI client) is created on
+# the first model call, not at import, so importing extract_offer or the turn
+# helpers stays cheap for workers that never call a model.
 
 # Previous implementation with swarm
 
 
 def product_verification_agent():
     """Agent responsible for verifying product details and authenticity"""
+    from swarm import Agent
+
     return Agent(
         name="Product Verification Agent",
-        system_prompt="""Verify this product's details, authenticity, and marketplace standards. 
+        instructions="""Verify this product's details, authenticity, and marketplace standards. 
         Report any concerns or issues immediately.""",
         tools=[],
     )
@@ -25,9 +39,11 @@ def product_verification_agent():
 
 def price_negotiation_agent():
     """Agent managing the price negotiation process"""
+    from swarm import Agent
+
     return Agent(
         name="Price Negotiation Agent",
-        system_prompt="""Facilitate price negotiations professionally. Make or evaluate offers based on 
+        instructions="""Facilitate price negotiations professionally. Make or evaluate offers based on 
         market value and budget constraints.""",
         tools=[],
     )
@@ -35,47 +51,395 @@ def price_negotiation_agent():
 
 def negotiation_abort_agent():
     """Agent handling negotiation termination"""
+    from swarm import Agent
+
     return Agent(
         name="Negotiation Abort Agent",
-        system_prompt="""Handle negotiation termination professionally and document the reason.""",
+        instructions="""Handle negotiation termination professionally and document the reason.""",
         tools=[],
     )
 
 
-def create_conversation_file(conversation_id):
-    """Create a new conversation CSV file"""
-    filepath = f"../marketplace/src/data/conversations/{conversation_id}.csv"
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-
-    with open(filepath, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["dateTime", "content", "sender", "type", "price"])
-
-
-def log_message(conversation_id, message):
-    """Log a message to the conversation CSV file"""
-    filepath = f"../marketplace/src/data/conversations/{conversation_id}.csv"
-    with open(filepath, "a", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(
-            [
-                message["dateTime"],
-                message["content"],
-                message["sender"],
-                message.get("type", "text"),
-                message.get("price", ""),
-            ]
-        )
+def verifier_turn(user_role, product_details, user_instruction=""):
+    """Shared verification agent and the messages for one verification"""
+    return AGENTS.turn(
+        "verifier",
+        f"Verify this product: {product_details}"
+        + (f"\nUser concerns: {user_instruction}" if user_instruction else ""),
+        user_role=user_role,
+    )
+
+
+def buyer_turn(product_name, buyer_budget, current_price, user_instruction=""):
+    """Shared buyer agent and the messages asking it for an offer"""
+    return AGENTS.turn(
+        "buyer",
+        f"Make an offer for the {product_name} currently at ${current_price}.",
+        user_instruction,
+        buyer_budget=buyer_budget,
+        current_price=current_price,
+    )
+
+
+def seller_turn(seller_min_price, buyer_offer, user_instruction=""):
+    """Shared seller agent and the messages asking it to answer an offer"""
+    return AGENTS.turn(
+        "seller",
+        f"Respond to buyer's offer of ${buyer_offer}",
+        user_instruction,
+        seller_min_price=seller_min_price,
+        buyer_offer=buyer_offer,
+    )
+
+
+def seller_batch_turn(seller_min_price, offers, user_instruction=""):
+    """Shared seller agent and the messages asking it to answer several buyers
+    in one call; `offers` maps buyer numbers to their offers"""
+    return AGENTS.turn(
+        "seller_batch",
+        f"Respond to the offers from buyers {', '.join(map(str, offers))}.",
+        user_instruction,
+        seller_min_price=seller_min_price,
+        offers="\n".join(
+            f"Buyer {number}: ${offer}" for number, offer in offers.items()
+        ),
+    )
 
 
 def marketplace_negotiation(
-    product_details, buyer_budget, seller_min_price, user_role="buyer", interactive=True
+    product_details,
+    buyer_budget,
+    seller_min_price,
+    user_role="buyer",
+    interactive=True,
+    arbiter=None,
+    speculative=False,
 ):
-    """Orchestrates the marketplace interaction between agents"""
+    """Orchestrates the marketplace interaction between agents
+
+    With a NegotiationArbiter, outcomes that are already determined by the
+    budget and minimum are settled without further model calls. With
+    speculative=True the first buyer offer is generated while verification
+    runs, and discarded if verification fails.
+    """
     # Create new conversation
     conversation_id = str(uuid.uuid4())
     create_conversation_file(conversation_id)
+    try:
+        with tags(session=conversation_id):
+            return _negotiate(
+                conversation_id,
+                product_details,
+                buyer_budget,
+                seller_min_price,
+                user_role,
+                interactive,
+                arbiter,
+                speculative,
+            )
+    finally:
+        end_conversation(conversation_id)
+        end_session(conversation_id)
+
+
+class ModelCall:
+    """One model call of a negotiation: agent, messages, temperature and the
+    instrumentation tags it runs under"""
+
+    __slots__ = ("agent", "messages", "temperature", "labels")
+
+    def __init__(self, agent, messages, temperature=0.7, **labels):
+        self.agent = agent
+        self.messages = messages
+        self.temperature = temperature
+        self.labels = labels
+
+    def run(self):
+        """Make the call on the shared backend and return the reply text"""
+        with tags(**self.labels):
+            return (
+                get_backend()
+                .run(self.agent, self.messages, temperature=self.temperature)
+                .content
+            )
 
+
+class NegotiationRounds:
+    """Verification and the price rounds of one negotiation, shared by the
+    blocking and the asyncio drivers
+
+    steps() is a generator yielding lists of ModelCalls; the driver makes the
+    calls and sends their replies back as a list in the same order. Calls in
+    one list do not depend on each other and may run concurrently. The
+    generator returns the negotiation's result. Logging, the arbiter and the
+    SessionProgress bookkeeping happen here; `instruction(stage)` supplies the
+    user's instructions, `say` reports progress and `on_progress` is called
+    whenever `progress` has changed.
+    """
+
+    def __init__(
+        self,
+        conversation_id,
+        product_details,
+        buyer_budget,
+        seller_min_price,
+        user_role="buyer",
+        max_rounds=5,
+        arbiter=None,
+        speculative=False,
+        progress=None,
+        instruction=None,
+        say=None,
+        on_progress=None,
+    ):
+        self.conversation_id = conversation_id
+        self.product_details = product_details
+        self.buyer_budget = buyer_budget
+        self.seller_min_price = seller_min_price
+        self.user_role = user_role
+        self.max_rounds = max_rounds
+        self.arbiter = arbiter
+        self.speculative = speculative
+        self.progress = progress or SessionProgress(conversation_id)
+        self.instruction = instruction or (lambda stage: "")
+        self.say = say or (lambda text: None)
+        self.on_progress = on_progress or (lambda: None)
+        # Set when a speculative opening was made but verification failed
+        self.discarded_opening = False
+
+    def buyer_call(self, round_num, current_price, user_instruction=""):
+        return ModelCall(
+            *buyer_turn(
+                self.product_details["name"],
+                self.buyer_budget,
+                current_price,
+                user_instruction if self.user_role == "buyer" else "",
+            ),
+            stage="negotiation",
+            round=round_num + 1,
+            role="buyer",
+            route=turn_route(round_num, self.max_rounds, "buyer"),
+            expect="offer",
+        )
+
+    def seller_call(self, round_num, buyer_offer, user_instruction=""):
+        return ModelCall(
+            *seller_turn(
+                self.seller_min_price,
+                buyer_offer,
+                user_instruction if self.user_role == "seller" else "",
+            ),
+            stage="negotiation",
+            round=round_num + 1,
+            role="seller",
+            route=turn_route(round_num, self.max_rounds, "seller"),
+            expect="verdict",
+        )
+
+    def _log(self, record):
+        log_message(self.conversation_id, record)
+
+    def _end_round(self, round_num, current_price):
+        progress = self.progress
+        progress.round = round_num + 1
+        progress.current_price = current_price
+        progress.pending_offer = None
+        self.on_progress()
+
+    def _agreed(self, price, ruling=None):
+        if ruling:
+            self.say(f"\n⚖️  Arbiter: {ruling.reason}")
+        self.say(f"\n✅ Deal agreed at ${price}!")
+
+    def steps(self):
+        arbiter, progress, say = self.arbiter, self.progress, self.say
+        max_rounds = self.max_rounds
+        ruling = arbiter and arbiter.check_zone(
+            self.buyer_budget, self.seller_min_price, max_rounds
+        )
+        if ruling:
+            say(f"\n⚖️  Arbiter: {ruling.reason}")
+            say("\n❌ Negotiation failed - no agreement possible")
+            return ruling.result(0)
+
+        opening = None
+        if not progress.verified:
+            # Step 1: Product Verification
+            say("\n--- Step 1: Product Verification ---")
+            user_instruction = self.instruction("verification")
+            calls = [
+                ModelCall(
+                    *verifier_turn(
+                        self.user_role, self.product_details, user_instruction
+                    ),
+                    temperature=0,
+                    stage="verification",
+                    role="verifier",
+                )
+            ]
+            if self.speculative:
+                # The first offer does not depend on verification; ask for it now
+                opening_instruction = self.instruction("round 1")
+                calls.append(
+                    self.buyer_call(
+                        0, self.product_details["price"], opening_instruction
+                    )
+                )
+            replies = yield calls
+            verification_result = replies[0]
+            say(f"\n🔍 Verification Result: {verification_result}")
+            if not parse_verification(verification_result):
+                self.discarded_opening = self.speculative
+                return {
+                    "status": False,
+                    "final_price": None,
+                    "message": "Verification failed - product did not meet marketplace standards",
+                    "rounds": 0,
+                }
+            if self.speculative:
+                opening = replies[1]
+
+            # Log initial greetings
+            now = time.time()
+            self._log(MessageRecord(Sender.BUYER, "Hello", at=now))
+            self._log(MessageRecord(Sender.SELLER, "Hello", at=now))
+            progress.verified = True
+            self.on_progress()
+
+        # Step 2: Price Negotiation
+        say("\n--- Starting Price Negotiation ---")
+        current_price = progress.current_price or self.product_details["price"]
+        final_result = {"status": False, "final_price": None, "message": "", "rounds": 0}
+
+        for round_num in range(progress.round, max_rounds):
+            final_result["rounds"] = round_num + 1
+            say(f"\n=== Round {round_num + 1}/{max_rounds} ===")
+            say(f"Current price: ${current_price}")
+
+            if progress.pending_offer is not None:
+                # Resumed after the offer was logged but before the seller
+                # answered it
+                buyer_offer = progress.pending_offer
+                user_instruction = ""
+            else:
+                # Buyer's turn; the first one may already have been made
+                if round_num == 0 and opening is not None:
+                    user_instruction = opening_instruction
+                    buyer_message = opening
+                else:
+                    user_instruction = self.instruction(f"round {round_num + 1}")
+                    (buyer_message,) = yield [
+                        self.buyer_call(round_num, current_price, user_instruction)
+                    ]
+                say(f"\n🛍️  Buyer: {buyer_message}")
+
+                buyer_offer = extract_offer(buyer_message)
+                if not buyer_offer and arbiter:
+                    buyer_offer = arbiter.fallback_offer(
+                        current_price, self.buyer_budget
+                    )
+                    say(f"⚖️  Arbiter: no offer found, using ${buyer_offer}")
+                if not buyer_offer:
+                    self._log(MessageRecord(Sender.BUYER, buyer_message))
+                    say("❌ Invalid offer - skipping round")
+                    self._end_round(round_num, current_price)
+                    continue
+                self._log(
+                    MessageRecord(
+                        Sender.BUYER, kind=MessageKind.OFFER, price=buyer_offer
+                    )
+                )
+                progress.pending_offer = buyer_offer
+
+            ruling = arbiter and arbiter.check_offer(buyer_offer, self.seller_min_price)
+            if ruling:
+                self._log(
+                    MessageRecord(
+                        Sender.SELLER, kind=MessageKind.ACCEPTED, price=buyer_offer
+                    )
+                )
+                self._agreed(buyer_offer, ruling)
+                return ruling.result(round_num + 1)
+
+            # Seller's turn
+            (seller_message,) = yield [
+                self.seller_call(round_num, buyer_offer, user_instruction)
+            ]
+            say(f"\n💼 Seller: {seller_message}")
+
+            verdict, counter_offer = classify_message(seller_message, last_price=False)
+            if verdict == ACCEPTED:
+                self._log(
+                    MessageRecord(
+                        Sender.SELLER, kind=MessageKind.ACCEPTED, price=buyer_offer
+                    )
+                )
+                self._agreed(buyer_offer)
+                return {
+                    "status": True,
+                    "final_price": buyer_offer,
+                    "message": f"Deal successfully concluded at ${buyer_offer}",
+                    "rounds": round_num + 1,
+                }
+
+            self._log(MessageRecord(Sender.SELLER, seller_message))
+            if verdict == REJECTED:
+                if round_num == max_rounds - 1:
+                    final_result["message"] = (
+                        "Negotiation failed - maximum rounds reached"
+                    )
+                    say("\n❌ Negotiation failed - maximum rounds reached")
+                    return final_result
+                self._end_round(round_num, current_price)
+                continue
+            if counter_offer:
+                ruling = arbiter and arbiter.check_counter(
+                    buyer_offer, counter_offer, self.buyer_budget
+                )
+                if ruling:
+                    self._log(
+                        MessageRecord(
+                            Sender.BUYER, kind=MessageKind.ACCEPTED, price=counter_offer
+                        )
+                    )
+                    self._agreed(counter_offer, ruling)
+                    return ruling.result(round_num + 1)
+                current_price = counter_offer
+                say(f"\n💰 New price: ${current_price}")
+            self._end_round(round_num, current_price)
+
+        final_result["message"] = "Negotiation failed - no agreement reached"
+        say("\n❌ Negotiation failed - no agreement reached")
+        return final_result
+
+
+def run_rounds(rounds):
+    """Drive a NegotiationRounds with blocking calls and return its result
+
+    When a step has several calls, the others run in the background while the
+    first one runs here.
+    """
+    steps = rounds.steps()
+    replies = None
+    while True:
+        try:
+            calls = steps.send(replies)
+        except StopIteration as stop:
+            return stop.value
+        others = [speculate(call.run) for call in calls[1:]]
+        replies = [calls[0].run()] + [future.result() for future in others]
+
+
+def _negotiate(
+    conversation_id,
+    product_details,
+    buyer_budget,
+    seller_min_price,
+    user_role,
+    interactive,
+    arbiter,
+    speculative,
+):
     print("\n=== Starting Marketplace Negotiation ===")
     print(f"Conversation ID: {conversation_id}")
     print(f"Product: {product_details['name']}")
@@ -97,204 +461,24 @@ def marketplace_negotiation(
             return input("> ").strip()
         return ""
 
-    # Step 1: Product Verification
-    print("\n--- Step 1: Product Verification ---")
-    user_instruction = get_user_instruction("verification")
-
-    verifier = Agent(
-        name="Product Verification Agent",
-        system_prompt=f"""You are verifying this product for the {user_role}.
-        Your ONLY task is to verify if this product meets marketplace standards.
-        
-        Format your response EXACTLY like this:
-        VERIFICATION: [YES/NO]
-        REASON: [One brief sentence explaining why]
-        
-        Do not provide recommendations, steps, or checklists.
-        If no specific concerns are provided, assume the product meets standards.""",
-        tools=[],
-    )
-
-    verification_result = client.run(
-        agent=verifier,
-        messages=[
-            {
-                "role": "user",
-                "content": f"Verify this product: {product_details}"
-                + (f"\nUser concerns: {user_instruction}" if user_instruction else ""),
-            }
-        ],
-    )
-
-    print(f"\n🔍 Verification Result: {verification_result.messages[-1]['content']}")
-
-    if "no" in verification_result.messages[-1]["content"].lower():
-        return {
-            "status": False,
-            "final_price": None,
-            "message": "Verification failed - product did not meet marketplace standards",
-        }
-
-    # Step 2: Price Negotiation
-    print("\n--- Starting Price Negotiation ---")
-    current_price = product_details["price"]
-    max_rounds = 5
-    final_result = {"status": False, "final_price": None, "message": ""}
-
-    # Log initial greetings
-    now = datetime.utcnow().isoformat() + "Z"
-    log_message(
-        conversation_id, {"dateTime": now, "content": "Hello", "sender": "buyer"}
-    )
-    log_message(
-        conversation_id, {"dateTime": now, "content": "Hello", "sender": "seller"}
-    )
-
-    for round_num in range(max_rounds):
-        print(f"\n=== Round {round_num + 1}/{max_rounds} ===")
-        print(f"Current price: ${current_price}")
-
-        # Get user instruction for this round
-        user_instruction = get_user_instruction(f"round {round_num + 1}")
-
-        # Buyer's turn
-        buyer_agent = Agent(
-            name="Buyer Agent",
-            system_prompt=f"""You are negotiating as the buyer.
-            Budget: ${buyer_budget}
-            Current price: ${current_price}
-            
-            IMPORTANT: Respond in a direct, conversational way. 
-            Start with your offer amount and then give a SHORT explanation.
-            Format: "I offer $X because [brief reason]"
-            
-            Consider user instructions: {user_instruction if user_role == 'buyer' else ''}""",
-            tools=[],
-        )
-
-        buyer_response = client.run(
-            agent=buyer_agent,
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"Make an offer for the {product_details['name']} currently at ${current_price}.",
-                }
-            ],
-        )
-
-        buyer_message = buyer_response.messages[-1]["content"]
-        print(f"\n🛍️  Buyer: {buyer_message}")
-
-        # Extract buyer's offer
-        buyer_offer = extract_offer(buyer_response.messages[-1]["content"])
-        if buyer_offer:
-            # Log the offer
-            now = datetime.utcnow().isoformat() + "Z"
-            log_message(
-                conversation_id,
-                {
-                    "dateTime": now,
-                    "content": "",
-                    "sender": "buyer",
-                    "type": "offer",
-                    "price": buyer_offer,
-                },
-            )
-        else:
-            # Log regular message
-            now = datetime.utcnow().isoformat() + "Z"
-            log_message(
-                conversation_id,
-                {"dateTime": now, "content": buyer_message, "sender": "buyer"},
-            )
-            print("❌ Invalid offer - skipping round")
-            continue
-
-        # Seller's turn
-        seller_agent = Agent(
-            name="Seller Agent",
-            system_prompt=f"""You are negotiating as the seller.
-            Minimum acceptable price: ${seller_min_price}
-            Current offer: ${buyer_offer}
-            
-            IMPORTANT: Respond in a direct, conversational way.
-            Use EXACTLY one of these formats:
-            - "ACCEPT: [brief acceptance message]"
-            - "COUNTER: $X [brief reason]"
-            - "REJECT: [brief reason]"
-            
-            Consider user instructions: {user_instruction if user_role == 'seller' else ''}""",
-            tools=[],
+    return run_rounds(
+        NegotiationRounds(
+            conversation_id,
+            product_details,
+            buyer_budget,
+            seller_min_price,
+            user_role=user_role,
+            arbiter=arbiter,
+            speculative=speculative,
+            instruction=get_user_instruction,
+            say=print,
         )
-
-        seller_response = client.run(
-            agent=seller_agent,
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"Respond to buyer's offer of ${buyer_offer}",
-                }
-            ],
-        )
-
-        seller_message = seller_response.messages[-1]["content"]
-        print(f"\n💼 Seller: {seller_message}")
-
-        now = datetime.utcnow().isoformat() + "Z"
-
-        # Process seller's response
-        response = seller_response.messages[-1]["content"].lower()
-        if "accept" in response:
-            # Log acceptance
-            log_message(
-                conversation_id,
-                {
-                    "dateTime": now,
-                    "content": "",
-                    "sender": "seller",
-                    "type": "accepted",
-                    "price": buyer_offer,
-                },
-            )
-            final_result = {
-                "status": True,
-                "final_price": buyer_offer,
-                "message": f"Deal successfully concluded at ${buyer_offer}",
-            }
-            print(f"\n✅ Deal agreed at ${buyer_offer}!")
-            return final_result
-        else:
-            # Log regular message
-            log_message(
-                conversation_id,
-                {"dateTime": now, "content": seller_message, "sender": "seller"},
-            )
-
-            if "reject" in response:
-                if round_num == max_rounds - 1:
-                    final_result["message"] = (
-                        "Negotiation failed - maximum rounds reached"
-                    )
-                    print("\n❌ Negotiation failed - maximum rounds reached")
-                    return final_result
-                continue
-            else:
-                counter_offer = extract_offer(response)
-                if counter_offer:
-                    current_price = counter_offer
-                    print(f"\n💰 New price: ${current_price}")
-
-    final_result["message"] = "Negotiation failed - no agreement reached"
-    print("\n❌ Negotiation failed - no agreement reached")
-    return final_result
+    )
 
 
 def extract_offer(message):
     """Extract numerical offer from message"""
-    import re
-
-    matches = re.findall(r"\$(\d+)", message)
-    return int(matches[0]) if matches else None
+    return parse_price(message)
 
 
 # Sample usage
@@ -307,6 +491,19 @@ if __name__ == "__main__":
         "price": 1000,
         "category": "Furniture",
     }
+    buyer_budget, seller_min_price = 900, 800
+
+    # --listing=<id> negotiates over a catalog listing instead of the sofa
+    for arg in sys.argv[1:]:
+        if arg.startswith("--listing="):
+            from listing_store import get_store, negotiation_jobs
+
+            listing = get_store().get(arg.split("=", 1)[1])
+            if listing is None:
+                sys.exit(f"No listing with id {arg.split('=', 1)[1]}")
+            [(product_details, buyer_budget, seller_min_price)] = negotiation_jobs(
+                [listing]
+            )
 
     print("\n1. Buyer")
     print("2. Seller")
@@ -315,8 +512,8 @@ if __name__ == "__main__":
 
     result = marketplace_negotiation(
         product_details=product_details,
-        buyer_budget=900,
-        seller_min_price=800,
+        buyer_budget=buyer_budget,
+        seller_min_price=seller_min_price,
         user_role=user_role,
         interactive=True,
     )
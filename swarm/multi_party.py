@@ -0,0 +1,426 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import random
+import time
+import uuid
+
+from batch_negotiation import BatchNegotiationEngine
+from conversation_log import create_conversation_file, log_message, end_conversation
+from instrumentation import end_session, tags
+from message_parser import (
+    ACCEPTED,
+    REJECTED,
+    classify_message,
+    parse_verification,
+    split_replies,
+)
+from model_router import turn_route
+from multi_agent import (
+    buyer_turn,
+    extract_offer,
+    seller_batch_turn,
+    seller_turn,
+    verifier_turn,
+)
+from scheduler import BATCH
+from session_state import MessageKind, MessageRecord, Sender
+
+# Multi-party marketplace: one seller agent per listing negotiating with many
+# buyers at once, and buyers shopping several listings. Every (buyer, listing)
+# pair is a session coroutine on a single event loop, sharing the batch
+# engine's call slots. A listing is verified once for all of its buyers. Offers
+# that reach a seller within `batch_window` of each other are answered by one
+# model call listing them all; a buyer the batched reply skips is asked about
+# on its own. A listing is sold once, to the best accepted offer, and a buyer
+# stops shopping after the first purchase.
+
+
+class Buyer:
+    """A shopper; `budgets` maps the listings it negotiates for to its budget"""
+
+    __slots__ = ("number", "budgets", "bought")
+
+    def __init__(self, number, budgets):
+        self.number = number
+        self.budgets = budgets
+        self.bought = None
+
+    def __repr__(self):
+        return f"Buyer({self.number}, {self.budgets})"
+
+
+class ListingSeller:
+    """The seller of one listing, answering its buyers' offers in batches"""
+
+    def __init__(self, engine, listing, product_details, seller_min_price):
+        self.engine = engine
+        self.listing = listing
+        self.product_details = product_details
+        self.seller_min_price = seller_min_price
+        self.session = f"listing-{listing}"
+        self.sold_to = None
+        self.final_price = None
+        # Seller model calls and the offers they answered
+        self.calls = 0
+        self.offers = 0
+        self._verification = None
+        self._pending = {}
+        self._timer = None
+
+    @property
+    def sold(self):
+        return self.sold_to is not None
+
+    def verified(self):
+        """Future of the listing's verification, started by the first buyer"""
+        if self._verification is None:
+            self._verification = asyncio.ensure_future(self._verify())
+        return self._verification
+
+    async def _verify(self):
+        with tags(session=self.session, priority=BATCH):
+            reply = await self.engine._run_agent(
+                *verifier_turn(self.engine.user_role, self.product_details),
+                temperature=0,
+                stage="verification",
+                role="verifier",
+            )
+        return parse_verification(reply)
+
+    def respond(self, buyer, offer):
+        """Future of the seller's reply to `offer`; None when the listing was
+        sold to someone else (or the buyer bought elsewhere) first"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self.sold:
+            future.set_result(None)
+            return future
+        self._pending[buyer] = (offer, future)
+        if len(self._pending) >= self.engine.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.engine.batch_window, self._flush)
+        return future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, {}
+        if pending:
+            self.engine._spawn(self._answer(pending))
+
+    async def _answer(self, pending):
+        try:
+            if self.sold:
+                replies = {}
+            else:
+                with tags(session=self.session, priority=BATCH):
+                    replies = await self._replies(
+                        {buyer: offer for buyer, (offer, _) in pending.items()}
+                    )
+        except Exception as e:
+            for _, future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Settled synchronously on the loop, so two sellers can never both
+        # close with the same buyer
+        verdicts = {
+            buyer: classify_message(reply, last_price=False)[0]
+            for buyer, reply in replies.items()
+        }
+        accepted = [
+            buyer
+            for buyer, verdict in verdicts.items()
+            if verdict == ACCEPTED and buyer.bought is None
+        ]
+        if accepted and not self.sold:
+            winner = max(accepted, key=lambda buyer: pending[buyer][0])
+            self.sold_to = winner
+            self.final_price = pending[winner][0]
+            winner.bought = self.listing
+        for buyer, (_, future) in pending.items():
+            if future.done():
+                continue
+            # Once sold, and for acceptances that lost out, the buyer's
+            # session ends instead of seeing the reply
+            lost = self.sold or verdicts.get(buyer) == ACCEPTED
+            if buyer in replies and (self.sold_to is buyer or not lost):
+                future.set_result(replies[buyer])
+            else:
+                future.set_result(None)
+
+    async def _replies(self, offers):
+        if len(offers) == 1:
+            ((buyer, offer),) = offers.items()
+            return {buyer: await self._reply_one(offer)}
+
+        by_number = {buyer.number: buyer for buyer in offers}
+        self.calls += 1
+        self.offers += len(offers)
+        message = await self.engine._run_agent(
+            *seller_batch_turn(
+                self.seller_min_price,
+                {buyer.number: offer for buyer, offer in offers.items()},
+            ),
+            stage="negotiation",
+            role="seller",
+        )
+        replies = {
+            by_number[number]: reply
+            for number, reply in split_replies(message).items()
+            if number in by_number
+        }
+        for buyer, offer in offers.items():
+            if buyer not in replies:
+                replies[buyer] = await self._reply_one(offer)
+        return replies
+
+    async def _reply_one(self, offer):
+        self.calls += 1
+        self.offers += 1
+        return await self.engine._run_agent(
+            *seller_turn(self.seller_min_price, offer),
+            stage="negotiation",
+            role="seller",
+        )
+
+
+class MultiPartyEngine(BatchNegotiationEngine):
+    """Many buyers per listing, one seller agent per listing, one event loop
+
+    batch_window  seconds a seller waits for more offers before answering
+    max_batch     most offers answered by one seller call; 1 turns batching off
+    """
+
+    def __init__(self, batch_window=0.01, max_batch=8, **kwargs):
+        super().__init__(**kwargs)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.sellers = []
+        self._tasks = set()
+
+    def _spawn(self, coroutine):
+        # Keep a reference so pending seller replies are not garbage collected
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def run_market(self, listings, buyers):
+        """Negotiate every (buyer, listing) pair; returns one result per pair
+
+        listings  [(product_details, seller_min_price), ...]
+        buyers    Buyer objects whose budgets are keyed by listing index
+        """
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.sellers = [
+            ListingSeller(self, index, product_details, seller_min_price)
+            for index, (product_details, seller_min_price) in enumerate(listings)
+        ]
+        try:
+            return await asyncio.gather(
+                *(
+                    self._session(buyer, self.sellers[listing])
+                    for buyer in buyers
+                    for listing in buyer.budgets
+                )
+            )
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _session(self, buyer, seller):
+        conversation_id = str(uuid.uuid4())
+        create_conversation_file(conversation_id)
+        try:
+            with tags(session=conversation_id, priority=BATCH):
+                result = await self._shop(conversation_id, buyer, seller)
+        except Exception as e:
+            result = {
+                "status": False,
+                "final_price": None,
+                "message": f"Negotiation error - {e}",
+                "rounds": 0,
+            }
+        finally:
+            end_conversation(conversation_id)
+            end_session(conversation_id)
+        result["buyer"] = buyer.number
+        result["listing"] = seller.listing
+        return result
+
+    def _ended(self, buyer, seller):
+        if buyer.bought is not None:
+            return "Negotiation ended - bought another listing"
+        if seller.sold:
+            return "Negotiation failed - sold to another buyer"
+        return None
+
+    def _buyer_turn(self, product_details, buyer_budget, round_num, current_price):
+        return self._run_agent(
+            *buyer_turn(product_details["name"], buyer_budget, current_price),
+            stage="negotiation",
+            round=round_num + 1,
+            role="buyer",
+            route=turn_route(round_num, self.max_rounds, "buyer"),
+            expect="offer",
+        )
+
+    async def _shop(self, conversation_id, buyer, seller):
+        result = {"status": False, "final_price": None, "message": "", "rounds": 0}
+        if not await seller.verified():
+            result["message"] = (
+                "Verification failed - product did not meet marketplace standards"
+            )
+            return result
+
+        now = time.time()
+        log_message(conversation_id, MessageRecord(Sender.BUYER, "Hello", at=now))
+        log_message(conversation_id, MessageRecord(Sender.SELLER, "Hello", at=now))
+
+        product_details = seller.product_details
+        buyer_budget = buyer.budgets[seller.listing]
+        current_price = product_details["price"]
+        for round_num in range(self.max_rounds):
+            ended = self._ended(buyer, seller)
+            if ended:
+                result["message"] = ended
+                return result
+            result["rounds"] = round_num + 1
+            buyer_message = await self._buyer_turn(
+                product_details, buyer_budget, round_num, current_price
+            )
+            buyer_offer = extract_offer(buyer_message)
+            if not buyer_offer:
+                log_message(
+                    conversation_id,
+                    MessageRecord(Sender.BUYER, buyer_message),
+                )
+                continue
+            log_message(
+                conversation_id,
+                MessageRecord(
+                    Sender.BUYER, kind=MessageKind.OFFER, price=buyer_offer
+                ),
+            )
+
+            seller_message = await seller.respond(buyer, buyer_offer)
+            if seller_message is None:
+                result["message"] = self._ended(buyer, seller) or (
+                    "Negotiation failed - sold to another buyer"
+                )
+                return result
+
+            verdict, counter_offer = classify_message(seller_message, last_price=False)
+            if verdict == ACCEPTED:
+                log_message(
+                    conversation_id,
+                    MessageRecord(
+                        Sender.SELLER, kind=MessageKind.ACCEPTED, price=buyer_offer
+                    ),
+                )
+                result.update(
+                    status=True,
+                    final_price=buyer_offer,
+                    message=f"Deal successfully concluded at ${buyer_offer}",
+                )
+                return result
+
+            log_message(
+                conversation_id,
+                MessageRecord(Sender.SELLER, seller_message),
+            )
+            if verdict != REJECTED and counter_offer:
+                current_price = counter_offer
+
+        result["message"] = "Negotiation failed - no agreement reached"
+        return result
+
+
+def run_market(listings, buyers, **kwargs):
+    """Blocking helper running a whole market"""
+    engine = MultiPartyEngine(**kwargs)
+    results = asyncio.run(engine.run_market(listings, buyers))
+    return engine, results
+
+
+def random_buyers(listings, count, shop=2, seed=0):
+    """`count` buyers, each shopping `shop` random listings with a budget of
+    75-100% of the listed price"""
+    rng = random.Random(seed)
+    buyers = []
+    for number in range(1, count + 1):
+        chosen = rng.sample(range(len(listings)), min(shop, len(listings)))
+        buyers.append(
+            Buyer(
+                number,
+                {
+                    index: round(listings[index][0]["price"] * rng.uniform(0.75, 1.0))
+                    for index in chosen
+                },
+            )
+        )
+    return buyers
+
+
+if __name__ == "__main__":
+    # Model calls per closed deal as the number of buyers grows, with every
+    # offer answered separately against batched seller replies, on the fake
+    # backend.
+    from llm_backend import FakeBackend
+
+    parser = argparse.ArgumentParser(description="Multi-party negotiation on the fake")
+    parser.add_argument("--listings", type=int, default=4)
+    parser.add_argument("--buyers", default="1,2,4,8,16,32")
+    parser.add_argument("--shop", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    products = [
+        ("Victorian Sofa", "1960s Vintage British Sofa", 1000),
+        ("Mountain Bike", "Trek mountain bike, barely used", 850),
+        ("Gaming Console", "PS5 with two controllers and 3 games", 450),
+        ("Vintage Camera", "Film camera in excellent condition", 300),
+    ]
+    listings = [
+        (
+            {"name": name, "description": description, "price": price},
+            round(price * 0.85),
+        )
+        for name, description, price in (
+            products[index % len(products)] for index in range(args.listings)
+        )
+    ]
+
+    print(
+        f"{args.listings} listings, {args.shop} per buyer, "
+        f"{args.latency}s per model call"
+    )
+    print(
+        f"{'buyers':>6} {'mode':<9} {'deals':>5} {'calls':>6} {'seller':>6} "
+        f"{'calls/deal':>10} {'offers/call':>11} {'seconds':>8}"
+    )
+    for count in (int(n) for n in args.buyers.split(",")):
+        buyers = random_buyers(listings, count, args.shop, args.seed)
+        for label, max_batch in (("per-offer", 1), ("batched", 16)):
+            for buyer in buyers:
+                buyer.bought = None
+            fake = FakeBackend(latency=args.latency, seed=args.seed)
+            start = time.perf_counter()
+            engine, results = run_market(
+                listings, buyers, backend=fake, concurrency=64, max_batch=max_batch
+            )
+            seconds = time.perf_counter() - start
+            deals = sum(result["status"] for result in results)
+            seller_calls = sum(seller.calls for seller in engine.sellers)
+            offers = sum(seller.offers for seller in engine.sellers)
+            print(
+                f"{count:>6} {label:<9} {deals:>5} {fake.calls:>6} {seller_calls:>6} "
+                f"{fake.calls / max(deals, 1):>10.2f} "
+                f"{offers / max(seller_calls, 1):>11.2f} {seconds:>8.2f}"
+            )
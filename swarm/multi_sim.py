@@ -1,17 +1,29 @@
-from openai import OpenAI
-from swarm import Agent, Swarm
+from contextlib import contextmanager
+import contextvars
+import sys
 import time
-import os
-from dotenv import load_dotenv
-import re
-import csv
-from datetime import datetime
 import uuid
 
-load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-
-client = OpenAI()
+from agent_registry import AGENTS
+from conversation_log import create_conversation_file, log_message, end_conversation
+from history import HISTORY_STRATEGIES, make_history
+from instrumentation import end_session, tags
+from llm_backend import get_backend
+from message_parser import (
+    ACCEPTED,
+    classify_message,
+    log_type,
+    parse_price,
+    parse_verification,
+)
+from model_router import turn_route
+from session_state import MessageRecord, Sender, kind_of, transcript
+from speculation import speculate
+from streaming import deal_end, deal_reached, stream_turn
+
+# Rounds before a negotiation ends without a deal; the last is routed as the
+# closing round
+MAX_ROUNDS = 5
 
 # sample item, change whenever
 ITEM = {
@@ -24,6 +36,93 @@ ITEM = {
 }
 
 
+# Console I/O goes through ask()/say() so a headless driver can script the
+# user's answers and silence output for its own context only
+_ask = contextvars.ContextVar("multi_sim_ask", default=input)
+_say = contextvars.ContextVar("multi_sim_say", default=print)
+
+
+def ask(prompt=""):
+    return _ask.get()(prompt)
+
+
+def ask_optional(prompt=""):
+    """ask() for prompts that may be skipped: end of input counts as Enter"""
+    try:
+        return ask(prompt)
+    except EOFError:
+        return ""
+
+
+def say(*args, **kwargs):
+    _say.get()(*args, **kwargs)
+
+
+@contextmanager
+def console(ask=None, say=None):
+    """Replace input() and/or print() for simulations run inside the block"""
+    tokens = []
+    if ask is not None:
+        tokens.append((_ask, _ask.set(ask)))
+    if say is not None:
+        tokens.append((_say, _say.set(say)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class SimulationResult:
+    """Outcome of one simulate_negotiation session
+
+    The transcript is kept as MessageRecords in a bounded deque; `transcript`
+    renders it as dicts.
+    """
+
+    __slots__ = (
+        "conversation_id",
+        "user_role",
+        "verified",
+        "deal_made",
+        "final_price",
+        "rounds",
+        "messages",
+        "timings",
+    )
+
+    def __init__(self, conversation_id, user_role):
+        self.conversation_id = conversation_id
+        self.user_role = user_role
+        self.verified = False
+        self.deal_made = False
+        self.final_price = None
+        self.rounds = 0
+        self.messages = transcript()
+        self.timings = []
+
+    @property
+    def transcript(self):
+        return [message.to_dict() for message in self.messages]
+
+    def to_dict(self):
+        return {
+            "conversation_id": self.conversation_id,
+            "user_role": self.user_role,
+            "verified": self.verified,
+            "deal_made": self.deal_made,
+            "final_price": self.final_price,
+            "rounds": self.rounds,
+            "transcript": self.transcript,
+        }
+
+    def __repr__(self):
+        return (
+            f"SimulationResult(deal_made={self.deal_made}, "
+            f"final_price={self.final_price}, rounds={self.rounds})"
+        )
+
+
 def create_system_prompt(role):
     if role == "seller":
         return """You are a marketplace seller on a casual messaging platform. Use a conversational, text-message style (casual but professional).
@@ -36,137 +135,126 @@ def create_system_prompt(role):
 
 
 def extract_price(message):
-    """Extract price from a message using regex to find dollar amounts."""
-    price_matches = re.findall(r"\$(\d+)", message)
-    if price_matches:
-        return int(price_matches[-1])
-    return None
+    """Extract the last dollar amount mentioned in a message."""
+    return parse_price(message, last=True)
 
 
 def get_user_role():
     while True:
-        role = input(
+        role = ask(
             "Would you like to be the buyer or seller? (buyer/seller): "
-        ).lower()
+        ).strip().lower()
         if role in ["buyer", "seller"]:
             return role
-        print("Please enter either 'buyer' or 'seller'")
+        say("Please enter either 'buyer' or 'seller'")
+
+
+def generate_message(messages, label, stream=False, timings=None):
+    """Get the AI's next message and print it after `label`
+
+    With stream=True tokens are printed as they arrive, the generation stops
+    once the reply has accepted a deal at a price, and the turn's
+    time-to-first-token and total latency are appended to `timings`.
+    """
+    if not stream:
+        message = get_backend().complete(
+            messages, model="gpt-4", temperature=0.7, max_tokens=150
+        ).content
+        say(f"{label} {message}")
+        return message
+
+    say(f"{label} ", end="", flush=True)
+    turn = stream_turn(
+        get_backend(),
+        messages,
+        on_token=lambda token: say(token, end="", flush=True),
+        stop=deal_reached,
+        model="gpt-4",
+        temperature=0.7,
+        max_tokens=150,
+    )
+    say(
+        f"\n   ⏱️  first token {turn.time_to_first_token:.2f}s, total {turn.latency:.2f}s"
+        + (" (stopped after the deal was agreed)" if turn.aborted else "")
+    )
+    if timings is not None:
+        timings.append(turn)
+    if turn.aborted:
+        # The last chunk may have started the next sentence; end at the deal
+        return turn.content[: deal_end(turn.content)].rstrip()
+    return turn.content
 
 
-def get_user_message(role, round_num, conversation_history):
-    print(f"\n--- Your turn (Round {round_num}) ---")
-    print("(Press Enter to skip and let the AI handle this turn)")
+def get_user_message(
+    role, round_num, conversation_history, stream=False, timings=None
+):
+    say(f"\n--- Your turn (Round {round_num}) ---")
+    say("(Press Enter to skip and let the AI handle this turn)")
 
     if round_num == 1 and role == "buyer":
         default_message = f"Hi! I saw your {ITEM['name']} listed for ${ITEM['listing_price']}. Could you tell me more about its condition?"
-        user_input = input(f"Enter your message as the {role}: ")
+        user_input = ask_optional(f"Enter your message as the {role}: ")
         return user_input if user_input.strip() else default_message
 
-    user_input = input(f"Enter your message as the {role}: ")
+    user_input = ask_optional(f"Enter your message as the {role}: ")
 
     if not user_input.strip():
         system_prompt = create_system_prompt(role)
-        messages = [{"role": "system", "content": system_prompt}, *conversation_history]
-        response = client.chat.completions.create(
-            model="gpt-4", messages=messages, temperature=0.7, max_tokens=150
-        )
-        ai_message = response.choices[0].message.content
-        print(f"\n Agent ({role}): {ai_message}")
-        return ai_message
+        messages = conversation_history.prompt(system_prompt)
+        return generate_message(messages, f"\n Agent ({role}):", stream, timings)
 
     return user_input
 
 
-def create_conversation_file(conversation_id):
-    """Create a new conversation CSV file"""
-    filepath = f"../marketplace/src/data/conversations/{conversation_id}.csv"
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-
-    with open(filepath, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["dateTime", "content", "sender", "type", "price"])
-
-
-def log_message(conversation_id, message):
-    """Log a message to the conversation CSV file"""
-    filepath = f"../marketplace/src/data/conversations/{conversation_id}.csv"
-    with open(filepath, "a", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(
-            [
-                message["dateTime"],
-                message["content"],
-                message["sender"],
-                message.get("type", "text"),
-                message.get("price", ""),
-            ]
-        )
-
-
 def verify_product(item, user_role, user_instruction=""):
     """Verify product details and authenticity"""
-    verifier = Agent(
-        name="Product Verification Agent",
-        instructions=f"""You are verifying this product for the {user_role}.
-        Your ONLY task is to verify if this product meets marketplace standards.
-        
-        Format your response EXACTLY like this:
-        VERIFICATION: [YES/NO]
-        REASON: [One brief sentence explaining why]
-        
-        Do not provide recommendations, steps, or checklists.
-        If no specific concerns are provided, assume the product meets standards.""",
-        tools=[],
+    verifier, messages = AGENTS.turn(
+        "verifier",
+        f"Verify this product: {item}"
+        + (f"\nUser concerns: {user_instruction}" if user_instruction else ""),
+        user_role=user_role,
     )
 
-    verification_result = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": verifier.instructions},
-            {
-                "role": "user",
-                "content": f"Verify this product: {item}"
-                + (f"\nUser concerns: {user_instruction}" if user_instruction else ""),
-            },
-        ],
-        temperature=0.7,
-        max_tokens=150,
-    )
+    with tags(stage="verification", role="verifier"):
+        verification_result = get_backend().complete(
+            model="gpt-4",
+            messages=[{"role": "system", "content": verifier.instructions}, *messages],
+            temperature=0,
+            max_tokens=150,
+        )
+
+    return verification_result.content
 
-    return verification_result.choices[0].message.content
 
+def simulate_negotiation(stream=False, history="full", speculative=False):
+    """Run one negotiation; `history` picks how much of the transcript each
+    agent turn is sent (see history.HISTORY_STRATEGIES). With speculative=True
+    verification runs in the background while the opening message is written
+    and the opening is discarded if verification fails.
 
-def simulate_negotiation():
+    Returns a SimulationResult.
+    """
     # Create new conversation at start
     conversation_id = str(uuid.uuid4())
     create_conversation_file(conversation_id)
-    print(f"\nConversation ID: {conversation_id}")
+    say(f"\nConversation ID: {conversation_id}")
+    try:
+        with tags(session=conversation_id):
+            return _simulate(conversation_id, stream, history, speculative)
+    finally:
+        end_conversation(conversation_id)
+        end_session(conversation_id)
+
 
+def _simulate(conversation_id, stream, history, speculative):
     user_role = get_user_role()
-    print(f"\nYou are the {user_role}. Let's start the negotiation!")
+    result = SimulationResult(conversation_id, user_role)
+    say(f"\nYou are the {user_role}. Let's start the negotiation!")
 
     # Step 1: Product Verification
-    print("\n--- Step 1: Product Verification ---")
-    print("Enter any concerns about the product (press Enter to skip):")
-    user_instruction = input("> ").strip()
-
-    verification_result = verify_product(ITEM, user_role, user_instruction)
-    print(f"\n🔍 Verification Result: {verification_result}")
-
-    if "no" in verification_result.lower():
-        print("\n❌ Verification failed - product did not meet marketplace standards")
-        return
-
-    # Log initial greeting messages
-    now = datetime.utcnow().isoformat() + "Z"
-    log_message(
-        conversation_id, {"dateTime": now, "content": "Hello", "sender": "buyer"}
-    )
-    log_message(
-        conversation_id, {"dateTime": now, "content": "Hello", "sender": "seller"}
-    )
-
-    print("\n--- Starting Price Negotiation ---")
+    say("\n--- Step 1: Product Verification ---")
+    say("Enter any concerns about the product (press Enter to skip):")
+    user_instruction = ask_optional("> ").strip()
 
     seller_system = (
         create_system_prompt("seller")
@@ -177,144 +265,184 @@ def simulate_negotiation():
         + "\nYou are responding as the BUYER. The other person is the SELLER."
     )
 
-    conversation_history = []
+    conversation_history = make_history(history)
+    timings = []
     round_count = 0
     deal_made = False
     final_price = None
 
     # Handle initial buyer message
-    if user_role == 'buyer':
-        buyer_message = get_user_message('buyer', 1, conversation_history)
-        print(f"🛍️ Buyer: {buyer_message}")
+    def opening_turn():
+        with tags(stage="opening", role="buyer"):
+            if user_role == 'buyer':
+                buyer_message = get_user_message(
+                    "buyer", 1, conversation_history, stream, timings
+                )
+                say(f"🛍️ Buyer: {buyer_message}")
+            else:
+                buyer_messages = [
+                    {"role": "system", "content": buyer_system},
+                    {"role": "user", "content": f"You're interested in a {ITEM['name']} listed for ${ITEM['listing_price']}. Start the conversation by asking about its condition."}
+                ]
+                buyer_message = generate_message(buyer_messages, "🛍️ Buyer:", stream, timings)
+        return buyer_message
+
+    if speculative:
+        # The opening does not depend on verification; write it meanwhile
+        verification = speculate(verify_product, ITEM, user_role, user_instruction)
+        say("\n--- Opening message (while verifying) ---")
+        buyer_message = opening_turn()
+        verification_result = verification.result()
     else:
-        buyer_messages = [
-            {"role": "system", "content": buyer_system},
-            {"role": "user", "content": f"You're interested in a {ITEM['name']} listed for ${ITEM['listing_price']}. Start the conversation by asking about its condition."}
-        ]
-        buyer_response = client.chat.completions.create(
-            model="gpt-4",
-            messages=buyer_messages,
-            temperature=0.7,
-            max_tokens=150
-        )
-        buyer_message = buyer_response.choices[0].message.content
-        print(f"🛍️ Buyer: {buyer_message}")
-    
-    conversation_history.append({
-        "role": "user",
-        "content": f"[BUYER]: {buyer_message}"
-    })
-    
-    while round_count < 5 and not deal_made:
-        print(f"\n--- Round {round_count + 1} ---")
+        verification_result = verify_product(ITEM, user_role, user_instruction)
+    say(f"\n🔍 Verification Result: {verification_result}")
 
-        # Seller's turn
-        if user_role == "seller":
-            seller_message = get_user_message(
-                "seller", round_count + 1, conversation_history
-            )
-        else:
-            seller_messages = [
-                {"role": "system", "content": seller_system},
-                *conversation_history,
-            ]
-            seller_response = client.chat.completions.create(
-                model="gpt-4", messages=seller_messages, temperature=0.7, max_tokens=150
-            )
-            seller_message = seller_response.choices[0].message.content
-            print(f"💼 Seller: {seller_message}")  # Add seller emoji
-
-        conversation_history.append({
-            "role": "assistant" if user_role == "buyer" else "user",
-            "content": seller_message
-        })
+    if not parse_verification(verification_result):
+        say("\n❌ Verification failed - product did not meet marketplace standards")
+        return result
+    result.verified = True
 
-        # Log seller's message
-        now = datetime.utcnow().isoformat() + "Z"
-        price = extract_price(seller_message)
-        message_type = "text"
-        if "deal" in seller_message.lower() or "sold" in seller_message.lower():
-            message_type = "accepted"
-        elif price:
-            message_type = "offer"
-
-        log_message(
-            conversation_id,
+    # Log initial greeting messages
+    now = time.time()
+    log_message(conversation_id, MessageRecord(Sender.BUYER, "Hello", at=now))
+    log_message(conversation_id, MessageRecord(Sender.SELLER, "Hello", at=now))
+
+    say("\n--- Starting Price Negotiation ---")
+    if not speculative:
+        buyer_message = opening_turn()
+
+    conversation_history.append(
+        {"role": "user", "content": f"[BUYER]: {buyer_message}"}, "buyer"
+    )
+    result.messages.append(MessageRecord(Sender.BUYER, buyer_message))
+
+    while round_count < MAX_ROUNDS and not deal_made:
+        say(f"\n--- Round {round_count + 1} ---")
+
+        # Seller's turn
+        with tags(
+            stage="negotiation",
+            round=round_count + 1,
+            role="seller",
+            route=turn_route(round_count, MAX_ROUNDS, "seller"),
+        ):
+            if user_role == "seller":
+                seller_message = get_user_message(
+                    "seller", round_count + 1, conversation_history, stream, timings
+                )
+            else:
+                seller_messages = conversation_history.prompt(seller_system)
+                seller_message = generate_message(
+                    seller_messages, "💼 Seller:", stream, timings
+                )
+
+        conversation_history.append(
             {
-                "dateTime": now,
+                "role": "assistant" if user_role == "buyer" else "user",
                 "content": seller_message,
-                "sender": "seller",
-                "type": message_type,
-                "price": price if price else "",
             },
+            "seller",
         )
 
-        if "deal" in seller_message.lower() or "sold" in seller_message.lower():
+        # Log seller's message
+        message_type, price = classify_message(seller_message)
+        record = MessageRecord(
+            Sender.SELLER, seller_message, kind_of(log_type(message_type, price)), price
+        )
+        log_message(conversation_id, record)
+        result.messages.append(record)
+
+        if message_type == ACCEPTED:
             deal_made = True
-            final_price = extract_price(seller_message)
+            final_price = price
             if not final_price:
                 final_price = ITEM["listing_price"]
             break
 
 
-        if user_role == "buyer":
-            buyer_message = get_user_message(
-                "buyer", round_count + 1, conversation_history
-            )
-        else:
-            buyer_messages = [
-                {"role": "system", "content": buyer_system},
-                *conversation_history,
-            ]
-            buyer_response = client.chat.completions.create(
-                model="gpt-4", messages=buyer_messages, temperature=0.7, max_tokens=150
-            )
-            buyer_message = buyer_response.choices[0].message.content
-            print(f"🛍️ Buyer: {buyer_message}") 
-
-        conversation_history.append({
-            "role": "user" if user_role == "buyer" else "assistant",
-            "content": buyer_message
-        })
-
-        # Log buyer's message
-        now = datetime.utcnow().isoformat() + "Z"
-        price = extract_price(buyer_message)
-        message_type = "text"
-        if "deal" in buyer_message.lower() or "sold" in buyer_message.lower():
-            message_type = "accepted"
-        elif price:
-            message_type = "offer"
-
-        log_message(
-            conversation_id,
+        with tags(
+            stage="negotiation",
+            round=round_count + 1,
+            role="buyer",
+            route=turn_route(round_count, MAX_ROUNDS, "buyer"),
+        ):
+            if user_role == "buyer":
+                buyer_message = get_user_message(
+                    "buyer", round_count + 1, conversation_history, stream, timings
+                )
+            else:
+                buyer_messages = conversation_history.prompt(buyer_system)
+                buyer_message = generate_message(
+                    buyer_messages, "🛍️ Buyer:", stream, timings
+                )
+
+        conversation_history.append(
             {
-                "dateTime": now,
+                "role": "user" if user_role == "buyer" else "assistant",
                 "content": buyer_message,
-                "sender": "buyer",
-                "type": message_type,
-                "price": price if price else "",
             },
+            "buyer",
         )
 
-        if "deal" in buyer_message.lower() or "sold" in buyer_message.lower():
+        # Log buyer's message
+        message_type, price = classify_message(buyer_message)
+        record = MessageRecord(
+            Sender.BUYER, buyer_message, kind_of(log_type(message_type, price)), price
+        )
+        log_message(conversation_id, record)
+        result.messages.append(record)
+
+        if message_type == ACCEPTED:
             deal_made = True
-            final_price = extract_price(buyer_message)
+            final_price = price
             if not final_price:
                 final_price = ITEM["listing_price"]
             break
 
         round_count += 1
-        time.sleep(1)
 
     if deal_made:
-        print(f"\nDeal made at ${final_price}!")
+        say(f"\nDeal made at ${final_price}!")
     else:
-        print("\nNegotiation ended without a deal.")
+        say("\nNegotiation ended without a deal.")
+
+    if timings:
+        ttft = sum(turn.time_to_first_token for turn in timings) / len(timings)
+        latency = sum(turn.latency for turn in timings) / len(timings)
+        say(
+            f"Streamed {len(timings)} turns: avg first token {ttft:.2f}s, "
+            f"avg turn {latency:.2f}s"
+        )
+
+    result.deal_made = deal_made
+    result.final_price = final_price
+    result.rounds = round_count + 1 if deal_made else round_count
+    result.timings = timings
+    return result
 
 
 if __name__ == "__main__":
+    # --listing=<id> simulates a catalog listing instead of the sample item
+    for arg in sys.argv[1:]:
+        if arg.startswith("--listing="):
+            from listing_store import get_store
+
+            listing = get_store().get(arg.split("=", 1)[1])
+            if listing is None:
+                sys.exit(f"No listing with id {arg.split('=', 1)[1]}")
+            ITEM = listing.sim_item()
+
     print(f"Starting negotiation for {ITEM['name']}")
     print(f"Listed price: ${ITEM['listing_price']}")
     print("-" * 50)
-    simulate_negotiation()
+    history = "full"
+    for arg in sys.argv[1:]:
+        if arg.startswith("--history="):
+            history = arg.split("=", 1)[1]
+    if history not in HISTORY_STRATEGIES:
+        sys.exit(f"--history must be one of: {', '.join(HISTORY_STRATEGIES)}")
+    simulate_negotiation(
+        stream="--stream" in sys.argv,
+        history=history,
+        speculative="--speculative" in sys.argv,
+    )
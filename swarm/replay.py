@@ -0,0 +1,297 @@
+import argparse
+import csv
+from itertools import islice
+import json
+from multiprocessing import Pool
+import os
+import sqlite3
+
+from conversation_log import CONVERSATIONS_DIR
+from message_parser import ACCEPTED, OFFER, COUNTER, classify_message
+
+# Replays the conversation CSVs with the current parsing logic and aggregates
+# outcomes: deal rate, the price concession curve of each side and the number
+# of rounds it takes to close. Files are scanned lazily and scored in a process
+# pool; every score is kept in a SQLite manifest together with the file's
+# mtime and size, so a re-run only rescores new or changed files and the
+# aggregate is streamed back out of the manifest. Memory stays bounded by the
+# scan batch size, not by the number of conversations.
+
+DEFAULT_MANIFEST = os.getenv("REPLAY_MANIFEST", "replay_manifest.sqlite")
+
+# Offers beyond this many per side are left out of the concession curve
+CURVE_POINTS = 10
+SCAN_BATCH = 10_000
+# SQLite builds before 3.32 allow at most 999 bound parameters per statement
+_LOOKUP_CHUNK = 500
+_SIDES = ("buyer", "seller")
+
+
+def iter_conversation_files(directory):
+    """Yield (name, mtime_ns, size) for every conversation CSV"""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(".csv") and entry.is_file():
+                stat = entry.stat()
+                yield entry.name, stat.st_mtime_ns, stat.st_size
+
+
+def iter_messages(path):
+    """Yield the rows of one conversation CSV as dicts"""
+    with open(path, newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def _number(value):
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(price) if price.is_integer() else price
+
+
+def score_messages(messages):
+    """Reclassify a conversation and reduce it to its outcome
+
+    Messages with text are classified by the current parser; rows without
+    text (structured offers and acceptances) keep their logged type and price.
+    """
+    offers = {"buyer": [], "seller": []}
+    final_price = None
+    deal = False
+    count = 0
+    for message in messages:
+        count += 1
+        sender = message.get("sender", "")
+        content = message.get("content") or ""
+        if content:
+            kind, price = classify_message(content)
+        else:
+            logged = message.get("type")
+            kind = {"accepted": ACCEPTED, "offer": OFFER}.get(logged)
+            price = _number(message.get("price"))
+
+        if kind == ACCEPTED:
+            deal = True
+            final_price = price
+            if final_price is None:
+                other = offers["seller" if sender == "buyer" else "buyer"]
+                final_price = other[-1] if other else None
+            break
+        if kind in (OFFER, COUNTER) and price is not None and sender in offers:
+            offers[sender].append(price)
+
+    return {
+        "messages": count,
+        "deal": deal,
+        "final_price": final_price,
+        # A round is one buyer offer and the seller's answer
+        "rounds": max(len(offers["buyer"]), 1 if deal else 0),
+        "buyer": offers["buyer"][:CURVE_POINTS],
+        "seller": offers["seller"][:CURVE_POINTS],
+    }
+
+
+def score_file(path):
+    """Pool worker: (file name, score), (file name, None) if unreadable
+
+    Any other error scoring the file is returned as {"error": ...} and kept in
+    the manifest, so one bad file cannot abort the pool run.
+    """
+    try:
+        return os.path.basename(path), score_messages(iter_messages(path))
+    except (OSError, csv.Error, UnicodeDecodeError):
+        return os.path.basename(path), None
+    except Exception as e:
+        return os.path.basename(path), {"error": f"{type(e).__name__}: {e}"}
+
+
+class ReplayStats:
+    """Aggregate of conversation scores; fixed size however many are added"""
+
+    def __init__(self):
+        self.conversations = 0
+        self.unreadable = 0
+        self.failed = 0
+        self.deals = 0
+        self.price_total = 0.0
+        self.priced_deals = 0
+        self.rounds_to_close = {}
+        # Mean price relative to the side's first offer, per offer index
+        self.curve = {
+            side: [[0.0, 0] for _ in range(CURVE_POINTS)] for side in _SIDES
+        }
+
+    def add(self, score):
+        self.conversations += 1
+        if score is None:
+            self.unreadable += 1
+            return
+        if "error" in score:
+            self.failed += 1
+            return
+        if score["deal"]:
+            self.deals += 1
+            rounds = score["rounds"]
+            self.rounds_to_close[rounds] = self.rounds_to_close.get(rounds, 0) + 1
+            if score["final_price"] is not None:
+                self.price_total += score["final_price"]
+                self.priced_deals += 1
+        for side in _SIDES:
+            prices = score[side]
+            if prices and prices[0]:
+                for point, price in zip(self.curve[side], prices):
+                    point[0] += price / prices[0]
+                    point[1] += 1
+
+    def summary(self):
+        return {
+            "conversations": self.conversations,
+            "unreadable": self.unreadable,
+            "failed": self.failed,
+            "deals": self.deals,
+            "deal_rate": self.deals / self.conversations if self.conversations else 0.0,
+            "mean_final_price": (
+                self.price_total / self.priced_deals if self.priced_deals else None
+            ),
+            "rounds_to_close": dict(sorted(self.rounds_to_close.items())),
+            "concession_curve": {
+                side: [round(total / count, 4) for total, count in points if count]
+                for side, points in self.curve.items()
+            },
+        }
+
+
+class ReplayManifest:
+    """SQLite table of (file name, mtime, size, score) from earlier replays"""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                name TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                scan INTEGER NOT NULL,
+                score TEXT
+            )"""
+        )
+        (last_scan,) = self._db.execute("SELECT MAX(scan) FROM files").fetchone()
+        self.scan = (last_scan or 0) + 1
+
+    def changed(self, batch):
+        """Files of a scan batch that are new or differ from the manifest;
+        unchanged ones are marked as seen in this scan"""
+        known = {}
+        for start in range(0, len(batch), _LOOKUP_CHUNK):
+            names = [name for name, _, _ in batch[start : start + _LOOKUP_CHUNK]]
+            query = "SELECT name, mtime_ns, size FROM files WHERE name IN (%s)"
+            placeholders = ",".join("?" * len(names))
+            for name, mtime_ns, size in self._db.execute(query % placeholders, names):
+                known[name] = (mtime_ns, size)
+
+        stale = []
+        unchanged = []
+        for entry in batch:
+            if known.get(entry[0]) == entry[1:]:
+                unchanged.append((self.scan, entry[0]))
+            else:
+                stale.append(entry)
+        self._db.executemany("UPDATE files SET scan = ? WHERE name = ?", unchanged)
+        self._db.commit()
+        return stale
+
+    def record(self, rows):
+        """Store (name, mtime_ns, size, score) rows scored in this scan"""
+        self._db.executemany(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+            [
+                (name, mtime_ns, size, self.scan, json.dumps(score))
+                for name, mtime_ns, size, score in rows
+            ],
+        )
+        self._db.commit()
+
+    def finish(self):
+        """Forget files that were not seen in this scan (deleted)"""
+        removed = self._db.execute(
+            "DELETE FROM files WHERE scan != ?", (self.scan,)
+        ).rowcount
+        self._db.commit()
+        return removed
+
+    def scores(self):
+        for (score,) in self._db.execute("SELECT score FROM files"):
+            yield json.loads(score)
+
+    def close(self):
+        self._db.close()
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def replay(
+    directory=CONVERSATIONS_DIR, manifest=DEFAULT_MANIFEST, processes=None, full=False
+):
+    """Rescore new and changed conversations and aggregate every score
+
+    full=True ignores the manifest and rescores everything. Returns the
+    aggregate summary plus how many files were rescored and removed.
+    """
+    if full and os.path.exists(manifest):
+        os.remove(manifest)
+    store = ReplayManifest(manifest)
+    rescored = 0
+    try:
+        with Pool(processes) as pool:
+            for batch in _batches(iter_conversation_files(directory), SCAN_BATCH):
+                stale = store.changed(batch)
+                if not stale:
+                    continue
+                sizes = {name: (mtime_ns, size) for name, mtime_ns, size in stale}
+                scored = pool.imap_unordered(
+                    score_file,
+                    (os.path.join(directory, name) for name in sizes),
+                    chunksize=64,
+                )
+                store.record((name, *sizes[name], score) for name, score in scored)
+                rescored += len(stale)
+        removed = store.finish()
+
+        stats = ReplayStats()
+        for score in store.scores():
+            stats.add(score)
+    finally:
+        store.close()
+    return {**stats.summary(), "rescored": rescored, "removed": removed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay and re-score conversation logs"
+    )
+    parser.add_argument("directory", nargs="?", default=CONVERSATIONS_DIR)
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--full", action="store_true", help="ignore the manifest")
+    args = parser.parse_args()
+
+    result = replay(args.directory, args.manifest, args.processes, args.full)
+    print(
+        f"{result['conversations']} conversations "
+        f"({result['rescored']} rescored, {result['removed']} removed, "
+        f"{result['unreadable']} unreadable, {result['failed']} failed)"
+    )
+    print(f"Deal rate: {result['deal_rate']:.1%}")
+    if result["mean_final_price"] is not None:
+        print(f"Mean final price: ${result['mean_final_price']:.2f}")
+    print("Rounds to close:")
+    for rounds, count in result["rounds_to_close"].items():
+        print(f"  {rounds:>2}: {count}")
+    print("Concession curve (price / first offer):")
+    for side, curve in result["concession_curve"].items():
+        print(f"  {side:>6}: " + " ".join(f"{point:.3f}" for point in curve))
@@ -0,0 +1,230 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from instrumentation import current_tags
+from llm_backend import LLMBackend, DEFAULT_MODEL, count_tokens
+
+# Central admission control for model calls. Every call waits for a slot in two
+# token buckets, requests per minute and tokens per minute, sized to the
+# provider's limits, so sustained throughput sits just under them instead of
+# running into 429s. Waiting calls are admitted in priority order: interactive
+# sessions go ahead of batch work. Rate limits and transient failures are
+# retried with jittered exponential backoff, and a 429 pauses the whole
+# scheduler so every caller backs off together rather than piling on retries.
+
+INTERACTIVE = 0
+BATCH = 1
+
+# Assumed completion size when a call does not set max_tokens
+COMPLETION_ESTIMATE = 256
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError", "RateLimitError"}
+
+
+class TokenBucket:
+    """Refills `rate` units per minute up to `capacity`; not thread-safe on its
+    own, the scheduler serialises access"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate / 60.0
+        self.capacity = capacity if capacity is not None else rate
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` units are available"""
+        self._refill(now)
+        # A request larger than the bucket only waits for a full bucket
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount):
+        self.level -= amount
+
+    def give(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+def is_retryable(error):
+    """Rate limits, timeouts, connection errors and 5xx responses"""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in _RETRYABLE_STATUS
+    return type(error).__name__ in _RETRYABLE_ERRORS
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class CallScheduler:
+    """Token-bucket budgets plus a priority queue of waiting calls
+
+    rpm / tpm  requests and tokens per minute; None means unlimited
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self._waiting = []
+        self._order = itertools.count()
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        self.admitted = 0
+        self.waited = 0.0
+        self.throttles = 0
+
+    def acquire(self, tokens, priority=INTERACTIVE):
+        """Block until a call of about `tokens` tokens may start"""
+        began = time.monotonic()
+        ticket = (priority, next(self._order))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    wait = None
+                    if self._waiting[0] == ticket:
+                        wait = self._wait_time(tokens, time.monotonic())
+                        if wait <= 0:
+                            break
+                    self._cond.wait(wait)
+                if self.requests:
+                    self.requests.take(1)
+                if self.tokens:
+                    self.tokens.take(tokens)
+                self.admitted += 1
+                self.waited += time.monotonic() - began
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+    def _wait_time(self, tokens, now):
+        wait = self._paused_until - now
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def settle(self, estimated, used):
+        """Return the unused part of a token reservation"""
+        if self.tokens and used and estimated > used:
+            with self._cond:
+                self.tokens.give(estimated - used)
+                self._cond.notify_all()
+
+    def pause(self, seconds):
+        """Hold every caller back, e.g. after the provider returned a 429"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.throttles += 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                "admitted": self.admitted,
+                "waiting": len(self._waiting),
+                "mean_wait": self.waited / self.admitted if self.admitted else 0.0,
+                "throttles": self.throttles,
+            }
+
+
+class ScheduledBackend(LLMBackend):
+    """Admits every call through a CallScheduler and retries transient errors
+
+    A call's priority comes from the `priority` instrumentation tag
+    (INTERACTIVE unless tagged otherwise); the batch engine tags its sessions
+    BATCH.
+    """
+
+    def __init__(
+        self,
+        backend,
+        scheduler=None,
+        max_retries=5,
+        base_delay=0.5,
+        max_delay=30.0,
+    ):
+        self.backend = backend
+        self.scheduler = scheduler if scheduler is not None else CallScheduler()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def _estimate(self, messages, max_tokens):
+        prompt = sum(count_tokens(m["content"]) for m in messages)
+        return prompt + (max_tokens or COMPLETION_ESTIMATE)
+
+    def _backoff(self, attempt, error):
+        """Sleep before retry `attempt`, or re-raise once retries run out"""
+        if attempt >= self.max_retries or not is_retryable(error):
+            raise error
+        # Full jitter keeps retries from many sessions from lining up
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if getattr(error, "status_code", None) == 429 or retry_after is not None:
+            self.scheduler.pause(delay)
+        time.sleep(delay)
+
+    def complete(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150):
+        estimate = self._estimate(messages, max_tokens)
+        priority = current_tags().get("priority", INTERACTIVE)
+        for attempt in itertools.count():
+            self.scheduler.acquire(estimate, priority)
+            try:
+                completion = self.backend.complete(
+                    messages, model=model, temperature=temperature, max_tokens=max_tokens
+                )
+            except Exception as e:
+                self._backoff(attempt, e)
+                continue
+            self.scheduler.settle(
+                estimate, completion.prompt_tokens + completion.completion_tokens
+            )
+            return completion
+
+    def stream(self, messages, model=DEFAULT_MODEL, temperature=0.7, max_tokens=150):
+        estimate = self._estimate(messages, max_tokens)
+        priority = current_tags().get("priority", INTERACTIVE)
+        prompt_tokens = estimate - (max_tokens or COMPLETION_ESTIMATE)
+        for attempt in itertools.count():
+            self.scheduler.acquire(estimate, priority)
+            chunks = []
+            error = None
+            try:
+                for chunk in self.backend.stream(
+                    messages, model=model, temperature=temperature, max_tokens=max_tokens
+                ):
+                    chunks.append(chunk)
+                    yield chunk
+            except Exception as e:
+                # Once text has been handed out the turn cannot be replayed
+                if chunks:
+                    raise
+                error = e
+            finally:
+                if error is None:
+                    # Streams report no usage; settle with the prompt and the
+                    # text handed out, also when the caller closed the stream
+                    self.scheduler.settle(
+                        estimate, prompt_tokens + count_tokens("".join(chunks))
+                    )
+            if error is None:
+                return
+            self._backoff(attempt, error)
@@ -0,0 +1,161 @@
+from collections import deque
+from datetime import datetime
+from enum import IntEnum
+import sys
+import time
+
+# Compact per-session state for processes holding many live negotiations.
+# Messages are slotted records instead of dicts: sender and type are small
+# IntEnum members (shared singletons), prices are integer cents, and the
+# timestamp is a float that is only formatted when the row is written. The
+# conversation writers accept records wherever they accept message dicts and
+# buffer them as-is, so nothing larger is built until a row hits the file.
+# Transcripts are bounded deques, so a runaway session cannot grow without
+# limit.
+#
+# Budget: a finished 5-round session (11 messages) should cost at most
+# BYTES_PER_SESSION bytes of bookkeeping on top of its message text. Run this
+# module to measure it against the dict representation.
+
+BYTES_PER_SESSION = 2048
+
+# Most messages a transcript keeps; older ones are dropped
+MAX_TRANSCRIPT = 64
+
+
+class Sender(IntEnum):
+    BUYER = 0
+    SELLER = 1
+
+
+class MessageKind(IntEnum):
+    TEXT = 0
+    OFFER = 1
+    ACCEPTED = 2
+
+
+# CSV spellings, indexed by enum value
+SENDER_NAMES = ("buyer", "seller")
+KIND_NAMES = ("text", "offer", "accepted")
+_KINDS = {name: MessageKind(value) for value, name in enumerate(KIND_NAMES)}
+
+
+def kind_of(name):
+    """MessageKind for a conversation CSV `type` (see message_parser.log_type)"""
+    return _KINDS[name]
+
+
+def to_cents(price):
+    """Integer cents for a dollar amount; None (and 0) for no price"""
+    return round(price * 100) if price else None
+
+
+def from_cents(cents):
+    """Dollar amount for integer cents: an int when whole, else a float"""
+    if cents is None:
+        return None
+    return cents // 100 if cents % 100 == 0 else cents / 100
+
+
+class MessageRecord:
+    """One conversation message"""
+
+    __slots__ = ("at", "sender", "kind", "cents", "content")
+
+    def __init__(self, sender, content="", kind=MessageKind.TEXT, price=None, at=None):
+        self.at = time.time() if at is None else at
+        self.sender = sender
+        self.kind = kind
+        self.cents = to_cents(price)
+        self.content = content
+
+    @property
+    def price(self):
+        return from_cents(self.cents)
+
+    def row(self):
+        """CSV row in the conversation format's column order"""
+        return [
+            datetime.utcfromtimestamp(self.at).isoformat() + "Z",
+            self.content,
+            SENDER_NAMES[self.sender],
+            KIND_NAMES[self.kind],
+            "" if self.cents is None else from_cents(self.cents),
+        ]
+
+    def to_dict(self):
+        return {"sender": SENDER_NAMES[self.sender], "content": self.content}
+
+    def __repr__(self):
+        price = f", ${self.price}" if self.cents is not None else ""
+        return (
+            f"MessageRecord({SENDER_NAMES[self.sender]}, "
+            f"{KIND_NAMES[self.kind]}{price})"
+        )
+
+
+def transcript(max_messages=MAX_TRANSCRIPT):
+    """Empty bounded transcript"""
+    return deque(maxlen=max_messages)
+
+
+if __name__ == "__main__":
+    # Bookkeeping bytes per live session: the dicts the simulators used to
+    # keep (a transcript entry plus a buffered log row per message) against
+    # records in a bounded transcript that the writer buffers directly.
+    # Message text is shared between sessions so only overhead is counted.
+    import tracemalloc
+
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    texts = [
+        "Hey, is this still available? What's the condition like?",
+        "Still available! Works perfectly, barely used.",
+        "Would you take $850?",
+        "I could do $950, that's a fair price.",
+    ]
+    messages_per_session = 11
+
+    def dict_session(index):
+        transcript_, rows = [], []
+        for n in range(messages_per_session):
+            sender = SENDER_NAMES[n % 2]
+            price = 800 + index % 200 + n if n % 3 == 2 else None
+            transcript_.append({"sender": sender, "content": texts[n % 4]})
+            rows.append(
+                [
+                    datetime.utcnow().isoformat() + "Z",
+                    texts[n % 4],
+                    sender,
+                    "offer" if price else "text",
+                    price if price else "",
+                ]
+            )
+        return transcript_, rows
+
+    def record_session(index):
+        records = transcript()
+        for n in range(messages_per_session):
+            price = 800 + index % 200 + n if n % 3 == 2 else None
+            records.append(
+                MessageRecord(
+                    Sender(n % 2),
+                    texts[n % 4],
+                    MessageKind.OFFER if price else MessageKind.TEXT,
+                    price,
+                )
+            )
+        return records
+
+    print(f"{sessions} sessions x {messages_per_session} messages")
+    for label, build in (("dicts", dict_session), ("records", record_session)):
+        tracemalloc.start()
+        live = [build(index) for index in range(sessions)]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        per_session = size / sessions
+        verdict = "within" if per_session <= BYTES_PER_SESSION else "over"
+        print(
+            f"  {label:<8} {per_session:8.0f} bytes/session "
+            f"({verdict} the {BYTES_PER_SESSION} byte budget)"
+        )
+        del live
@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+
+# Background execution for speculative work. Verification and the opening buyer
+# turn do not depend on each other, so the simulators can start verification
+# here and produce the opening turn in the meantime; the opening is thrown
+# away if verification says NO. Work is submitted with a copy of the caller's
+# context so instrumentation tags follow it into the worker thread.
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="speculative")
+
+
+def speculate(fn, *args, **kwargs):
+    """Start fn(*args, **kwargs) in the background and return its Future"""
+    context = contextvars.copy_context()
+    return _executor.submit(context.run, fn, *args, **kwargs)
+
+
+if __name__ == "__main__":
+    # Wall-clock time per session with and without speculation, on the fake
+    # backend with a fixed per-call latency (seconds, first argument).
+    import asyncio
+    from contextlib import redirect_stdout
+    import io
+    import sys
+    import time
+
+    from llm_backend import FakeBackend, set_backend
+
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.2
+    sessions = 5
+    set_backend(FakeBackend(latency=latency))
+
+    from batch_negotiation import BatchNegotiationEngine
+    from multi_agent import marketplace_negotiation
+
+    product_details = {
+        "name": "Victorian Sofa",
+        "description": "1960s Vintage British Sofa",
+        "condition": "Excellent",
+        "price": 1000,
+        "category": "Furniture",
+    }
+
+    print(f"{sessions} sessions per mode, {latency}s per model call")
+    for label, speculative in (("sequential", False), ("speculative", True)):
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            for _ in range(sessions):
+                marketplace_negotiation(
+                    product_details, 900, 800, interactive=False, speculative=speculative
+                )
+        per_session = (time.perf_counter() - start) / sessions
+        print(f"  marketplace_negotiation {label:>11}: {per_session:.3f}s/session")
+
+    for label, speculative in (("sequential", False), ("speculative", True)):
+        # One session at a time with two call slots, so per-session latency
+        # is not inflated by queueing behind other sessions
+        engine = BatchNegotiationEngine(
+            concurrency=2, max_sessions=1, speculative=speculative
+        )
+        results = asyncio.run(engine.run([(product_details, 900, 800)] * sessions))
+        per_session = sum(r["latency"] for r in results) / sessions
+        print(f"  batch engine            {label:>11}: {per_session:.3f}s/session")
@@ -0,0 +1,81 @@
+import re
+import time
+
+from message_parser import ACCEPTED, classify_message
+
+# Streams a model turn token by token, timing the first token and the whole
+# turn, and optionally stops the generation as soon as the reply has agreed to
+# a deal.
+
+# The simulators' agents accept in free-form text ("Deal! $900 works"), so a
+# reply has agreed once the text up to a sentence end classifies as accepted
+# at a named price. Stopping before the price would lose the agreed amount, so
+# an acceptance without one lets the turn run on. Only the sentences after it
+# are left ungenerated.
+_SENTENCE_END = re.compile(r"[.!?](?=\s)|\n")
+
+
+def deal_end(text):
+    """Offset just past the first complete sentence by which text accepts a
+    deal at a price, or None"""
+    for match in _SENTENCE_END.finditer(text):
+        kind, price = classify_message(text[: match.end()])
+        if kind == ACCEPTED and price is not None:
+            return match.end()
+    return None
+
+
+def deal_reached(text):
+    """True once text has accepted a deal at a price in a complete sentence"""
+    return deal_end(text) is not None
+
+
+class TurnResult:
+    """Outcome of one streamed turn"""
+
+    def __init__(self, content, time_to_first_token, latency, aborted):
+        self.content = content
+        self.time_to_first_token = time_to_first_token
+        self.latency = latency
+        self.aborted = aborted
+
+    def __repr__(self):
+        return (
+            f"TurnResult(ttft={self.time_to_first_token:.3f}s, "
+            f"latency={self.latency:.3f}s, aborted={self.aborted})"
+        )
+
+
+def stream_turn(backend, messages, on_token=None, stop=None, **kwargs):
+    """Run one turn through backend.stream
+
+    on_token  called with every chunk as it arrives (e.g. to print it)
+    stop      predicate on the text so far; when it returns True the stream is
+              closed, which aborts the generation on the provider side
+    """
+    start = time.perf_counter()
+    first_token = None
+    chunks = []
+    aborted = False
+    stream = backend.stream(messages, **kwargs)
+    try:
+        for chunk in stream:
+            if not chunk:
+                continue
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            chunks.append(chunk)
+            if on_token:
+                on_token(chunk)
+            if stop and stop("".join(chunks)):
+                aborted = True
+                break
+    finally:
+        stream.close()
+    latency = time.perf_counter() - start
+    return TurnResult(
+        "".join(chunks),
+        first_token if first_token is not None else latency,
+        latency,
+        aborted,
+    )
@@ -0,0 +1,317 @@
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+import itertools
+import json
+import os
+import time
+
+from arbiter import NegotiationArbiter
+from batch_negotiation import BatchNegotiationEngine
+from conversation_log import get_writer, set_writer
+from llm_backend import get_backend, set_backend
+
+# Parameter sweeps over (product, buyer budget, seller minimum) grids. Each
+# cell of the grid is negotiated `repeats` times. Cells are handed out in
+# chunks to a process pool; every worker owns its backend (and so its HTTP
+# client) and runs its chunk through a BatchNegotiationEngine, so a sweep uses
+# processes x concurrency call slots. Finished cells are appended to a JSONL
+# checkpoint as they come back, and a re-run with the same checkpoint skips
+# them, so an interrupted sweep resumes where it stopped. The per-cell summary
+# is written column by column (one array per metric) to a .json path, ready
+# for a DataFrame, or as a row-per-cell CSV to any other path.
+#
+# Per-conversation CSV logging is safe across processes. With
+# CONVERSATION_LOG_FORMAT=segmented each worker writes its own store under
+# CONVERSATION_STORE_DIR/sweep-<pid>, since segments assume a single writer.
+
+SUMMARY_COLUMNS = (
+    "cell",
+    "product",
+    "buyer_budget",
+    "seller_min_price",
+    "sessions",
+    "deals",
+    "errors",
+    "deal_rate",
+    "mean_final_price",
+    "mean_rounds",
+    "mean_latency",
+    "max_latency",
+    "calls_saved",
+)
+
+
+def cell_key(product_details, buyer_budget, seller_min_price):
+    product = product_details.get("id", product_details["name"])
+    return f"{product}|{buyer_budget}|{seller_min_price}"
+
+
+def grid(products, budgets, minimums, repeats=1):
+    """Every (product, budget, minimum) cell of a sweep"""
+    return [
+        {
+            "cell": cell_key(product, budget, minimum),
+            "product_details": product,
+            "buyer_budget": budget,
+            "seller_min_price": minimum,
+            "repeats": repeats,
+        }
+        for product, budget, minimum in itertools.product(products, budgets, minimums)
+    ]
+
+
+def summarize_cell(cell, results):
+    """One summary row from a cell's session results"""
+    deals = [r for r in results if r["status"]]
+    errors = sum(r["message"].startswith("Negotiation error") for r in results)
+    latencies = [r.get("latency", 0.0) for r in results]
+    return {
+        "cell": cell["cell"],
+        "product": cell["product_details"]["name"],
+        "buyer_budget": cell["buyer_budget"],
+        "seller_min_price": cell["seller_min_price"],
+        "sessions": len(results),
+        "deals": len(deals),
+        "errors": errors,
+        "deal_rate": len(deals) / len(results) if results else 0.0,
+        "mean_final_price": (
+            sum(r["final_price"] for r in deals) / len(deals) if deals else None
+        ),
+        "mean_rounds": (
+            sum(r.get("rounds", 0) for r in results) / len(results) if results else 0.0
+        ),
+        "mean_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+        "max_latency": max(latencies, default=0.0),
+        "calls_saved": sum(r.get("calls_saved", 0) for r in results),
+    }
+
+
+_engine = None
+
+
+def _init_worker(concurrency, arbiter):
+    global _engine
+    # Forked workers inherit the parent's backend and log writer; build fresh
+    # ones so no client or file handle is shared between processes
+    set_backend(None)
+    if os.getenv("CONVERSATION_LOG_FORMAT", "csv") == "segmented":
+        from conversation_store import STORE_DIR, ConversationStore
+
+        durability = os.getenv("CONVERSATION_LOG_DURABILITY", "message")
+        set_writer(
+            ConversationStore(
+                os.path.join(STORE_DIR, f"sweep-{os.getpid()}"), durability=durability
+            )
+        )
+    else:
+        set_writer(None)
+    _engine = BatchNegotiationEngine(
+        backend=get_backend(),
+        concurrency=concurrency,
+        arbiter=NegotiationArbiter() if arbiter else None,
+    )
+
+
+def _run_cells(cells):
+    """Negotiate a chunk of cells in a worker and return their summary rows"""
+    jobs = [
+        (cell["product_details"], cell["buyer_budget"], cell["seller_min_price"])
+        for cell in cells
+        for _ in range(cell["repeats"])
+    ]
+    results = asyncio.run(_engine.run(jobs))
+    # Pool workers exit without running atexit hooks
+    get_writer().flush()
+
+    rows = []
+    offset = 0
+    for cell in cells:
+        rows.append(summarize_cell(cell, results[offset : offset + cell["repeats"]]))
+        offset += cell["repeats"]
+    return rows
+
+
+def load_checkpoint(path):
+    """Summary rows of the cells a previous run finished, by cell key"""
+    rows = {}
+    if path and os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line from an interrupted run; that cell reruns
+                    continue
+                rows[row["cell"]] = row
+    return rows
+
+
+def write_summary(rows, path):
+    """Columnar JSON for a .json path: {column: [value per cell]} over
+    SUMMARY_COLUMNS, in grid order. Any other path gets one CSV row per cell."""
+    if path.endswith(".json"):
+        columns = {
+            column: [row.get(column) for row in rows] for column in SUMMARY_COLUMNS
+        }
+        with open(path, "w") as f:
+            json.dump(columns, f)
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def totals(rows):
+    """Sweep-wide deal rate, mean final price, rounds and latency"""
+    sessions = sum(row["sessions"] for row in rows)
+    deals = sum(row["deals"] for row in rows)
+    if not sessions:
+        return {"sessions": 0, "deals": 0}
+    return {
+        "sessions": sessions,
+        "deals": deals,
+        "errors": sum(row["errors"] for row in rows),
+        "deal_rate": deals / sessions,
+        "mean_final_price": (
+            sum(row["mean_final_price"] * row["deals"] for row in rows if row["deals"])
+            / deals
+            if deals
+            else None
+        ),
+        "mean_rounds": sum(row["mean_rounds"] * row["sessions"] for row in rows)
+        / sessions,
+        "mean_latency": sum(row["mean_latency"] * row["sessions"] for row in rows)
+        / sessions,
+        "calls_saved": sum(row.get("calls_saved", 0) for row in rows),
+    }
+
+
+def run_sweep(
+    cells,
+    processes=None,
+    concurrency=16,
+    checkpoint=None,
+    summary=None,
+    chunk_sessions=None,
+    arbiter=False,
+):
+    """Run every unfinished cell across a process pool
+
+    chunk_sessions  sessions handed to a worker at a time (default
+                    concurrency * 4, enough to keep its call slots busy)
+    arbiter         settle determined outcomes with a NegotiationArbiter
+
+    Returns the summary rows of all cells, including ones restored from the
+    checkpoint, in grid order.
+    """
+    done = load_checkpoint(checkpoint)
+    pending = [cell for cell in cells if cell["cell"] not in done]
+    if done:
+        print(f"Resuming: {len(cells) - len(pending)} of {len(cells)} cells done")
+
+    chunk_sessions = chunk_sessions or concurrency * 4
+    chunks = []
+    chunk, size = [], 0
+    for cell in pending:
+        chunk.append(cell)
+        size += cell["repeats"]
+        if size >= chunk_sessions:
+            chunks.append(chunk)
+            chunk, size = [], 0
+    if chunk:
+        chunks.append(chunk)
+
+    start = time.perf_counter()
+    sessions = 0
+    log = open(checkpoint, "a") if checkpoint else None
+    try:
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_worker,
+            initargs=(concurrency, arbiter),
+        ) as pool:
+            futures = [pool.submit(_run_cells, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                for row in future.result():
+                    done[row["cell"]] = row
+                    sessions += row["sessions"]
+                    if log:
+                        log.write(json.dumps(row) + "\n")
+                if log:
+                    log.flush()
+                elapsed = time.perf_counter() - start
+                print(
+                    f"{len(done)}/{len(cells)} cells, {sessions} sessions "
+                    f"({sessions / elapsed:.1f}/s)"
+                )
+    finally:
+        if log:
+            log.close()
+
+    rows = [done[cell["cell"]] for cell in cells if cell["cell"] in done]
+    if summary:
+        write_summary(rows, summary)
+    return rows
+
+
+def _steps(spec):
+    """'700:1000:50' -> range(700, 1000, 50); '800' -> [800]"""
+    if ":" in spec:
+        return range(*(int(part) for part in spec.split(":")))
+    return [int(value) for value in spec.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep negotiation parameters")
+    parser.add_argument("--products", help="JSON file with a list of product_details")
+    parser.add_argument("--budgets", default="700:1000:50")
+    parser.add_argument("--minimums", default="700:950:50")
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--checkpoint", default="sweep_checkpoint.jsonl")
+    parser.add_argument(
+        "--summary", default="sweep_summary.json", help=".json columnar or .csv"
+    )
+    parser.add_argument("--arbiter", action="store_true")
+    args = parser.parse_args()
+
+    if args.products:
+        with open(args.products) as f:
+            products = json.load(f)
+    else:
+        products = [
+            {
+                "name": "Victorian Sofa",
+                "description": "1960s Vintage British Sofa",
+                "condition": "Excellent",
+                "price": 1000,
+                "category": "Furniture",
+            }
+        ]
+
+    cells = grid(
+        products, _steps(args.budgets), _steps(args.minimums), repeats=args.repeats
+    )
+    rows = run_sweep(
+        cells,
+        processes=args.processes,
+        concurrency=args.concurrency,
+        checkpoint=args.checkpoint,
+        summary=args.summary,
+        arbiter=args.arbiter,
+    )
+    overall = totals(rows)
+    print(f"\n{overall['sessions']} sessions over {len(rows)} cells")
+    if overall["sessions"]:
+        price = overall["mean_final_price"]
+        print(f"Deal rate: {overall['deal_rate']:.1%} ({overall['errors']} errors)")
+        print(f"Mean final price: {f'${price:.2f}' if price is not None else '-'}")
+        print(f"Mean rounds: {overall['mean_rounds']:.2f}")
+        print(f"Mean session latency: {overall['mean_latency']:.3f}s")
+        if args.arbiter:
+            print(f"Model calls saved by the arbiter: {overall['calls_saved']}")
+    print(f"Summary written to {args.summary}")
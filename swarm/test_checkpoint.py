@@ -0,0 +1,48 @@
+from checkpoint import SessionProgress, replay_log
+
+GREETINGS = [
+    {"sender": "buyer", "content": "Hello", "type": "text", "price": ""},
+    {"sender": "seller", "content": "Hello", "type": "text", "price": ""},
+]
+
+
+def _offer(price):
+    return {"sender": "buyer", "content": "", "type": "offer", "price": str(price)}
+
+
+def _accepted(sender, price):
+    return {"sender": sender, "content": "", "type": "accepted", "price": str(price)}
+
+
+def test_buyer_accepting_a_counter_closes_its_round():
+    # The arbiter's converged ruling logs the seller's counter, then the
+    # buyer's acceptance of it, both in round 1
+    messages = GREETINGS + [
+        _offer(900),
+        {
+            "sender": "seller",
+            "content": "COUNTER: $950 is my floor",
+            "type": "text",
+            "price": "",
+        },
+        _accepted("buyer", 950),
+    ]
+    result = replay_log(SessionProgress("c", resumed=True), messages, 5)
+    assert result["status"]
+    assert (result["final_price"], result["rounds"]) == (950, 1)
+
+
+def test_seller_accepting_an_offer_closes_its_round():
+    messages = GREETINGS + [
+        _offer(850),
+        {
+            "sender": "seller",
+            "content": "COUNTER: $950",
+            "type": "text",
+            "price": "",
+        },
+        _offer(920),
+        _accepted("seller", 920),
+    ]
+    result = replay_log(SessionProgress("c", resumed=True), messages, 5)
+    assert (result["final_price"], result["rounds"]) == (920, 2)
@@ -0,0 +1,76 @@
+import os
+
+from listing_store import ListingStore
+
+HEADER = "id,title,description,price,location,imageUrl,datePosted,sellerName\n"
+
+
+def _row(listing_id, price, city="Berkeley"):
+    return (
+        f'{listing_id},Lamp {listing_id},"Brass, working",{price},"{city}, CA",'
+        f"/lamp.jpg,2024-12-01,Sam\n"
+    )
+
+
+# Enough rows after listing 1 that an edit to it is far from the end of the file
+FILLER = "".join(_row(listing_id, "20") for listing_id in range(10, 20))
+
+
+def _write(path, text, mode="w"):
+    stat = os.stat(path) if os.path.exists(path) else None
+    with open(path, mode, newline="") as f:
+        f.write(text)
+    if stat is not None:
+        # A new mtime even on filesystems with coarse timestamps
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_edit_in_place_reloads(tmp_path):
+    path = tmp_path / "listings.csv"
+    _write(path, HEADER + _row(1, "299.99") + FILLER)
+    store = ListingStore(str(path))
+
+    _write(path, HEADER + _row(1, "199.99") + FILLER)
+    assert store.refresh() == 11
+    assert store.reloads == 2
+    assert store.get("1").price == 199.99
+    assert store.query(min_price=100, max_price=250) == [store.get("1")]
+
+
+def test_append_parses_only_new_rows(tmp_path):
+    path = tmp_path / "listings.csv"
+    _write(path, HEADER + _row(1, "299.99"))
+    store = ListingStore(str(path))
+
+    _write(path, _row(2, "50", city="Oakland"), mode="a")
+    assert store.refresh() == 1
+    assert (store.reloads, store.appends) == (1, 1)
+    assert [listing.id for listing in store.query(location="oakland")] == ["2"]
+    assert store.refresh() == 0
+
+
+def test_edit_and_append_reloads(tmp_path):
+    path = tmp_path / "listings.csv"
+    _write(path, HEADER + _row(1, "299.99") + FILLER)
+    store = ListingStore(str(path))
+
+    _write(path, HEADER + _row(1, "199.99") + FILLER + _row(2, "50"))
+    assert store.refresh() == 12
+    assert store.reloads == 2
+    assert store.get("1").price == 199.99
+    assert store.get("2").price == 50
+
+
+def test_unterminated_last_row(tmp_path):
+    path = tmp_path / "listings.csv"
+    _write(path, HEADER + _row(1, "299.99") + _row(2, "50").rstrip("\n"))
+    store = ListingStore(str(path))
+    assert len(store) == 2
+
+    # A row still being written is held back until a refresh finds the file
+    # unchanged
+    _write(path, "\n" + _row(3, "75").rstrip("\n"), mode="a")
+    assert store.refresh() == 0
+    assert store.get("3") is None
+    assert store.refresh() == 1
+    assert store.get("3").price == 75
@@ -0,0 +1,52 @@
+from message_parser import (
+    ACCEPTED,
+    COUNTER,
+    OFFER,
+    TEXT,
+    classify_batch,
+    classify_message,
+)
+
+
+def test_lowercase_that_changes_length():
+    # "İ".lower() is two characters long
+    assert classify_message("İİİİ $5") == (OFFER, 5)
+    assert classify_message("İstanbul pickup, ACCEPT at $40?") == (ACCEPTED, 40)
+
+
+def test_batch_keeps_tokens_with_their_message():
+    messages = [
+        "İİİİİİİİ nice item",
+        "COUNTER: $950 is my floor",
+        "Ça marche, deal at $900",
+        "ok",
+    ]
+    assert classify_batch(messages) == [
+        (TEXT, None),
+        (COUNTER, 950),
+        (ACCEPTED, 900),
+        (TEXT, None),
+    ]
+    assert classify_batch(messages) == [classify_message(m) for m in messages]
+
+
+def test_direct_scan_matches_batch():
+    messages = [
+        "I offer $850, or $900 if you deliver",
+        "  reject : $700 is too low",
+        "counter:$1,150.50",
+        "Accepted at $1.2K",
+        "I won't accept $500, my last offer is $600",
+        "No deal.",
+        "I accepts_ nothing for $12345,678",
+        "The dealer sold it for $ 75",
+        "Rejected. Still, $99.999 is close",
+        "deals are rejects",
+        "Note: I can pick it up Tuesday",
+        "$ sign only",
+        "",
+    ]
+    for last_price in (True, False):
+        assert classify_batch(messages, last_price) == [
+            classify_message(message, last_price) for message in messages
+        ]
@@ -0,0 +1,24 @@
+from llm_backend import FakeBackend
+from streaming import deal_end, deal_reached, stream_turn
+
+
+def test_stops_once_a_deal_is_agreed():
+    backend = FakeBackend(
+        script=["Deal! I can do $900. Pick it up tomorrow after 5pm?"]
+    )
+    turn = stream_turn(backend, [{"role": "user", "content": "$900?"}])
+    assert not turn.aborted
+
+    backend.script.append(turn.content)
+    turn = stream_turn(
+        backend, [{"role": "user", "content": "$900?"}], stop=deal_reached
+    )
+    assert turn.aborted
+    assert turn.content[: deal_end(turn.content)].rstrip() == "Deal! I can do $900."
+
+
+def test_deal_needs_a_price_and_no_negation():
+    # Stopping at "Deal!" would lose the amount that follows
+    assert deal_end("Deal! ") is None
+    assert deal_end("No deal at $900. Try $1,000. ") is None
+    assert deal_end("Sounds good, $1,150.50 works, deal\nsee you") == 35